@@ -0,0 +1,89 @@
+import logging
+from typing import Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class IVFIndex:
+    def __init__(self, centroids: np.ndarray):
+        """
+        Inverted-file (IVF) coarse quantizer for approximate nearest-neighbour search
+
+        Vectors are bucketed by their nearest centroid; a query only scans the
+        buckets of its `nprobe` closest centroids. Centroids are trained with
+        spherical k-means, so they assume L2-normalized vectors.
+        """
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.nlist = len(self.centroids)
+
+    @classmethod
+    def train(cls,
+              matrix: np.ndarray,
+              nlist: int,
+              iterations: int = 10,
+              sample_size: Optional[int] = None,
+              seed: int = 0) -> "IVFIndex":
+        """
+        Train centroids on (a sample of) the normalized embedding matrix
+        """
+        rng = np.random.default_rng(seed)
+        nlist = max(1, min(nlist, len(matrix)))
+        sample = matrix
+        if sample_size and len(matrix) > sample_size:
+            sample = matrix[rng.choice(len(matrix), sample_size, replace=False)]
+
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=nlist)
+            empty = counts == 0
+            # centroid ที่ไม่มีสมาชิก ให้สุ่มจุดใหม่แทน
+            if empty.any():
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        logger.info(f"Trained IVF index with {nlist} lists on {len(sample)} vectors")
+        return cls(centroids)
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Nearest centroid for each vector
+        """
+        if not len(vectors):
+            return np.zeros(0, dtype=np.int32)
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def probe(self, query_embedding: np.ndarray, nprobe: int) -> np.ndarray:
+        """
+        Ids of the `nprobe` lists whose centroids are closest to the query
+        """
+        nprobe = max(1, min(nprobe, self.nlist))
+        scores = self.centroids @ query_embedding
+        if nprobe == self.nlist:
+            return np.arange(self.nlist)
+        return np.argpartition(-scores, nprobe - 1)[:nprobe]
+
+
+def build_inverted_lists(assignments: np.ndarray, nlist: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Group row ids by list: rows of list c are order[offsets[c]:offsets[c + 1]]
+    """
+    order = np.argsort(assignments, kind="stable")
+    offsets = np.zeros(nlist + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignments, minlength=nlist), out=offsets[1:])
+    return order, offsets
+
+
+def gather_candidates(order: np.ndarray, offsets: np.ndarray, lists: np.ndarray) -> np.ndarray:
+    """
+    Row ids belonging to the given lists, in ascending row order
+    """
+    if not len(lists):
+        return np.zeros(0, dtype=np.int64)
+    rows = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in lists])
+    rows.sort()
+    return rows
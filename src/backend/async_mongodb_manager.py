@@ -0,0 +1,158 @@
+import logging
+from typing import Dict, List, Any, Optional, Tuple
+import pandas as pd
+from pymongo import DESCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from config import MONGODB_URL, MONGODB_DB
+from mongodb_manager import (
+    CHAT_ROOM_FIELDS, CHAT_ROOM_SUMMARY_FIELDS, USER_FIELDS, PROPERTY_FIELDS, RESERVE_OPTIONS, BUCKET_FIELDS,
+    ChatRoomsWrite, HistoryPage, client_options, reserve_filter, reserve_update, history_page, user_upsert
+)
+
+logger = logging.getLogger(__name__)
+
+class AsyncMongoDBManager:
+    def __init__(self):
+        """
+        asyncio counterpart of MongoDBManager built on motor
+
+        Exposes the request-path methods of MongoDBManager with the same
+        names, arguments and return values, as coroutines, so handlers can
+        await MongoDB without holding an I/O executor thread. The query
+        shapes and the chat write / history paging logic (ChatRoomsWrite,
+        HistoryPage) are shared with MongoDBManager, so only the awaited I/O
+        lives here. Index creation, legacy chat room migration and
+        ingestion stay on the synchronous manager. Create the instance inside
+        the event loop that will use it (after fork, in a startup hook).
+        """
+        try:
+            from motor.motor_asyncio import AsyncIOMotorClient
+        except ImportError as e:
+            raise ImportError("MONGODB_DRIVER=motor needs the motor package (pip install motor)") from e
+        self.client = AsyncIOMotorClient(MONGODB_URL, **client_options())
+        self.db = self.client[MONGODB_DB]
+        self.properties = self.db["properties"]
+        self.sessions = self.db["sessions"]
+        self.users = self.db["users"]
+        self.chat_rooms = self.db["chat_rooms"]
+        self.chat_messages = self.db["chat_messages"]
+        logger.info(f"Connected to MongoDB at {MONGODB_URL} (motor)")
+
+    async def delete_properties(self, file_id: str) -> int:
+        result = await self.properties.delete_many({"file_id": file_id})
+        return result.deleted_count
+
+    async def get_properties(self, query: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        return await self.properties.find(query or {}, PROPERTY_FIELDS).to_list(length=None)
+
+    async def create_session(self, session_id: str, user_id: Optional[str] = None) -> str:
+        await self.sessions.insert_one({
+            "session_id": session_id,
+            "user_id": user_id,
+            "created_at": pd.Timestamp.now(),
+            "messages": []
+        })
+        return session_id
+
+    async def add_message(self, session_id: str, message: Dict[str, Any]) -> bool:
+        result = await self.sessions.update_one({"session_id": session_id}, {"$push": {"messages": message}})
+        return result.modified_count > 0
+
+    async def add_session_messages(self, messages: Dict[str, List[Dict[str, Any]]]) -> int:
+        operations = [
+            UpdateOne({"session_id": session_id}, {"$push": {"messages": {"$each": items}}})
+            for session_id, items in messages.items() if items
+        ]
+        if not operations:
+            return 0
+        result = await self.sessions.bulk_write(operations, ordered=False)
+        return result.modified_count
+
+    async def get_session(self, session_id: str) -> Dict[str, Any]:
+        return await self.sessions.find_one({"session_id": session_id}, {"_id": 0})
+
+    async def save_chat_room(self, chat_room_id: str, messages: List[Dict[str, Any]], user_id: Optional[str] = None) -> bool:
+        return (await self.save_chat_rooms({chat_room_id: (messages, user_id)}))[chat_room_id]
+
+    async def save_chat_rooms(self,
+                              rooms: Dict[str, Tuple[List[Dict[str, Any]], Optional[str]]],
+                              reserved: Optional[Dict[str, List[int]]] = None) -> Dict[str, bool]:
+        write = ChatRoomsWrite(rooms, reserved)
+        for chat_room_id, (_, user_id) in rooms.items():
+            messages = write.unreserved(chat_room_id)
+            try:
+                # ห้องแชทรูปแบบเดิมที่ยังไม่ถูกย้ายจะได้ DuplicateKeyError (MongoDBManager ย้ายให้ตอนเริ่มระบบ)
+                write.reserved(chat_room_id, await self.chat_rooms.find_one_and_update(
+                    reserve_filter(chat_room_id), reserve_update(messages, user_id), **RESERVE_OPTIONS) if messages is not None else None)
+            except Exception as e:
+                write.failed(chat_room_id, e)
+        if not write.operations:
+            return write.results
+
+        try:
+            await self.chat_messages.bulk_write(write.operations, ordered=False)
+        except Exception as e:
+            return write.written(e)
+        return write.written()
+
+    async def get_chat_room(self, chat_room_id: str) -> Dict[str, Any]:
+        try:
+            return await self.chat_rooms.find_one({"chat_room_id": chat_room_id}, CHAT_ROOM_FIELDS)
+        except Exception as e:
+            logger.error(f"Error retrieving chat room: {str(e)}")
+            return None
+
+    async def get_chat_messages(self, chat_room_id: str, before: Optional[int] = None, limit: Optional[int] = None) -> Dict[str, Any]:
+        page = HistoryPage(chat_room_id, before, limit)
+        try:
+            async for bucket in self.chat_messages.find(page.query, BUCKET_FIELDS).sort("bucket", DESCENDING):
+                if page.add(bucket):
+                    break
+            return page.result()
+        except Exception as e:
+            logger.error(f"Error retrieving chat messages: {str(e)}")
+            return history_page([])
+
+    async def get_user_chat_rooms(self, user_id: str) -> List[Dict[str, Any]]:
+        try:
+            cursor = self.chat_rooms.find({"user_id": user_id}, CHAT_ROOM_SUMMARY_FIELDS).sort("updated_at", DESCENDING)
+            return await cursor.to_list(length=None)
+        except Exception as e:
+            logger.error(f"Error retrieving user chat rooms: {str(e)}")
+            return []
+
+    async def save_user(self, user_data: Dict[str, Any]) -> bool:
+        try:
+            result = await self.users.update_one({"id": user_data["id"]}, user_upsert(user_data), upsert=True)
+            return result.upserted_id is not None or result.modified_count > 0
+        except DuplicateKeyError as e:
+            logger.warning(f"User {user_data.get('id')} conflicts with an existing user: {str(e)}")
+            return False
+        except Exception as e:
+            logger.error(f"Error saving user: {str(e)}")
+            return False
+
+    async def get_user(self, user_id: str) -> Dict[str, Any]:
+        try:
+            return await self.users.find_one({"id": user_id}, USER_FIELDS)
+        except Exception as e:
+            logger.error(f"Error retrieving user: {str(e)}")
+            return None
+
+    async def get_user_by_email(self, email: str) -> Dict[str, Any]:
+        try:
+            return await self.users.find_one({"email": email}, USER_FIELDS)
+        except Exception as e:
+            logger.error(f"Error retrieving user by email: {str(e)}")
+            return None
+
+    async def ping(self) -> bool:
+        try:
+            await self.client.admin.command("ping")
+            return True
+        except Exception as e:
+            logger.error(f"MongoDB ping failed: {str(e)}")
+            return False
+
+    def close(self):
+        self.client.close()
@@ -0,0 +1,121 @@
+"""
+Compare generator execution modes (fp32 / bf16 / int8) on a fixed Thai prompt set
+
+    python benchmark_generator.py --modes none int8 bf16 --max-new-tokens 64
+
+The first mode is the reference. For every mode the script reports load
+time, model memory, latency and tokens/sec of greedy decoding, plus two
+accuracy measures against the reference outputs: how many leading tokens
+match, and the mean negative log-likelihood the model assigns to the
+reference continuation (lower is better; equal to the reference's own NLL
+when nothing changed).
+"""
+import argparse
+import json
+import time
+from typing import Any, Dict, List, Tuple
+import torch
+from language_models import LanguageModelManager
+
+SAMPLE_PROPERTIES = [
+    {"ประเภท": "คอนโด", "โครงการ": "ไลฟ์ อโศก", "ราคา": 4500000, "รูปแบบ": "1 ห้องนอน",
+     "สถานศึกษา": "ไม่มี", "สถานีรถไฟฟ้า": "MRT เพชรบุรี", "ห้างสรรพสินค้า": "เทอร์มินอล 21"},
+    {"ประเภท": "บ้านเดี่ยว", "โครงการ": "เศรษฐสิริ บางนา", "ราคา": 8900000, "รูปแบบ": "3 ห้องนอน",
+     "สถานศึกษา": "มหาวิทยาลัยอัสสัมชัญ", "สถานีรถไฟฟ้า": "ไม่มี", "ห้างสรรพสินค้า": "เมกา บางนา"},
+    {"ประเภท": "ทาวน์โฮม", "โครงการ": "พฤกษา วิลล์ รังสิต", "ราคา": 2500000, "รูปแบบ": "2 ห้องนอน",
+     "สถานศึกษา": "มหาวิทยาลัยธรรมศาสตร์ ศูนย์รังสิต", "สถานีรถไฟฟ้า": "ไม่มี", "ห้างสรรพสินค้า": "ฟิวเจอร์พาร์ค รังสิต"},
+]
+
+# (คำถาม, ลำดับ property ที่พบ, รูปแบบการตอบ)
+PROMPT_SET = [
+    ("หาคอนโดใกล้รถไฟฟ้าแถวอโศก งบไม่เกิน 5 ล้าน", [0], "formal"),
+    ("อยากได้บ้านเดี่ยวสำหรับครอบครัว แถวบางนา", [1], "friendly"),
+    ("ทาวน์โฮมราคาถูกใกล้มหาวิทยาลัยมีไหม", [2], "casual"),
+    ("แนะนำที่อยู่อาศัยใกล้ห้างหน่อย", [0, 1, 2], "professional"),
+    ("คอนโด 1 ห้องนอนสำหรับคนทำงาน", [0], "casual"),
+    ("บ้านราคาไม่เกิน 3 ล้านแถวรังสิต", [2], "formal"),
+    ("มีคอนโดติดทะเลที่ภูเก็ตไหม", [], "friendly"),
+    ("เปรียบเทียบบ้านเดี่ยวกับทาวน์โฮมให้หน่อย", [1, 2], "professional"),
+]
+
+def run_mode(mode: str, max_new_tokens: int, reference: List[List[int]] = None) -> Tuple[Dict[str, Any], List[List[int]]]:
+    manager = LanguageModelManager(quantization=mode)
+    manager.load()
+    tokenizer, model = manager.tokenizer, manager.model
+    latencies = []
+    new_tokens = 0
+    outputs = []
+    agreement = []
+    nll = []
+    try:
+        for query, indices, style in PROMPT_SET:
+            prompt = manager._build_prompt(query, [SAMPLE_PROPERTIES[i] for i in indices], style)
+            inputs = tokenizer(prompt, return_tensors="pt", max_length=512, truncation=True)
+            prompt_length = inputs["input_ids"].shape[-1]
+            started = time.perf_counter()
+            with torch.inference_mode():
+                generated = model.generate(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    do_sample=False,
+                    num_beams=1,
+                    pad_token_id=tokenizer.pad_token_id
+                )
+            latencies.append(time.perf_counter() - started)
+            tokens = generated[0, prompt_length:].tolist()
+            new_tokens += len(tokens)
+            outputs.append(tokens)
+
+            if reference is not None:
+                ref = reference[len(outputs) - 1]
+                matched = next((i for i, (a, b) in enumerate(zip(tokens, ref)) if a != b), min(len(tokens), len(ref)))
+                agreement.append(matched / max(len(ref), 1))
+            ref_tokens = reference[len(outputs) - 1] if reference is not None else tokens
+            nll.append(_continuation_nll(model, inputs["input_ids"], ref_tokens))
+    finally:
+        result = {
+            "mode": manager.quantization,
+            "load_seconds": manager.load_seconds,
+            "memory_mb": manager.memory_bytes / 2**20,
+            "mean_latency_seconds": sum(latencies) / len(latencies) if latencies else None,
+            "tokens_per_second": new_tokens / sum(latencies) if latencies else None,
+            "prefix_agreement": sum(agreement) / len(agreement) if agreement else 1.0,
+            "reference_nll": sum(nll) / len(nll) if nll else None
+        }
+        manager.shutdown()
+    return result, outputs
+
+def _continuation_nll(model, prompt_ids: torch.Tensor, continuation: List[int]) -> float:
+    if not continuation:
+        return 0.0
+    ids = torch.cat([prompt_ids, torch.tensor([continuation], dtype=torch.long)], dim=1)
+    with torch.inference_mode():
+        logits = model(input_ids=ids).logits[0, prompt_ids.shape[-1] - 1:-1].float()
+    return float(torch.nn.functional.cross_entropy(logits, torch.tensor(continuation)))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["none", "int8", "bf16"])
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    results = []
+    reference = None
+    for mode in args.modes:
+        result, outputs = run_mode(mode, args.max_new_tokens, reference)
+        if reference is None:
+            reference = outputs
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False))
+
+    base = results[0]
+    for result in results[1:]:
+        print("{} vs {}: memory x{:.2f}, tokens/sec x{:.2f}, prefix agreement {:.1%}, NLL {:+.3f}".format(
+            result["mode"], base["mode"],
+            result["memory_mb"] / base["memory_mb"],
+            result["tokens_per_second"] / base["tokens_per_second"],
+            result["prefix_agreement"],
+            result["reference_nll"] - base["reference_nll"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Compare the pymongo (thread pool) and motor (asyncio) MongoDB managers under concurrent chat load
+
+    python benchmark_mongodb.py --concurrency 10 50 200 --turns 20
+
+Every simulated user owns a chat room and runs `turns` chat turns. Each
+turn fetches the latest page of history, saves a user/assistant message
+pair and looks up the user by email, which are the request-path calls an
+/api/chat turn makes. The pymongo manager runs on a thread pool of
+IO_WORKERS threads, like the io executor in main.py. The motor manager is
+awaited directly. For each driver and concurrency level the script
+reports turns/sec and p50/p95 turn latency.
+
+Needs a reachable mongod at MONGODB_URL (pool size, timeouts and
+compression come from MONGODB_CLIENT_CONFIG) and the motor package.
+Benchmark documents are removed afterwards.
+"""
+import argparse
+import asyncio
+import json
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+from config import EXECUTOR_CONFIG
+from mongodb_manager import MongoDBManager
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+def _turn_messages(user: int, turn: int) -> List[Dict[str, Any]]:
+    now = int(time.time() * 1000)
+    return [
+        {"role": "user", "content": f"หาคอนโดใกล้รถไฟฟ้า งบ {turn} ล้าน", "timestamp": now},
+        {"role": "assistant", "content": f"แนะนำโครงการสำหรับผู้ใช้ {user} รอบที่ {turn}", "timestamp": now}
+    ]
+
+async def _run_sync(manager: MongoDBManager, prefix: str, concurrency: int, turns: int) -> List[float]:
+    loop = asyncio.get_running_loop()
+    pool = ThreadPoolExecutor(max_workers=EXECUTOR_CONFIG['io_workers'])
+    latencies = []
+
+    async def user(index: int) -> None:
+        room, email = f"{prefix}_{index}", f"{prefix}_{index}@example.com"
+        for turn in range(turns):
+            started = time.perf_counter()
+            await loop.run_in_executor(pool, manager.get_chat_messages, room, None, 20)
+            await loop.run_in_executor(pool, manager.save_chat_room, room, _turn_messages(index, turn), None)
+            await loop.run_in_executor(pool, manager.get_user_by_email, email)
+            latencies.append(time.perf_counter() - started)
+
+    try:
+        await asyncio.gather(*(user(i) for i in range(concurrency)))
+    finally:
+        pool.shutdown(wait=True)
+    return latencies
+
+async def _run_async(manager, prefix: str, concurrency: int, turns: int) -> List[float]:
+    latencies = []
+
+    async def user(index: int) -> None:
+        room, email = f"{prefix}_{index}", f"{prefix}_{index}@example.com"
+        for turn in range(turns):
+            started = time.perf_counter()
+            await manager.get_chat_messages(room, None, 20)
+            await manager.save_chat_room(room, _turn_messages(index, turn), None)
+            await manager.get_user_by_email(email)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+    return latencies
+
+async def run(concurrency_levels: List[int], turns: int) -> List[Dict[str, Any]]:
+    from async_mongodb_manager import AsyncMongoDBManager
+    sync_manager = MongoDBManager()
+    sync_manager.ensure_indexes()
+    async_manager = AsyncMongoDBManager()
+    prefix = f"bench_{secrets.token_hex(4)}"
+    results = []
+    try:
+        for concurrency in concurrency_levels:
+            for driver in ("pymongo", "motor"):
+                run_prefix = f"{prefix}_{driver}_{concurrency}"
+                started = time.perf_counter()
+                if driver == "pymongo":
+                    latencies = await _run_sync(sync_manager, run_prefix, concurrency, turns)
+                else:
+                    latencies = await _run_async(async_manager, run_prefix, concurrency, turns)
+                wall = time.perf_counter() - started
+                result = {
+                    "driver": driver,
+                    "concurrency": concurrency,
+                    "turns": len(latencies),
+                    "turns_per_second": len(latencies) / wall if wall > 0 else None,
+                    "p50_ms": _percentile(latencies, 0.50) * 1000,
+                    "p95_ms": _percentile(latencies, 0.95) * 1000
+                }
+                results.append(result)
+                print(json.dumps(result, ensure_ascii=False))
+    finally:
+        pattern = {"$regex": f"^{prefix}_"}
+        sync_manager.chat_rooms.delete_many({"chat_room_id": pattern})
+        sync_manager.chat_messages.delete_many({"chat_room_id": pattern})
+        sync_manager.close()
+        async_manager.close()
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.concurrency, args.turns))
+    for concurrency in args.concurrency:
+        by_driver = {r["driver"]: r for r in results if r["concurrency"] == concurrency}
+        base, other = by_driver["pymongo"], by_driver["motor"]
+        print("concurrency {}: motor vs pymongo turns/sec x{:.2f}, p95 {:.1f}ms vs {:.1f}ms".format(
+            concurrency,
+            other["turns_per_second"] / base["turns_per_second"],
+            other["p95_ms"], base["p95_ms"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# ack = รอจนข้อความถูกเขียนลง MongoDB แล้วจึงตอบ (group commit), async = ตอบทันทีแล้วเขียนใน background
+WRITE_MODES = ("ack", "async")
+
+class ChatWriteBuffer:
+    def __init__(self,
+                 mongodb_manager,
+                 mode: str = "async",
+                 max_batch_messages: int = 200,
+                 flush_interval: float = 0.05,
+                 max_pending_messages: int = 10000,
+                 retry_delay: float = 1.0,
+                 ack_timeout: float = 5.0,
+                 fallback_path: Optional[str] = None):
+        """
+        Write-behind buffer for chat and session messages
+
+        Messages are queued in process and written by one background thread.
+        Everything queued for the same room is coalesced, and each flush
+        writes all rooms through MongoDBManager.save_chat_rooms (one bulk
+        write for the message buckets) and all sessions through one
+        add_session_messages bulk write. A flush happens when
+        max_batch_messages are pending or flush_interval seconds after the
+        oldest pending message.
+
+        In "ack" mode save_chat_room() blocks until its batch is written (at
+        most ack_timeout seconds, after which it reports failure while the
+        messages stay queued) and returns the real result. Concurrent turns
+        still share one flush, like a group commit. In "async" mode it
+        returns as soon as the messages are queued. A failed flush is retried
+        every retry_delay seconds with the seq numbers it already reserved, so
+        a retry neither leaves gaps nor stores a message twice. close() drains
+        the queue on graceful shutdown. Anything that still cannot be written
+        is appended to fallback_path as JSON lines, and replay() queues it
+        again on the next start.
+        """
+        if mode not in WRITE_MODES:
+            raise ValueError(f"Unknown chat write mode {mode!r}, expected one of {WRITE_MODES}")
+        self.mongodb_manager = mongodb_manager
+        self.mode = mode
+        self.max_batch_messages = max_batch_messages
+        self.flush_interval = flush_interval
+        self.max_pending_messages = max_pending_messages
+        self.retry_delay = retry_delay
+        self.ack_timeout = ack_timeout
+        self.fallback_path = fallback_path
+        self._reset_state()
+
+    def _reset_state(self) -> None:
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        # chat_room_id -> {"messages", "user_id", "futures", "seqs"} ตามลำดับที่เข้ามา
+        # seqs = เลขลำดับที่จองไว้แล้วสำหรับข้อความต้นรายการ (จาก flush ที่ล้มเหลว)
+        self._rooms: Dict[str, Dict[str, Any]] = {}
+        self._sessions: Dict[str, List[Dict[str, Any]]] = {}
+        self._pending = 0
+        self._oldest: Optional[float] = None
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self.flushes = 0
+        self.messages_written = 0
+        self.failed_flushes = 0
+        self.last_flush_seconds: Optional[float] = None
+
+    def after_fork(self) -> None:
+        """
+        Start from an empty queue in a forked worker (locks and threads do not survive fork)
+        """
+        self._reset_state()
+
+    def submit_chat_room(self, chat_room_id: str, messages: List[Dict[str, Any]], user_id: Optional[str] = None) -> Future:
+        """
+        Queue messages for a chat room; the future resolves to True/False once they are written
+        """
+        return self._submit_room(chat_room_id, messages, user_id)
+
+    def _submit_room(self,
+                     chat_room_id: str,
+                     messages: List[Dict[str, Any]],
+                     user_id: Optional[str],
+                     seqs: Optional[List[int]] = None) -> Future:
+        future: Future = Future()
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._wait_for_space(len(messages))
+                room = self._rooms.setdefault(chat_room_id, {"messages": [], "user_id": None, "futures": [], "seqs": []})
+                if seqs and len(room["seqs"]) < len(room["messages"]):
+                    # seq ที่จองไว้ต้องเป็นของข้อความต้นรายการ: มีข้อความที่ยังไม่จองอยู่ก่อนแล้ว จึงต้องจองใหม่
+                    logger.warning(f"Re-reserving seqs of {len(seqs)} replayed messages of chat room {chat_room_id}")
+                    seqs = None
+                room["messages"].extend(messages)
+                room["seqs"].extend(seqs or [])
+                room["user_id"] = room["user_id"] or user_id
+                room["futures"].append(future)
+                self._added(len(messages))
+        if closed:
+            # หลังปิดแล้ว (ระหว่าง shutdown) เขียนตรงแทน
+            future.set_result(self.mongodb_manager.save_chat_rooms(
+                {chat_room_id: (messages, user_id)}, {chat_room_id: list(seqs)} if seqs else None)[chat_room_id])
+        return future
+
+    def save_chat_room(self, chat_room_id: str, messages: List[Dict[str, Any]], user_id: Optional[str] = None) -> bool:
+        """
+        Drop-in replacement for MongoDBManager.save_chat_room that goes through the buffer
+        """
+        future = self.submit_chat_room(chat_room_id, messages, user_id)
+        if self.mode == "ack":
+            try:
+                return future.result(timeout=self.ack_timeout)
+            except FutureTimeoutError:
+                logger.error(f"Chat messages for {chat_room_id} not written within {self.ack_timeout}s")
+                return False
+        return True
+
+    def add_session_message(self, session_id: str, message: Dict[str, Any]) -> None:
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._wait_for_space(1)
+                self._sessions.setdefault(session_id, []).append(message)
+                self._added(1)
+        if closed:
+            self.mongodb_manager.add_message(session_id, message)
+
+    def _wait_for_space(self, count: int) -> None:
+        # backpressure: ถ้าคิวเต็ม ผู้เขียนต้องรอ flush แทนการใช้หน่วยความจำไม่จำกัด
+        while self._pending and self._pending + count > self.max_pending_messages:
+            self._not_full.wait()
+
+    def _added(self, count: int) -> None:
+        self._pending += count
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="chat-write-buffer", daemon=True)
+            self._thread.start()
+        self._not_empty.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                while not self._pending and not self._closed:
+                    self._not_empty.wait()
+                if not self._pending and self._closed:
+                    return
+                # รอให้ครบ batch หรือครบเวลา flush_interval นับจากข้อความแรกที่ค้างอยู่
+                while not self._closed and self._pending < self.max_batch_messages:
+                    remaining = self._oldest + self.flush_interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._not_empty.wait(remaining)
+                rooms, sessions = self._take_locked()
+            if not self._flush(rooms, sessions):
+                with self._lock:
+                    closed = self._closed
+                if closed:
+                    # close() อาจเลิกรอ thread นี้แล้ว: บันทึกลงไฟล์แทนการใส่คืนคิวที่ไม่มีใครเขียนต่อ
+                    self._spill(rooms, sessions)
+                    return
+                self._requeue(rooms, sessions)
+                time.sleep(self.retry_delay)
+
+    def _take_locked(self):
+        rooms, sessions = self._rooms, self._sessions
+        self._rooms, self._sessions = {}, {}
+        self._pending = 0
+        self._oldest = None
+        self._not_full.notify_all()
+        return rooms, sessions
+
+    def _flush(self, rooms: Dict[str, Dict[str, Any]], sessions: Dict[str, List[Dict[str, Any]]]) -> bool:
+        """
+        Write one batch; False when it should be retried
+        """
+        started = time.perf_counter()
+        # seq ที่รอบก่อนจองไว้แล้วใช้ซ้ำ (save_chat_rooms เติม seq ที่จองใหม่ลงใน dict นี้)
+        reserved = {chat_room_id: room["seqs"] for chat_room_id, room in rooms.items() if room["seqs"]}
+        try:
+            if sessions:
+                self.mongodb_manager.add_session_messages(sessions)
+                sessions.clear()
+            results = self.mongodb_manager.save_chat_rooms(
+                {chat_room_id: (room["messages"], room["user_id"]) for chat_room_id, room in rooms.items()},
+                reserved
+            ) if rooms else {}
+        except Exception as e:
+            logger.error(f"Error flushing chat writes: {str(e)}")
+            self.failed_flushes += 1
+            return False
+        finally:
+            for chat_room_id, seqs in reserved.items():
+                rooms[chat_room_id]["seqs"] = seqs
+
+        # ห้องที่เขียนสำเร็จตอบ future ได้เลย ห้องที่ล้มเหลวจะถูกใส่คืนคิวเพื่อลองใหม่
+        for chat_room_id in [room_id for room_id, ok in results.items() if ok]:
+            room = rooms.pop(chat_room_id)
+            self.messages_written += len(room["messages"])
+            for future in room["futures"]:
+                future.set_result(True)
+        self.flushes += 1
+        self.last_flush_seconds = time.perf_counter() - started
+        if rooms:
+            self.failed_flushes += 1
+            return False
+        return True
+
+    def _requeue(self, rooms: Dict[str, Dict[str, Any]], sessions: Dict[str, List[Dict[str, Any]]]) -> None:
+        with self._lock:
+            # ข้อความที่ยังเขียนไม่สำเร็จต้องมาก่อนข้อความที่เข้ามาใหม่ในห้องเดียวกัน
+            for chat_room_id, room in rooms.items():
+                self._pending += len(room["messages"])
+                newer = self._rooms.get(chat_room_id)
+                if newer is not None:
+                    # seq ของข้อความใหม่ (ถ้ามี) ต่อท้ายได้เฉพาะเมื่อข้อความเดิมถูกจองครบแล้ว
+                    if newer["seqs"] and len(room["seqs"]) == len(room["messages"]):
+                        room["seqs"].extend(newer["seqs"])
+                    room["messages"].extend(newer["messages"])
+                    room["user_id"] = room["user_id"] or newer["user_id"]
+                    room["futures"].extend(newer["futures"])
+                self._rooms[chat_room_id] = room
+            for session_id, items in sessions.items():
+                self._sessions[session_id] = items + self._sessions.get(session_id, [])
+                self._pending += len(items)
+            if self._pending and self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def close(self, timeout: float = 10.0) -> None:
+        """
+        Flush everything still queued (graceful shutdown); unwritten messages go to fallback_path
+        """
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        with self._lock:
+            rooms, sessions = self._take_locked()
+        if thread is not None and thread.is_alive():
+            # thread ยังเขียน batch ก่อนหน้าไม่เสร็จ: ห้ามเขียนซ้อนกัน (seq ของห้องเดียวกันจะสลับลำดับ)
+            # จึงบันทึกส่วนที่เหลือลงไฟล์ ส่วน batch ของ thread ถ้าล้มเหลวจะถูกบันทึกลงไฟล์เอง
+            logger.warning(f"Chat write flush still running after {timeout}s, saving the rest for replay")
+            if rooms or sessions:
+                self._spill(rooms, sessions)
+            return
+        if (rooms or sessions) and not self._flush(rooms, sessions):
+            self._spill(rooms, sessions)
+
+    def _spill(self, rooms: Dict[str, Dict[str, Any]], sessions: Dict[str, List[Dict[str, Any]]]) -> None:
+        count = sum(len(room["messages"]) for room in rooms.values()) + sum(len(items) for items in sessions.values())
+        for room in rooms.values():
+            for future in room["futures"]:
+                if not future.done():
+                    future.set_result(False)
+        if not self.fallback_path:
+            logger.error(f"Lost {count} chat messages that could not be written before shutdown")
+            return
+        try:
+            os.makedirs(os.path.dirname(self.fallback_path) or ".", exist_ok=True)
+            with self._spill_lock, open(self.fallback_path, "a", encoding="utf-8") as f:
+                for chat_room_id, room in rooms.items():
+                    f.write(json.dumps({"chat_room_id": chat_room_id, "user_id": room["user_id"],
+                                        "messages": room["messages"], "seqs": room["seqs"]},
+                                       ensure_ascii=False, default=str) + "\n")
+                for session_id, items in sessions.items():
+                    f.write(json.dumps({"session_id": session_id, "messages": items}, ensure_ascii=False, default=str) + "\n")
+            logger.warning(f"Saved {count} unwritten chat messages to {self.fallback_path}")
+        except Exception as e:
+            logger.error(f"Lost {count} chat messages, could not write {self.fallback_path}: {str(e)}")
+
+    def replay(self) -> int:
+        """
+        Queue messages spilled by a previous shutdown; returns how many were queued
+        """
+        if not self.fallback_path or not os.path.exists(self.fallback_path):
+            return 0
+        # ย้ายไฟล์ออกก่อน เพื่อไม่ให้ worker อื่นอ่านซ้ำ
+        claimed = f"{self.fallback_path}.{os.getpid()}"
+        try:
+            os.replace(self.fallback_path, claimed)
+        except OSError:
+            return 0
+        count = 0
+        with open(claimed, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if "chat_room_id" in entry:
+                    self._submit_room(entry["chat_room_id"], entry["messages"], entry.get("user_id"), entry.get("seqs"))
+                else:
+                    for message in entry["messages"]:
+                        self.add_session_message(entry["session_id"], message)
+                count += len(entry["messages"])
+        os.remove(claimed)
+        logger.info(f"Replayed {count} chat messages from {self.fallback_path}")
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = self._pending
+        return {
+            "mode": self.mode,
+            "pending_messages": pending,
+            "flushes": self.flushes,
+            "messages_written": self.messages_written,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_seconds": self.last_flush_seconds
+        }
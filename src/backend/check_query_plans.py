@@ -0,0 +1,32 @@
+"""
+Ensure MongoDB indexes and fail if any query shape the backend uses runs as a collection scan
+
+    python check_query_plans.py
+
+Prints one JSON line per query shape (collection, filter, plan stages) and
+exits with status 1 when a winning plan contains COLLSCAN, so it can run as
+a CI step against a disposable mongod. tests/test_query_plans.py runs the
+same check under pytest (skipped when no mongod is reachable).
+"""
+import json
+import sys
+from mongodb_manager import MongoDBManager
+
+def main() -> int:
+    manager = MongoDBManager()
+    try:
+        manager.ensure_indexes()
+        results = manager.verify_query_plans()
+    finally:
+        manager.close()
+    for result in results:
+        print(json.dumps(result, ensure_ascii=False))
+    scans = [result for result in results if result["collscan"]]
+    if scans:
+        print(f"{len(scans)} of {len(results)} query shapes use a collection scan", file=sys.stderr)
+        return 1
+    print(f"All {len(results)} query shapes use an index")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
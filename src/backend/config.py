@@ -5,12 +5,77 @@ from typing import Dict, List
 # MongoDB configuration
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017/AI")
 MONGODB_DB = os.getenv("MONGODB_DB", "AI")
+# MongoClient: ขนาด connection pool, timeout และการบีบอัดข้อมูลระหว่าง client กับ server
+# pool ควรใหญ่กว่า IO_WORKERS + thread ของ ingestion และ chat write buffer
+MONGODB_CLIENT_CONFIG = {
+    'maxPoolSize': int(os.getenv("MONGODB_MAX_POOL_SIZE", "32")),
+    'minPoolSize': int(os.getenv("MONGODB_MIN_POOL_SIZE", "4")),
+    'maxIdleTimeMS': int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "60000")),
+    # รอ connection ว่างใน pool ได้นานเท่านี้ก่อน error (แทนการรอไม่มีกำหนด)
+    'waitQueueTimeoutMS': int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "2000")),
+    'serverSelectionTimeoutMS': int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    'connectTimeoutMS': int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000")),
+    'socketTimeoutMS': int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "30000")),
+    # zstd / snappy ต้องติดตั้ง zstandard / python-snappy เพิ่ม, zlib ใช้ได้ทันที, ว่าง = ไม่บีบอัด
+    'compressors': os.getenv("MONGODB_COMPRESSORS", "zlib"),
+}
+# driver ที่ handler ใช้อ่าน/เขียน: pymongo (ผ่าน io executor) หรือ motor (asyncio, ต้องติดตั้ง motor)
+MONGODB_DRIVER = os.getenv("MONGODB_DRIVER", "pymongo")
+# จำนวน operation ต่อ bulk_write ตอนบันทึก property (upsert แบบ unordered)
+PROPERTY_WRITE_BATCH_SIZE = int(os.getenv("PROPERTY_WRITE_BATCH_SIZE", "500"))
 
 # Language model configuration
 # Thai only
 MODEL_CONFIG = {
     'language_model': 'meta-llama/Llama-3.2-1B',
     'embedding_model': 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2',
+    # ชุดพารามิเตอร์ decoding (เลือกแลกคุณภาพกับ throughput ได้ชัดเจน)
+    'decoding_profiles': {
+        # greedy beam เดียว: เร็วที่สุดและได้ผลลัพธ์ซ้ำเดิมทุกครั้ง
+        'fast-greedy': {
+            'max_new_tokens': 150,
+            'min_new_tokens': 30,
+            'do_sample': False,
+            'num_beams': 1,
+            'repetition_penalty': 1.3,
+            'no_repeat_ngram_size': 4,
+        },
+        # sampling beam เดียว: ใช้ได้กับ streaming และ continuous batching
+        'sampled': {
+            'max_new_tokens': 150,
+            'min_new_tokens': 30,
+            'do_sample': True,
+            'num_beams': 1,
+            'temperature': 0.8,
+            'top_p': 0.95,
+            'top_k': 40,
+            'repetition_penalty': 1.3,
+            'no_repeat_ngram_size': 4,
+        },
+        # beam search + sampling แบบเดิม: ใช้ compute ต่อ token ประมาณ 3 เท่า
+        'quality-beam': {
+            'max_new_tokens': 150,
+            'min_new_tokens': 30,
+            'do_sample': True,
+            'num_beams': 3,
+            'temperature': 0.8,
+            'top_p': 0.95,
+            'top_k': 40,
+            'repetition_penalty': 1.3,
+            'no_repeat_ngram_size': 4,
+            'length_penalty': 1.2,
+            'early_stopping': True,
+        },
+    },
+    # profile ที่แต่ละ endpoint ใช้
+    'endpoint_profiles': {
+        'chat': os.getenv("CHAT_DECODING_PROFILE", "sampled"),
+        'stream': os.getenv("STREAM_DECODING_PROFILE", "sampled"),
+        'fallback': os.getenv("FALLBACK_DECODING_PROFILE", "sampled"),
+        'translate': os.getenv("TRANSLATE_DECODING_PROFILE", "fast-greedy"),
+    },
+    # override ต่อ consultation style เช่น {"professional": "quality-beam"}
+    'style_profiles': {},
 }
 
 # Available language options
@@ -28,6 +93,117 @@ CONSULTATION_STYLES = {
 VECTOR_SIMILARITY_THRESHOLD = 0.8
 MAX_RESULTS = 3
 
+# Query caches: embedding ของคำค้นหา และผลลัพธ์การค้นหา (ผลลัพธ์ถูกล้างทุกครั้งที่ index เปลี่ยน)
+QUERY_CACHE_CONFIG = {
+    'embedding_maxsize': int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2048")),
+    'embedding_ttl': float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "3600")),  # วินาที
+    'result_maxsize': int(os.getenv("SEARCH_RESULT_CACHE_SIZE", "1024")),
+    'result_ttl': float(os.getenv("SEARCH_RESULT_CACHE_TTL", "300")),  # วินาที
+}
+
+# Micro-batching ของการ encode คำค้นหาจาก request ที่เข้ามาพร้อมกัน
+EMBEDDING_BATCH_CONFIG = {
+    'max_batch_size': int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "32")),
+    'max_wait_ms': float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "5")),
+}
+
+# Embedding cache บน disk (key = ชื่อ embedding model + hash ของข้อความ property)
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(".cache", "embeddings"))
+
+# Embedding encoder: torch (SentenceTransformer), onnx หรือ onnx-int8 (ต้องติดตั้ง onnxruntime)
+# backend ONNX จะถูกใช้ก็ต่อเมื่อผ่านการตรวจ parity (cosine similarity กับ SentenceTransformer ไม่ต่ำกว่า parity_tolerance)
+EMBEDDING_ENCODER_CONFIG = {
+    'backend': os.getenv("EMBEDDING_ENCODER_BACKEND", "torch"),
+    'export_dir': os.getenv("EMBEDDING_ONNX_DIR", os.path.join(".cache", "onnx")),
+    'parity_tolerance': float(os.getenv("EMBEDDING_PARITY_TOLERANCE", "0.99")),
+    'parity_texts_file': os.getenv("EMBEDDING_PARITY_TEXTS_FILE"),  # ข้อความ property ทีละบรรทัด
+}
+
+# Approximate nearest-neighbour index (IVF)
+# backend: "exact" = brute-force ทุกแถว, "ivf" = ค้นหาเฉพาะ cluster ที่ใกล้คำค้นหาแล้ว rerank แบบ exact
+VECTOR_INDEX_CONFIG = {
+    'backend': os.getenv("VECTOR_INDEX_BACKEND", "exact"),
+    'nlist': int(os.getenv("VECTOR_INDEX_NLIST", "256")),  # จำนวน cluster
+    'nprobe': int(os.getenv("VECTOR_INDEX_NPROBE", "16")),  # จำนวน cluster ที่ค้นต่อคำค้นหา (recall vs speed)
+    'min_train_size': int(os.getenv("VECTOR_INDEX_MIN_TRAIN_SIZE", "20000")),  # ต่ำกว่านี้ใช้ brute-force
+    'train_sample_size': int(os.getenv("VECTOR_INDEX_TRAIN_SAMPLE_SIZE", "50000")),
+    'train_iterations': int(os.getenv("VECTOR_INDEX_TRAIN_ITERATIONS", "10")),
+    'retrain_growth': float(os.getenv("VECTOR_INDEX_RETRAIN_GROWTH", "2.0")),  # train ใหม่เมื่อข้อมูลโตเกินกี่เท่า
+}
+
+# Property index maintenance
+# ติดตาม change stream ของ collection properties (ต้องใช้ MongoDB แบบ replica set)
+PROPERTY_WATCH_ENABLED = os.getenv("PROPERTY_WATCH_ENABLED", "false").lower() == "true"
+PROPERTY_WATCH_MAX_AWAIT_MS = int(os.getenv("PROPERTY_WATCH_MAX_AWAIT_MS", "1000"))
+
+
+# Executors: งาน inference (CPU) และงาน I/O กับ MongoDB แยก pool กัน
+# queue_size = จำนวนงานที่รอได้ก่อนตอบ 503 กลับไป
+EXECUTOR_CONFIG = {
+    'inference_workers': int(os.getenv("INFERENCE_WORKERS", "1")),
+    'inference_queue_size': int(os.getenv("INFERENCE_QUEUE_SIZE", "32")),
+    'io_workers': int(os.getenv("IO_WORKERS", "16")),
+    'io_queue_size': int(os.getenv("IO_QUEUE_SIZE", "256")),
+    # encode คำค้นหาแยก pool จากการ generate เพื่อไม่ให้ต้องรอ generation ที่กำลัง stream อยู่
+    'embedding_workers': int(os.getenv("EMBEDDING_WORKERS", "1")),
+    'embedding_queue_size': int(os.getenv("EMBEDDING_QUEUE_SIZE", "32")),
+}
+
+# Continuous batching ของการ generate (request ใหม่เข้าร่วม/ออกจาก batch ได้ทุก token)
+# เปิดใช้แล้วการ generate จะเป็น sampling แบบ beam เดียว
+GENERATION_SCHEDULER_CONFIG = {
+    'enabled': os.getenv("GENERATION_SCHEDULER_ENABLED", "false").lower() == "true",
+    'max_batch_size': int(os.getenv("GENERATION_MAX_BATCH_SIZE", "16")),
+    'max_pending': int(os.getenv("GENERATION_MAX_PENDING", "64")),
+}
+
+# โหมดการรันโมเดล generate บน CPU: none (fp32), bf16 หรือ int8 (dynamic quantization)
+# โมเดล int8 ที่แปลงแล้วเก็บไว้ใน QUANTIZED_MODEL_CACHE_DIR เพื่อไม่ต้องแปลงใหม่ทุกครั้งที่เริ่มระบบ
+GENERATOR_QUANTIZATION = os.getenv("GENERATOR_QUANTIZATION", "none")
+QUANTIZED_MODEL_CACHE_DIR = os.getenv("QUANTIZED_MODEL_CACHE_DIR", os.path.join(".cache", "quantized"))
+
+# ใช้ KV cache ของส่วนต้น prompt ที่เหมือนกันทุก request ซ้ำ (ลด time-to-first-token)
+PREFIX_CACHE_ENABLED = os.getenv("PREFIX_CACHE_ENABLED", "true").lower() == "true"
+
+# Startup: โหลดโมเดลและ index ใน background หลัง API เริ่มรับ request แล้ว
+# งบเวลาตั้งแต่ process เริ่มจนทุก component พร้อม (เกินแล้วจะ log เตือน)
+STARTUP_READY_BUDGET_SECONDS = float(os.getenv("STARTUP_READY_BUDGET_SECONDS", "120"))
+
+# โหลดโมเดลและ property index ตอน import (ก่อน fork) เพื่อให้ทุก worker ใช้หน่วยความจำร่วมกันแบบ copy-on-write
+# เปิดอัตโนมัติเมื่อรันผ่าน gunicorn.conf.py (preload_app)
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "false").lower() == "true"
+
+# การนำเข้าไฟล์อัพโหลด: แยกเป็น chunk ละ chunk_rows แถว (บันทึกและ embed ทีละ chunk)
+INGESTION_CONFIG = {
+    'chunk_rows': int(os.getenv("INGESTION_CHUNK_ROWS", "1000")),
+    'spool_dir': os.getenv("INGESTION_SPOOL_DIR", os.path.join(".cache", "uploads")),
+    'max_queued_jobs': int(os.getenv("INGESTION_MAX_QUEUED_JOBS", "16")),
+    # job ที่ไม่มีการบันทึก checkpoint นานเกินนี้ (วินาที) ถือว่า worker ที่ทำอยู่ตายแล้ว
+    'lease_seconds': float(os.getenv("INGESTION_LEASE_SECONDS", "600")),
+    # job ที่เสร็จแล้วเก็บในหน่วยความจำนานเท่านี้ (วินาที) / ไม่เกินกี่ job (หลังจากนั้นอ่านสถานะจาก MongoDB)
+    'finished_job_ttl': float(os.getenv("INGESTION_FINISHED_JOB_TTL", "3600")),
+    'max_finished_jobs': int(os.getenv("INGESTION_MAX_FINISHED_JOBS", "100")),
+}
+
+# ประวัติแชท: ข้อความเก็บเป็น bucket ละ bucket_size ข้อความ (ไม่ใช่ array เดียวในเอกสารห้องแชท)
+CHAT_HISTORY_CONFIG = {
+    'bucket_size': int(os.getenv("CHAT_BUCKET_SIZE", "100")),
+    'page_size': int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50")),
+    'max_page_size': int(os.getenv("CHAT_HISTORY_MAX_PAGE_SIZE", "200")),
+}
+
+# Write-behind ของข้อความแชท: รวมข้อความหลายห้องแล้วเขียนเป็น batch
+# mode: ack = ตอบผู้ใช้หลังเขียนลง MongoDB แล้ว, async = ตอบทันทีแล้วเขียนใน background
+CHAT_WRITE_BUFFER_CONFIG = {
+    'mode': os.getenv("CHAT_WRITE_MODE", "async"),
+    'max_batch_messages': int(os.getenv("CHAT_WRITE_BATCH_MESSAGES", "200")),
+    'flush_interval_ms': int(os.getenv("CHAT_WRITE_FLUSH_MS", "50")),
+    'max_pending_messages': int(os.getenv("CHAT_WRITE_MAX_PENDING", "10000")),
+    'ack_timeout': float(os.getenv("CHAT_WRITE_ACK_TIMEOUT", "5")),
+    # ข้อความที่เขียนไม่สำเร็จตอน shutdown จะถูกเก็บไว้ที่นี่ แล้วเขียนซ้ำเมื่อเริ่มระบบครั้งถัดไป
+    'fallback_path': os.getenv("CHAT_WRITE_FALLBACK_PATH", os.path.join(".cache", "chat_writes_pending.jsonl")),
+}
 
 # File upload limits
 MAX_UPLOAD_SIZE = 5 * 1024 * 1024  # 5MB
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import List, Tuple
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+KEY_SIZE = 16
+CACHE_FORMAT_VERSION = 1
+
+class EmbeddingCache:
+    def __init__(self, cache_dir: str, model_name: str, dimension: int):
+        """
+        Persistent embedding cache keyed by (model name, hash of the text)
+
+        Layout inside cache_dir:
+          meta.json    model name, dimension and format version
+          keys.bin     16-byte blake2b digests, one per row
+          vectors.f32  raw float32 rows, memory-mapped for reads
+
+        Rows are only appended. A different model name or dimension in
+        meta.json wipes the cache so stale vectors are never returned.
+        """
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.dimension = dimension
+        self._meta_path = os.path.join(cache_dir, "meta.json")
+        self._keys_path = os.path.join(cache_dir, "keys.bin")
+        self._vectors_path = os.path.join(cache_dir, "vectors.f32")
+        self._lock_path = os.path.join(cache_dir, ".lock")
+        self._lock = threading.Lock()
+        self._index = {}
+        self._vectors = np.zeros((0, dimension), dtype=np.float32)
+        # จำนวนแถวบน disk ที่อยู่ใน _index แล้ว
+        self._rows = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def key(self, text: str) -> bytes:
+        return hashlib.blake2b(
+            text.encode("utf-8"),
+            digest_size=KEY_SIZE,
+            person=b"property-embed",
+            salt=hashlib.blake2b(self.model_name.encode("utf-8"), digest_size=16).digest()
+        ).digest()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get_many(self, texts: List[str]) -> Tuple[np.ndarray, List[int]]:
+        """
+        Look up texts; returns (embeddings, positions of texts that were not cached)
+
+        Rows for missing texts are left as zeros.
+        """
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        missing = []
+        with self._lock:
+            for i, text in enumerate(texts):
+                row = self._index.get(self.key(text))
+                if row is None:
+                    missing.append(i)
+                else:
+                    embeddings[i] = self._vectors[row]
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return embeddings, missing
+
+    def put_many(self, texts: List[str], embeddings: np.ndarray) -> None:
+        """
+        Append new (text, embedding) pairs; texts already cached are skipped
+
+        Only the appended keys (and any rows other workers appended since the
+        last call) are added to the in-memory index, so the cost is
+        proportional to the batch and the new rows, not to the size of the
+        cache.
+        """
+        if not texts:
+            return
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        try:
+            with self._lock, self._file_lock():
+                self._sync_rows()
+                keys = []
+                seen = set()
+                rows = []
+                for text, embedding in zip(texts, embeddings):
+                    key = self.key(text)
+                    if key in self._index or key in seen:
+                        continue
+                    seen.add(key)
+                    keys.append(key)
+                    rows.append(embedding)
+                if not keys:
+                    return
+
+                start = self._rows
+                # เขียนเวกเตอร์ก่อน key เสมอ เพื่อให้ key ไม่ชี้ไปยังแถวที่ยังเขียนไม่เสร็จ
+                with open(self._vectors_path, "r+b" if os.path.exists(self._vectors_path) else "wb") as f:
+                    f.seek(start * self.dimension * 4)
+                    f.write(np.asarray(rows, dtype=np.float32).tobytes())
+                    f.truncate()
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(self._keys_path, "r+b" if os.path.exists(self._keys_path) else "wb") as f:
+                    f.seek(start * KEY_SIZE)
+                    f.write(b"".join(keys))
+                    f.truncate()
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                for offset, key in enumerate(keys):
+                    self._index[key] = start + offset
+                self._map_vectors(start + len(keys))
+        except Exception as e:
+            # cache เป็นเพียงตัวช่วยเร่งความเร็ว ไม่ควรทำให้การ index ล้มเหลว
+            logger.error(f"Error writing embedding cache: {str(e)}")
+
+    def clear(self) -> None:
+        with self._lock, self._file_lock():
+            self._reset_files()
+            self._load_rows()
+
+    def _load(self) -> None:
+        try:
+            with self._lock, self._file_lock():
+                meta = None
+                if os.path.exists(self._meta_path):
+                    with open(self._meta_path, "r", encoding="utf-8") as f:
+                        meta = json.load(f)
+                expected = self._meta()
+                if meta != expected:
+                    if meta is not None:
+                        logger.info(f"Embedding cache was built for {meta.get('model_name')}, invalidating")
+                    self._reset_files()
+                self._load_rows()
+            logger.info(f"Loaded embedding cache with {len(self._index)} vectors from {self.cache_dir}")
+        except Exception as e:
+            logger.error(f"Error loading embedding cache, starting empty: {str(e)}")
+            self._index = {}
+            self._vectors = np.zeros((0, self.dimension), dtype=np.float32)
+            self._rows = 0
+
+    def _meta(self) -> dict:
+        return {
+            "model_name": self.model_name,
+            "dimension": self.dimension,
+            "version": CACHE_FORMAT_VERSION
+        }
+
+    def _reset_files(self) -> None:
+        for path in (self._keys_path, self._vectors_path):
+            if os.path.exists(path):
+                os.remove(path)
+        with open(self._meta_path, "w", encoding="utf-8") as f:
+            json.dump(self._meta(), f)
+
+    def _row_count_on_disk(self) -> int:
+        keys_rows = os.path.getsize(self._keys_path) // KEY_SIZE if os.path.exists(self._keys_path) else 0
+        vector_rows = os.path.getsize(self._vectors_path) // (self.dimension * 4) if os.path.exists(self._vectors_path) else 0
+        # ถ้าเขียนค้างไว้ครึ่งทาง ให้ใช้เฉพาะแถวที่มีครบทั้ง key และเวกเตอร์
+        return min(keys_rows, vector_rows)
+
+    def _load_rows(self) -> None:
+        self._index = {}
+        self._rows = 0
+        self._vectors = np.zeros((0, self.dimension), dtype=np.float32)
+        self._sync_rows()
+
+    def _sync_rows(self) -> None:
+        """
+        Index rows appended on disk since the last load (by this or another worker), reading only their keys
+        """
+        rows = self._row_count_on_disk()
+        if rows < self._rows:
+            # worker อื่นล้าง cache ไปแล้ว: โหลดใหม่ทั้งหมด
+            self._load_rows()
+            return
+        if rows == self._rows:
+            return
+        with open(self._keys_path, "rb") as f:
+            f.seek(self._rows * KEY_SIZE)
+            data = f.read((rows - self._rows) * KEY_SIZE)
+        for offset in range(rows - self._rows):
+            self._index[data[offset * KEY_SIZE:(offset + 1) * KEY_SIZE]] = self._rows + offset
+        self._map_vectors(rows)
+
+    def _map_vectors(self, rows: int) -> None:
+        self._rows = rows
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dimension))
+
+    def _file_lock(self):
+        return _FileLock(self._lock_path)
+
+
+class _FileLock:
+    def __init__(self, path: str):
+        """
+        Advisory cross-process lock so several workers can share one cache directory
+        """
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.path, "a")
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        return False
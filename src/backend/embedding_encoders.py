@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# torch = SentenceTransformer เดิม, onnx = graph ที่ export แล้วรันด้วย onnxruntime, onnx-int8 = onnx + น้ำหนัก int8
+ENCODER_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+# ข้อความ property ตัวอย่างสำหรับตรวจ parity เมื่อไม่ได้กำหนดไฟล์ข้อความของเราเอง
+DEFAULT_PARITY_TEXTS = [
+    "ประเภท: คอนโด โครงการ: ไลฟ์ อโศก ราคา: 4500000 บาท รูปแบบ: 1 ห้องนอน ตำแหน่ง: อโศก ใกล้สถานีรถไฟฟ้า: MRT เพชรบุรี",
+    "ประเภท: บ้านเดี่ยว โครงการ: เศรษฐสิริ บางนา ราคา: 8900000 บาท รูปแบบ: 3 ห้องนอน ตำแหน่ง: บางนา ใกล้สถานศึกษา: มหาวิทยาลัยอัสสัมชัญ",
+    "ประเภท: ทาวน์โฮม โครงการ: พฤกษา วิลล์ รังสิต ราคา: 2500000 บาท รูปแบบ: 2 ห้องนอน ตำแหน่ง: รังสิต ใกล้ห้างสรรพสินค้า: ฟิวเจอร์พาร์ค",
+    "ประเภท: คอนโด โครงการ: ศุภาลัย ริวา ราคา: 3200000 บาท ตำแหน่ง: พระราม 3 ใกล้โรงพยาบาล: โรงพยาบาลบางโพ",
+    "ประเภท: บ้านแฝด โครงการ: เดอะ แพลนท์ ราคา: 5200000 บาท ตำแหน่ง: ลาดกระบัง ใกล้สนามบิน: สุวรรณภูมิ",
+    "หาคอนโดใกล้รถไฟฟ้าแถวอโศก งบไม่เกิน 5 ล้าน",
+    "อยากได้บ้านเดี่ยวสำหรับครอบครัว ใกล้โรงเรียนนานาชาติ",
+    "ทาวน์โฮมราคาถูกใกล้มหาวิทยาลัย",
+]
+
+class SentenceTransformerEncoder:
+    def __init__(self, model_name: str):
+        """
+        Reference encoder: the full SentenceTransformer model on torch
+        """
+        from sentence_transformers import SentenceTransformer
+        self.model_name = model_name
+        self.backend = "torch"
+        self.model = SentenceTransformer(model_name)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.max_seq_length = self.model.max_seq_length
+
+    @property
+    def cache_name(self) -> str:
+        return self.model_name
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self.model.encode(texts, convert_to_numpy=True), dtype=np.float32)
+
+
+class OnnxEncoder:
+    def __init__(self, export_dir: str, quantized: bool = False, batch_size: int = 32):
+        """
+        Exported transformer graph run through onnxruntime, with mean pooling in numpy
+
+        Needs only onnxruntime and the tokenizer at startup; the torch model
+        is never loaded.
+        """
+        import onnxruntime
+        from transformers import AutoTokenizer
+        with open(os.path.join(export_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.model_name = meta["model_name"]
+        self.backend = "onnx-int8" if quantized else "onnx"
+        self.dimension = meta["dimension"]
+        self.max_seq_length = meta["max_seq_length"]
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        model_path = os.path.join(export_dir, "model.int8.onnx" if quantized else "model.onnx")
+        self.session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    @property
+    def cache_name(self) -> str:
+        # embedding จาก backend ต่างกันไม่เท่ากันทุกบิต จึงแยก cache บน disk
+        return f"{self.model_name}#{self.backend}"
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            inputs = self.tokenizer(batch, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors="np")
+            feed = {name: inputs[name].astype(np.int64) for name in self._input_names if name in inputs}
+            hidden = self.session.run(None, feed)[0]
+            # mean pooling เหมือน SentenceTransformer (ไม่นับ token ที่เป็น padding)
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            out[start:start + len(batch)] = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return out
+
+
+def export_onnx(reference: SentenceTransformerEncoder, export_dir: str) -> None:
+    """
+    Export the transformer of a SentenceTransformer to ONNX, plus an int8 dynamically quantized copy
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    started = time.perf_counter()
+    os.makedirs(export_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(reference.model_name)
+    model = AutoModel.from_pretrained(reference.model_name)
+    model.config.return_dict = False
+    model.eval()
+    sample = tokenizer(["ตัวอย่างข้อความ"], return_tensors="pt")
+    fp32_path = os.path.join(export_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state", "pooler_output"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"}
+            },
+            opset_version=14
+        )
+    quantize_dynamic(fp32_path, os.path.join(export_dir, "model.int8.onnx"), weight_type=QuantType.QInt8)
+    tokenizer.save_pretrained(export_dir)
+    _write_meta(export_dir, {
+        "model_name": reference.model_name,
+        "dimension": reference.dimension,
+        "max_seq_length": reference.max_seq_length,
+        "parity": {}
+    })
+    logger.info(f"Exported {reference.model_name} to ONNX in {time.perf_counter() - started:.1f}s")
+
+
+def check_parity(reference, candidate, texts: List[str], tolerance: float) -> Dict[str, Any]:
+    """
+    Cosine similarity between reference and candidate embeddings of the same texts
+
+    Passes when every text's cosine is at least `tolerance`.
+    """
+    expected = _unit(reference.encode(texts))
+    got = _unit(candidate.encode(texts))
+    cosines = (expected * got).sum(axis=1)
+    return {
+        "texts": len(texts),
+        "min_cosine": float(cosines.min()),
+        "mean_cosine": float(cosines.mean()),
+        "tolerance": tolerance,
+        "passed": bool(cosines.min() >= tolerance)
+    }
+
+
+def load_parity_texts(path: Optional[str]) -> List[str]:
+    """
+    Held-out texts for parity checks: one per line from `path`, or the built-in samples
+    """
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        if texts:
+            return texts
+    return list(DEFAULT_PARITY_TEXTS)
+
+
+def create_encoder(model_name: str,
+                   backend: str = "torch",
+                   export_dir: Optional[str] = None,
+                   parity_texts: Optional[List[str]] = None,
+                   tolerance: float = 0.99):
+    """
+    Build the embedding encoder for `backend`, falling back to the torch reference
+
+    The first start with an ONNX backend exports the model and checks parity
+    against the reference SentenceTransformer. The result is stored in
+    meta.json. Later starts load the exported graph directly (skipping the
+    torch model load) as long as that backend passed parity. A failed check,
+    or a missing onnxruntime, falls back to the reference encoder.
+    """
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend {backend!r}, expected one of {ENCODER_BACKENDS}")
+    if backend == "torch":
+        return SentenceTransformerEncoder(model_name)
+
+    model_dir = os.path.join(export_dir, re.sub(r"[^A-Za-z0-9_.-]+", "--", model_name))
+    quantized = backend == "onnx-int8"
+    meta = _read_meta(model_dir)
+    parity = meta.get("parity", {}).get(backend) if meta and meta.get("model_name") == model_name else None
+    # export ที่เสียหรือเขียนไม่ครบต้องถูก export ใหม่ ไม่เช่นนั้นทุกครั้งที่เริ่มระบบจะล้มเหลวแบบเดิม
+    reexport = meta is None or meta.get("model_name") != model_name
+    if parity is not None and parity["passed"]:
+        try:
+            encoder = OnnxEncoder(model_dir, quantized=quantized)
+            logger.info(f"Loaded {backend} embedding encoder (parity min cosine {parity['min_cosine']:.4f})")
+            return encoder
+        except Exception as e:
+            logger.error(f"Error loading {backend} embedding encoder, re-exporting: {str(e)}")
+            reexport = True
+    elif parity is not None:
+        logger.warning(f"{backend} encoder previously failed parity (min cosine {parity['min_cosine']:.4f}), using torch")
+        return SentenceTransformerEncoder(model_name)
+
+    reference = SentenceTransformerEncoder(model_name)
+    try:
+        if reexport:
+            export_onnx(reference, model_dir)
+        encoder = OnnxEncoder(model_dir, quantized=quantized)
+        result = check_parity(reference, encoder, parity_texts or list(DEFAULT_PARITY_TEXTS), tolerance)
+    except ImportError as e:
+        logger.warning(f"{backend} encoder needs onnxruntime ({str(e)}), using torch")
+        return reference
+    except Exception as e:
+        logger.error(f"Error preparing {backend} embedding encoder, using torch: {str(e)}")
+        return reference
+
+    meta = _read_meta(model_dir)
+    meta.setdefault("parity", {})[backend] = result
+    _write_meta(model_dir, meta)
+    if not result["passed"]:
+        logger.warning(f"{backend} encoder failed parity check: {result}, using torch")
+        return reference
+    logger.info(f"{backend} encoder passed parity check: {result}")
+    return encoder
+
+
+def _unit(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+def _read_meta(export_dir: str) -> Optional[Dict[str, Any]]:
+    path = os.path.join(export_dir, "meta.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _write_meta(export_dir: str, meta: Dict[str, Any]) -> None:
+    with open(os.path.join(export_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+from typing import Callable, Dict, Any, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingBatcher:
+    def __init__(self,
+                 encode_fn: Callable[[List[str]], np.ndarray],
+                 max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0):
+        """
+        Micro-batches concurrent single-text encode requests
+
+        Texts that arrive within `max_wait_ms` of the first pending one (up to
+        `max_batch_size`) are encoded in a single forward pass off the event
+        loop, and each waiting coroutine receives its own row.
+        """
+        self.encode_fn = encode_fn
+        # BoundedExecutor สำหรับงาน inference (ถ้าไม่กำหนดจะใช้ default executor ของ event loop)
+        self.executor = None
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+
+    async def encode(self, text: str) -> np.ndarray:
+        """
+        Encode one text, sharing the forward pass with concurrent callers
+        """
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def stop(self) -> None:
+        """
+        Stop the background worker, failing any request still queued
+        """
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._queue is not None:
+            while not self._queue.empty():
+                _, future = self._queue.get_nowait()
+                if not future.done():
+                    future.set_exception(RuntimeError("Embedding batcher stopped"))
+            self._queue = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "average_batch_size": self.items / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0
+        }
+
+    def _ensure_worker(self) -> None:
+        # สร้าง queue/worker ภายใน event loop ที่กำลังทำงาน
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _collect(self) -> List[Tuple[str, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # ข้อความซ้ำใน batch เดียวกัน encode ครั้งเดียว
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                if self.executor is not None:
+                    embeddings = await self.executor.run(self.encode_fn, texts)
+                else:
+                    embeddings = await loop.run_in_executor(None, self.encode_fn, texts)
+                rows = {text: embeddings[i] for i, text in enumerate(texts)}
+                for text, future in batch:
+                    if not future.done():
+                        future.set_result(rows[text])
+            except asyncio.CancelledError:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError("Embedding batcher stopped"))
+                raise
+            except Exception as e:
+                logger.error(f"Error encoding query batch: {str(e)}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+            self.batches += 1
+            self.items += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
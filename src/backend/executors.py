@@ -0,0 +1,118 @@
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    """
+    Raised when a BoundedExecutor already has max_workers + max_queue tasks in flight
+    """
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        """
+        Thread pool with a bounded backlog and queue-depth counters
+
+        At most `max_workers` tasks run at once and at most `max_queue` more
+        wait for a worker; anything beyond that is rejected with
+        QueueFullError instead of piling up behind a slow model.
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._has_space = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run fn(*args, **kwargs) on the pool and await its result
+        """
+        future = self.submit(fn, *args, **kwargs)
+        return await asyncio.wrap_future(future)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Schedule fn without awaiting it (e.g. fire-and-forget persistence)
+        """
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise QueueFullError(f"{self.name} executor queue is full")
+            self._in_flight += 1
+        return self._schedule(fn, *args, **kwargs)
+
+    def submit_wait(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Schedule fn, waiting for room in the queue instead of raising QueueFullError
+
+        For background work (e.g. ingestion) that must not fail because
+        request traffic filled the queue; request handlers use submit/run.
+        """
+        with self._lock:
+            while self._in_flight >= self.max_workers + self.max_queue:
+                self._has_space.wait()
+            self._in_flight += 1
+        return self._schedule(fn, *args, **kwargs)
+
+    def _schedule(self, fn: Callable, *args, **kwargs) -> Future:
+        try:
+            return self.executor.submit(self._call, functools.partial(fn, *args, **kwargs))
+        except Exception:
+            with self._lock:
+                self._in_flight -= 1
+                self._has_space.notify()
+            raise
+
+    def _call(self, task: Callable) -> Any:
+        with self._lock:
+            self._running += 1
+        try:
+            result = task()
+            with self._lock:
+                self.completed += 1
+            return result
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._in_flight -= 1
+                self._has_space.notify()
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        Tasks accepted but still waiting for a worker
+        """
+        with self._lock:
+            return self._in_flight - self._running
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": self._in_flight - self._running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.executor.shutdown(wait=wait)
+        logger.info(f"Shut down {self.name} executor")
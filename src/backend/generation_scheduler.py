@@ -0,0 +1,424 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional
+import torch
+import torch.nn.functional as F
+from transformers import (
+    LogitsProcessorList, MinNewTokensLengthLogitsProcessor, NoRepeatNGramLogitsProcessor,
+    RepetitionPenaltyLogitsProcessor, TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper
+)
+from executors import QueueFullError
+
+try:
+    from transformers import DynamicCache
+except ImportError:  # transformers รุ่นเก่าใช้ tuple ของ (key, value) ต่อ layer
+    DynamicCache = None
+
+logger = logging.getLogger(__name__)
+
+# พารามิเตอร์ที่ decoding loop รองรับต่อ request (ไม่รองรับ beam search)
+SAMPLING_PARAMS = (
+    "max_new_tokens", "min_new_tokens", "do_sample", "temperature", "top_p", "top_k",
+    "repetition_penalty", "no_repeat_ngram_size"
+)
+
+class _Sequence:
+    def __init__(self,
+                 prompt: str,
+                 params: Dict[str, Any],
+                 cancel_event: Optional[threading.Event],
+                 streamer: Any,
+                 prefix: Optional[str]):
+        """
+        One request inside the shared decoding loop
+        """
+        self.prompt = prompt
+        self.prefix = prefix
+        self.params = params
+        self.cancel_event = cancel_event
+        self.streamer = streamer
+        self.future: Future = Future()
+        self.tokens: List[int] = []
+        self.prompt_length = 0
+        self.processors: Optional[LogitsProcessorList] = None
+        self.submitted_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+
+    @property
+    def generated(self) -> List[int]:
+        return self.tokens[self.prompt_length:]
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+
+class GenerationScheduler:
+    def __init__(self, model, tokenizer, max_batch_size: int = 16, max_pending: int = 64, max_prompt_tokens: int = 512):
+        """
+        Continuous-batching decoder shared by all generation requests
+
+        A single background thread owns the model. Each iteration it admits
+        waiting requests (prefilled together, left-padded), runs one decode
+        step for every active sequence, samples the next token per request
+        with that request's own parameters, and drops sequences that hit EOS,
+        max_new_tokens or cancellation. Requests therefore join and leave at
+        token boundaries instead of waiting for the whole batch to finish.
+
+        The key/value cache of the batch is kept left-padded to a common
+        length; the attention mask hides the padding and position_ids are
+        tracked per sequence.
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_pending = max_pending
+        self.max_prompt_tokens = max_prompt_tokens
+        self.pad_token_id = tokenizer.pad_token_id
+        # PromptPrefixCache (ถ้ากำหนด) ให้ prefill เฉพาะส่วนหลัง prefix ที่ cache ไว้
+        self.prefix_cache = None
+        eos = tokenizer.eos_token_id
+        self.eos_token_ids = set(eos if isinstance(eos, list) else [eos]) if eos is not None else set()
+        self._pending: "queue.Queue[_Sequence]" = queue.Queue()
+        self._active: List[_Sequence] = []
+        self._cache = None
+        self._mask: Optional[torch.Tensor] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.steps = 0
+        self.batched_rows = 0
+        self.tokens_generated = 0
+        self.requests_completed = 0
+        self.requests_failed = 0
+        self.busy_seconds = 0.0
+        self._latencies = deque(maxlen=1000)
+        self._first_token_latencies = deque(maxlen=1000)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="generation-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"Started generation scheduler (max_batch_size={self.max_batch_size})")
+
+    def after_fork(self) -> None:
+        """
+        Restart the decoding loop in a forked worker
+
+        Threads do not survive fork and the inherited queue/event may have
+        been locked by the parent's loop thread, so both are recreated.
+        """
+        self._pending = queue.Queue()
+        self._stop = threading.Event()
+        self._active = []
+        self._cache = None
+        self._mask = None
+        self._thread = None
+        self.start()
+
+    def stop(self) -> None:
+        """
+        Stop the decoding loop and fail every request that has not finished
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+        error = RuntimeError("Generation scheduler stopped")
+        for seq in self._active:
+            self._fail(seq, error)
+        self._active = []
+        self._cache = None
+        self._mask = None
+        while True:
+            try:
+                self._fail(self._pending.get_nowait(), error)
+            except queue.Empty:
+                break
+
+    def submit(self,
+               prompt: str,
+               params: Dict[str, Any],
+               cancel_event: Optional[threading.Event] = None,
+               streamer: Any = None,
+               prefix: Optional[str] = None) -> Future:
+        """
+        Queue a prompt; the returned Future resolves to the generated token ids
+
+        `streamer` (e.g. a TextIteratorStreamer) receives each token as it is
+        sampled and is ended when the sequence finishes. `prefix` names the
+        static start of the prompt whose cached key/values may be reused.
+        """
+        if self._thread is None:
+            raise RuntimeError("Generation scheduler is not running")
+        if self._pending.qsize() >= self.max_pending:
+            raise QueueFullError("generation scheduler queue is full")
+        unsupported = set(params) - set(SAMPLING_PARAMS)
+        if unsupported:
+            raise ValueError(f"Unsupported decoding parameters for batched generation: {sorted(unsupported)}")
+        seq = _Sequence(prompt, params, cancel_event, streamer, prefix)
+        self._pending.put(seq)
+        return seq.future
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+        first_token = sorted(self._first_token_latencies)
+        return {
+            "active": len(self._active),
+            "pending": self._pending.qsize(),
+            "max_batch_size": self.max_batch_size,
+            "steps": self.steps,
+            "average_batch_size": self.batched_rows / self.steps if self.steps else 0.0,
+            "tokens_generated": self.tokens_generated,
+            "tokens_per_second": self.tokens_generated / self.busy_seconds if self.busy_seconds else 0.0,
+            "requests_completed": self.requests_completed,
+            "requests_failed": self.requests_failed,
+            "latency_p50_seconds": _percentile(latencies, 0.50),
+            "latency_p95_seconds": _percentile(latencies, 0.95),
+            "first_token_p95_seconds": _percentile(first_token, 0.95)
+        }
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            joining = self._take_pending()
+            if not joining and not self._active:
+                continue
+            started = time.perf_counter()
+            try:
+                with torch.inference_mode():
+                    if joining:
+                        self._prefill(joining)
+                    if self._active:
+                        self._decode_step()
+            except Exception as e:
+                logger.error(f"Error in generation scheduler step: {str(e)}")
+                for seq in self._active + [seq for seq in joining if seq not in self._active]:
+                    self._fail(seq, e)
+                self._active = []
+                self._cache = None
+                self._mask = None
+            self.busy_seconds += time.perf_counter() - started
+
+    def _take_pending(self) -> List[_Sequence]:
+        joining = []
+        free = self.max_batch_size - len(self._active)
+        if free <= 0:
+            return joining
+        try:
+            # ถ้าไม่มีงานค้างอยู่ รอ request ใหม่แบบบล็อก (ตรวจ stop เป็นระยะ)
+            if not self._active:
+                joining.append(self._pending.get(timeout=0.1))
+            while len(joining) < free:
+                joining.append(self._pending.get_nowait())
+        except queue.Empty:
+            pass
+        return [seq for seq in joining if not self._drop_if_cancelled(seq)]
+
+    def _prefill(self, joining: List[_Sequence]) -> None:
+        batched = []
+        for seq in joining:
+            ids = self.tokenizer(seq.prompt, max_length=self.max_prompt_tokens, truncation=True)["input_ids"]
+            seq.tokens = list(ids)
+            seq.prompt_length = len(ids)
+            seq.processors = self._build_processors(seq)
+            cached = None
+            if seq.prefix is not None and self.prefix_cache is not None:
+                cached = self.prefix_cache.lookup(seq.tokens, seq.prefix)
+            if cached is None:
+                batched.append(seq)
+            else:
+                self._prefill_from_prefix(seq, *cached)
+
+        if not batched:
+            return
+        width = max(len(seq.tokens) for seq in batched)
+        input_ids = torch.full((len(batched), width), self.pad_token_id, dtype=torch.long)
+        mask = torch.zeros((len(batched), width), dtype=torch.long)
+        for i, seq in enumerate(batched):
+            input_ids[i, width - len(seq.tokens):] = torch.tensor(seq.tokens, dtype=torch.long)
+            mask[i, width - len(seq.tokens):] = 1
+        position_ids = (mask.cumsum(-1) - 1).clamp(min=0)
+
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=mask,
+            position_ids=position_ids,
+            use_cache=True
+        )
+        self._merge(batched, to_legacy_cache(outputs.past_key_values), mask)
+        self._sample(batched, outputs.logits[:, -1, :], offset=len(self._active) - len(batched))
+
+    def _prefill_from_prefix(self, seq: _Sequence, prefix_length: int, prefix_cache: list) -> None:
+        """
+        Prefill only the tokens after a cached prefix, then join the batch
+        """
+        length = len(seq.tokens)
+        outputs = self.model(
+            input_ids=torch.tensor([seq.tokens[prefix_length:]], dtype=torch.long),
+            attention_mask=torch.ones((1, length), dtype=torch.long),
+            position_ids=torch.arange(prefix_length, length, dtype=torch.long).unsqueeze(0),
+            past_key_values=from_legacy_cache(prefix_cache),
+            use_cache=True
+        )
+        self._merge([seq], to_legacy_cache(outputs.past_key_values), torch.ones((1, length), dtype=torch.long))
+        self._sample([seq], outputs.logits[:, -1, :], offset=len(self._active) - 1)
+
+    def _decode_step(self) -> None:
+        batch = len(self._active)
+        input_ids = torch.tensor([[seq.tokens[-1]] for seq in self._active], dtype=torch.long)
+        position_ids = torch.tensor([[len(seq.tokens) - 1] for seq in self._active], dtype=torch.long)
+        mask = torch.cat([self._mask, torch.ones((batch, 1), dtype=torch.long)], dim=1)
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=mask,
+            position_ids=position_ids,
+            past_key_values=from_legacy_cache(self._cache),
+            use_cache=True
+        )
+        self._cache = to_legacy_cache(outputs.past_key_values)
+        self._mask = mask
+        self.steps += 1
+        self.batched_rows += batch
+        self._sample(list(self._active), outputs.logits[:, -1, :], offset=0)
+
+    def _sample(self, sequences: List[_Sequence], logits: torch.Tensor, offset: int) -> None:
+        finished = []
+        now = time.perf_counter()
+        for i, seq in enumerate(sequences):
+            ids = torch.tensor([seq.tokens], dtype=torch.long)
+            scores = seq.processors(ids, logits[i:i + 1].float())
+            if seq.params.get("do_sample", False):
+                token = int(torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1)[0, 0])
+            else:
+                token = int(torch.argmax(scores, dim=-1)[0])
+            seq.tokens.append(token)
+            self.tokens_generated += 1
+            if seq.first_token_at is None:
+                seq.first_token_at = now
+                self._first_token_latencies.append(now - seq.submitted_at)
+
+            done = token in self.eos_token_ids
+            if not done and seq.streamer is not None:
+                seq.streamer.put(torch.tensor([token]))
+            if done or len(seq.generated) >= seq.params.get("max_new_tokens", 150) or seq.cancelled:
+                finished.append(offset + i)
+
+        if finished:
+            self._remove(finished)
+
+    def _build_processors(self, seq: _Sequence) -> LogitsProcessorList:
+        params = seq.params
+        processors = LogitsProcessorList()
+        if params.get("repetition_penalty", 1.0) != 1.0:
+            processors.append(RepetitionPenaltyLogitsProcessor(params["repetition_penalty"]))
+        if params.get("no_repeat_ngram_size", 0) > 0:
+            processors.append(NoRepeatNGramLogitsProcessor(params["no_repeat_ngram_size"]))
+        if params.get("min_new_tokens", 0) > 0 and self.eos_token_ids:
+            processors.append(MinNewTokensLengthLogitsProcessor(
+                seq.prompt_length, params["min_new_tokens"], list(self.eos_token_ids)))
+        if params.get("do_sample", False):
+            if params.get("temperature", 1.0) != 1.0:
+                processors.append(TemperatureLogitsWarper(params["temperature"]))
+            if params.get("top_k", 0) > 0:
+                processors.append(TopKLogitsWarper(params["top_k"]))
+            if params.get("top_p", 1.0) < 1.0:
+                processors.append(TopPLogitsWarper(params["top_p"]))
+        return processors
+
+    def _merge(self, joining: List[_Sequence], cache, mask: torch.Tensor) -> None:
+        """
+        Append newly prefilled rows to the running batch, left-padding whichever side is shorter
+        """
+        if self._cache is None:
+            self._cache, self._mask = cache, mask
+        else:
+            width = max(self._mask.shape[1], mask.shape[1])
+            self._cache = [
+                (torch.cat([_pad_left(k, width), _pad_left(new_k, width)], dim=0),
+                 torch.cat([_pad_left(v, width), _pad_left(new_v, width)], dim=0))
+                for (k, v), (new_k, new_v) in zip(self._cache, cache)
+            ]
+            self._mask = torch.cat([
+                F.pad(self._mask, (width - self._mask.shape[1], 0)),
+                F.pad(mask, (width - mask.shape[1], 0))
+            ], dim=0)
+        self._active.extend(joining)
+
+    def _remove(self, finished: List[int]) -> None:
+        """
+        Drop finished rows from the batch and trim padding columns no row needs any more
+        """
+        done = set(finished)
+        for i in finished:
+            self._finish(self._active[i])
+        keep = [i for i in range(len(self._active)) if i not in done]
+        self._active = [self._active[i] for i in keep]
+        if not keep:
+            self._cache = None
+            self._mask = None
+            return
+        index = torch.tensor(keep, dtype=torch.long)
+        mask = self._mask.index_select(0, index)
+        start = int(mask.any(dim=0).nonzero()[0, 0])
+        self._mask = mask[:, start:]
+        self._cache = [
+            (k.index_select(0, index)[:, :, start:, :], v.index_select(0, index)[:, :, start:, :])
+            for k, v in self._cache
+        ]
+
+    def _finish(self, seq: _Sequence) -> None:
+        if seq.streamer is not None:
+            seq.streamer.end()
+        latency = time.perf_counter() - seq.submitted_at
+        self._latencies.append(latency)
+        self.requests_completed += 1
+        generated = [token for token in seq.generated if token not in self.eos_token_ids]
+        if not seq.future.done():
+            seq.future.set_result(generated)
+
+    def _fail(self, seq: _Sequence, error: Exception) -> None:
+        if seq.streamer is not None:
+            seq.streamer.end()
+        self.requests_failed += 1
+        if not seq.future.done():
+            seq.future.set_exception(error)
+
+    def _drop_if_cancelled(self, seq: _Sequence) -> bool:
+        if not seq.cancelled:
+            return False
+        if seq.streamer is not None:
+            seq.streamer.end()
+        if not seq.future.done():
+            seq.future.set_result([])
+        return True
+
+
+def _pad_left(tensor: torch.Tensor, width: int) -> torch.Tensor:
+    # tensor: [batch, heads, seq_len, head_dim]
+    return F.pad(tensor, (0, 0, width - tensor.shape[2], 0))
+
+def to_legacy_cache(past_key_values) -> list:
+    """
+    Per-layer (key, value) tensors from a model's past_key_values, whatever cache class it uses
+    """
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return list(past_key_values.to_legacy_cache())
+    return list(past_key_values)
+
+def from_legacy_cache(cache):
+    """
+    Wrap legacy (key, value) tensors in the cache type the installed transformers expects
+    """
+    if DynamicCache is not None:
+        return DynamicCache.from_legacy_cache(tuple(cache))
+    return tuple(cache)
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
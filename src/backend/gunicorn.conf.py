@@ -0,0 +1,36 @@
+"""
+Preforking multi-worker mode
+
+    gunicorn -c gunicorn.conf.py main:app
+
+The app (models, property index) is imported once in the master process and
+then forked, so every worker shares the read-only pages of the model weights
+and embedding matrix instead of loading its own copy. Each worker reopens its
+MongoDB connection and restarts its background threads after the fork.
+
+With several workers, set PROPERTY_WATCH_ENABLED=true so every worker's
+index follows uploads handled by the other workers.
+"""
+import multiprocessing
+import os
+
+# ต้องกำหนดก่อน import main ใน master process
+os.environ.setdefault("PRELOAD_MODELS", "true")
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# โหลดโมเดลใน master ใช้เวลานาน และ request generate ใช้เวลาหลายวินาที
+timeout = int(os.getenv("WORKER_TIMEOUT", "300"))
+graceful_timeout = 30
+
+def post_fork(server, worker):
+    import torch
+    import main
+
+    # แบ่ง core ให้แต่ละ worker เพื่อไม่ให้ thread ของ torch แย่ง CPU กันเอง
+    threads = int(os.getenv("TORCH_THREADS_PER_WORKER", "0")) or max(1, multiprocessing.cpu_count() // workers)
+    torch.set_num_threads(threads)
+    main.after_fork()
+    server.log.info(f"Worker {worker.pid} ready ({threads} torch threads)")
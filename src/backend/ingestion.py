@@ -0,0 +1,458 @@
+import logging
+import os
+import secrets
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import pandas as pd
+from executors import BoundedExecutor
+
+logger = logging.getLogger(__name__)
+
+# คอลัมน์ที่ไฟล์ข้อมูลอสังหาริมทรัพย์ต้องมี
+EXPECTED_COLUMNS = [
+    'ประเภท', 'โครงการ', 'ราคา', 'รูปแบบ', 'รูป', 'ตำแหน่ง',
+    'สถานศึกษา', 'สถานีรถไฟฟ้า', 'ห้างสรรพสินค้า', 'โรงพยาบาล', 'สนามบิน'
+]
+
+# สถานะของ job ที่ยังทำไม่เสร็จ (กลับมาทำต่อได้หลัง restart)
+UNFINISHED_STATUSES = ("queued", "running")
+MAX_REPORTED_ERRORS = 50
+
+def read_header(path: str, file_ext: str) -> List[str]:
+    """
+    Column names of an uploaded file, reading only its first row
+    """
+    if file_ext == 'csv':
+        return [str(col) for col in pd.read_csv(path, nrows=0).columns]
+    if file_ext == 'xlsx':
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True)
+        try:
+            header = next(workbook.active.iter_rows(max_row=1, values_only=True), ())
+            return [str(col) for col in header if col is not None]
+        finally:
+            workbook.close()
+    return [str(col) for col in pd.read_excel(path, nrows=0).columns]
+
+def missing_columns(columns: List[str]) -> List[str]:
+    return [col for col in EXPECTED_COLUMNS if col not in columns]
+
+def estimate_rows(path: str, file_ext: str) -> Optional[int]:
+    """
+    Approximate number of data rows, for progress and ETA (None if unknown)
+
+    CSV counts line breaks, so quoted multi-line cells make it an overestimate.
+    """
+    try:
+        if file_ext == 'csv':
+            lines = 0
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    lines += block.count(b"\n")
+            return max(lines - 1, 0)
+        if file_ext == 'xlsx':
+            from openpyxl import load_workbook
+            workbook = load_workbook(path, read_only=True)
+            try:
+                max_row = workbook.active.max_row
+                return max(max_row - 1, 0) if max_row else None
+            finally:
+                workbook.close()
+    except Exception as e:
+        logger.error(f"Error estimating rows of {path}: {str(e)}")
+    return None
+
+def iter_chunks(path: str, file_ext: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """
+    Yield the rows of an uploaded file as DataFrames of at most chunk_rows rows
+
+    CSV and xlsx are parsed incrementally. Legacy .xls has no streaming
+    reader, so it is loaded whole and then sliced. Chunk boundaries are
+    deterministic, which is what lets a resumed job skip committed chunks.
+    """
+    if file_ext == 'csv':
+        yield from pd.read_csv(path, chunksize=chunk_rows)
+    elif file_ext == 'xlsx':
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = list(next(rows, ()))
+            chunk = []
+            for row in rows:
+                if all(value is None for value in row):
+                    continue
+                chunk.append(row)
+                if len(chunk) >= chunk_rows:
+                    yield pd.DataFrame(chunk, columns=header)
+                    chunk = []
+            if chunk:
+                yield pd.DataFrame(chunk, columns=header)
+        finally:
+            workbook.close()
+    else:
+        df = pd.read_excel(path)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+
+
+class IngestionJob:
+    def __init__(self,
+                 job_id: str,
+                 filename: str,
+                 path: str,
+                 file_ext: str,
+                 replace_file_id: Optional[str] = None):
+        """
+        Progress and checkpoint of one uploaded file; the job id doubles as the upload's file_id
+
+        `chunks` counts chunks fully committed (stored and indexed); a resumed
+        job skips that many chunks of the spooled file. Rows are counted as
+        inserted (new listing), updated (fields changed), unchanged (already
+        stored as is), duplicate (repeated within the file) or failed.
+        """
+        self.job_id = job_id
+        self.filename = filename
+        self.path = path
+        self.file_ext = file_ext
+        self.replace_file_id = replace_file_id
+        # queued -> running -> completed / completed_with_errors / failed
+        self.status = "queued"
+        self.owner: Optional[str] = None
+        self.chunks = 0
+        self.rows_processed = 0
+        self.rows_inserted = 0
+        self.rows_updated = 0
+        self.rows_unchanged = 0
+        self.rows_duplicate = 0
+        self.rows_failed = 0
+        self.total_rows: Optional[int] = None
+        self.errors: List[Dict[str, Any]] = []
+        self.error: Optional[str] = None
+        self.resumed = 0
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.heartbeat_at = self.created_at
+        # อัตราการนำเข้าคำนวณจากรอบการทำงานปัจจุบันเท่านั้น (ไม่รวมช่วงที่ process ล่ม)
+        self._run_started_at: Optional[float] = None
+        self._run_start_rows = 0
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "IngestionJob":
+        job = cls(record["job_id"], record["filename"], record["path"], record["file_ext"], record.get("replace_file_id"))
+        for field in ("status", "owner", "chunks", "rows_processed", "rows_inserted", "rows_updated", "rows_unchanged",
+                      "rows_duplicate", "rows_failed", "total_rows", "errors", "error", "resumed", "created_at",
+                      "started_at", "finished_at", "heartbeat_at"):
+            if field in record:
+                setattr(job, field, record[field])
+        return job
+
+    def to_record(self) -> Dict[str, Any]:
+        """
+        Everything needed to resume the job, as stored in MongoDB
+        """
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "path": self.path,
+            "file_ext": self.file_ext,
+            "replace_file_id": self.replace_file_id,
+            **self.checkpoint(),
+            "created_at": self.created_at,
+            "started_at": self.started_at
+        }
+
+    def checkpoint(self) -> Dict[str, Any]:
+        return {
+            "status": self.status,
+            "owner": self.owner,
+            "chunks": self.chunks,
+            "rows_processed": self.rows_processed,
+            "rows_inserted": self.rows_inserted,
+            "rows_updated": self.rows_updated,
+            "rows_unchanged": self.rows_unchanged,
+            "rows_duplicate": self.rows_duplicate,
+            "rows_failed": self.rows_failed,
+            "total_rows": self.total_rows,
+            "errors": self.errors,
+            "error": self.error,
+            "resumed": self.resumed,
+            "finished_at": self.finished_at,
+            "heartbeat_at": self.heartbeat_at
+        }
+
+    def rows_per_second(self) -> Optional[float]:
+        if self._run_started_at is None:
+            return None
+        end = self.finished_at or time.time()
+        elapsed = end - self._run_started_at
+        return (self.rows_processed - self._run_start_rows) / elapsed if elapsed > 0 else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        rate = self.rows_per_second()
+        eta = None
+        if self.status == "running" and rate and self.total_rows is not None:
+            eta = max(self.total_rows - self.rows_processed, 0) / rate
+        return {
+            "job_id": self.job_id,
+            "file_id": self.job_id,
+            "filename": self.filename,
+            "status": self.status,
+            "chunks": self.chunks,
+            "rows_processed": self.rows_processed,
+            "rows_inserted": self.rows_inserted,
+            "rows_updated": self.rows_updated,
+            "rows_unchanged": self.rows_unchanged,
+            "rows_duplicate": self.rows_duplicate,
+            "rows_failed": self.rows_failed,
+            "total_rows": self.total_rows,
+            "rows_per_second": rate,
+            "eta_seconds": eta,
+            "errors": self.errors,
+            "error": self.error,
+            "resumed": self.resumed,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+class IngestionPipeline:
+    def __init__(self,
+                 mongodb_manager,
+                 vector_store,
+                 embed: Callable[[List[Dict[str, Any]]], None],
+                 chunk_rows: int = 1000,
+                 max_queued_jobs: int = 16,
+                 lease_seconds: float = 600.0,
+                 finished_job_ttl: float = 3600.0,
+                 max_finished_jobs: int = 100):
+        """
+        Background ingestion queue: parses uploads in bounded chunks, stores and indexes each chunk
+
+        Jobs run one at a time on a dedicated worker. For each chunk the rows
+        are upserted into MongoDB by listing fingerprint, and only new or
+        changed listings, plus unchanged ones the vector store does not hold,
+        are passed to `embed`. Re-uploading a sheet therefore neither
+        duplicates listings nor re-embeds unchanged ones, and it repairs
+        listings that were stored by an earlier job but never indexed. Memory stays bounded by chunk_rows
+        regardless of file size.
+
+        Job state lives in the `ingestion_jobs` collection and is checkpointed
+        after every committed chunk. A job owned by a dead process on this
+        host, or whose heartbeat is older than lease_seconds, is claimed
+        (compare-and-swap on the owner) by resume_pending() and continues from
+        its last committed chunk. Writes are upserts, so replaying the chunk
+        that was in flight when the process died stores nothing twice.
+
+        Finished jobs stay in `jobs` for finished_job_ttl seconds, and at most
+        max_finished_jobs of them are kept. After that status() reads them
+        from MongoDB.
+        """
+        self.mongodb_manager = mongodb_manager
+        self.vector_store = vector_store
+        self.embed = embed
+        self.chunk_rows = chunk_rows
+        self.lease_seconds = lease_seconds
+        self.finished_job_ttl = finished_job_ttl
+        self.max_finished_jobs = max_finished_jobs
+        self.executor = BoundedExecutor("ingestion", max_workers=1, max_queue=max_queued_jobs)
+        self.jobs: Dict[str, IngestionJob] = {}
+        self._lock = threading.Lock()
+        self._hostname = socket.gethostname()
+        self._token = secrets.token_hex(4)
+
+    @property
+    def owner(self) -> str:
+        # คำนวณใหม่ทุกครั้ง เพราะ worker ที่ fork มาจะมี pid ต่างจาก master
+        return f"{self._hostname}:{os.getpid()}:{self._token}"
+
+    def submit(self, path: str, file_ext: str, job_id: str, filename: str, replace_file_id: Optional[str] = None) -> IngestionJob:
+        """
+        Queue a spooled upload for ingestion; raises QueueFullError when too many jobs are waiting
+        """
+        job = IngestionJob(job_id, filename, path, file_ext, replace_file_id)
+        job.owner = self.owner
+        self.mongodb_manager.save_ingestion_job(job.to_record())
+        self._enqueue(job)
+        return job
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Live status of a job (from this process, or from MongoDB if another worker owns it)
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        record = self.mongodb_manager.get_ingestion_job(job_id)
+        return IngestionJob.from_record(record).to_dict() if record else None
+
+    def resume_pending(self) -> int:
+        """
+        Claim and requeue unfinished jobs whose owner is gone; returns how many were resumed
+        """
+        resumed = 0
+        try:
+            records = self.mongodb_manager.get_unfinished_ingestion_jobs()
+        except Exception as e:
+            logger.error(f"Error loading unfinished ingestion jobs: {str(e)}")
+            return 0
+        for record in records:
+            if not self._owner_gone(record):
+                continue
+            claimed = self.mongodb_manager.claim_ingestion_job(record["job_id"], record.get("owner"), self.owner)
+            if claimed is None:
+                # worker อื่นรับไปแล้ว
+                continue
+            job = IngestionJob.from_record(claimed)
+            if not os.path.exists(job.path):
+                job.status = "failed"
+                job.error = "Uploaded file is no longer available"
+                job.finished_at = time.time()
+                self.mongodb_manager.update_ingestion_job(job.job_id, job.owner, job.checkpoint())
+                continue
+            job.resumed += 1
+            self._enqueue(job)
+            resumed += 1
+            logger.info(f"Resuming ingestion of {job.filename} from chunk {job.chunks}")
+        return resumed
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
+
+    def _enqueue(self, job: IngestionJob) -> None:
+        self.executor.submit(self._run, job)
+        with self._lock:
+            self.jobs[job.job_id] = job
+            self._prune_locked()
+
+    def _prune_locked(self) -> None:
+        # job ที่เสร็จแล้วไม่ต้องอยู่ในหน่วยความจำตลอดไป (worker ที่รันนานจะโตไม่จำกัด)
+        now = time.time()
+        finished = sorted((job for job in self.jobs.values() if job.finished_at is not None),
+                          key=lambda job: job.finished_at)
+        excess = len(finished) - self.max_finished_jobs
+        for index, job in enumerate(finished):
+            if index < excess or now - job.finished_at > self.finished_job_ttl:
+                del self.jobs[job.job_id]
+
+    def _forget(self, job: IngestionJob) -> None:
+        # worker อื่นเป็นเจ้าของ job แล้ว: สถานะล่าสุดอยู่ใน MongoDB
+        with self._lock:
+            if self.jobs.get(job.job_id) is job:
+                del self.jobs[job.job_id]
+
+    def _owner_gone(self, record: Dict[str, Any]) -> bool:
+        if time.time() - record.get("heartbeat_at", 0) > self.lease_seconds:
+            return True
+        host, _, rest = (record.get("owner") or "").partition(":")
+        pid = rest.split(":")[0]
+        if host != self._hostname or not pid.isdigit():
+            return False
+        if record.get("owner") == self.owner:
+            return False
+        try:
+            os.kill(int(pid), 0)
+            return False
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            return False
+
+    def _checkpoint(self, job: IngestionJob) -> bool:
+        """
+        Persist progress; False when another worker has taken the job over
+        """
+        job.heartbeat_at = time.time()
+        return self.mongodb_manager.update_ingestion_job(job.job_id, job.owner, job.checkpoint())
+
+    def _run(self, job: IngestionJob) -> None:
+        job.status = "running"
+        job.started_at = job.started_at or time.time()
+        job._run_started_at = time.time()
+        job._run_start_rows = job.rows_processed
+        finished = False
+        try:
+            if job.total_rows is None:
+                job.total_rows = estimate_rows(job.path, job.file_ext)
+            if not self._checkpoint(job):
+                logger.warning(f"Ingestion job {job.job_id} is owned by another worker, skipping")
+                self._forget(job)
+                return
+
+            # ถ้าเป็นการอัพโหลดแทนชุดข้อมูลเดิม ให้ลบชุดเดิมออกก่อน
+            if job.replace_file_id and job.chunks == 0:
+                try:
+                    self.mongodb_manager.delete_properties(job.replace_file_id)
+                    self.vector_store.remove_by_file_id(job.replace_file_id)
+                except Exception as e:
+                    logger.error(f"Error removing replaced upload {job.replace_file_id}: {str(e)}")
+
+            for index, df in enumerate(iter_chunks(job.path, job.file_ext, self.chunk_rows)):
+                if index < job.chunks:
+                    continue
+                self._ingest_chunk(job, index, df)
+                job.chunks = index + 1
+                if not self._checkpoint(job):
+                    logger.warning(f"Lost ownership of ingestion job {job.job_id}, stopping")
+                    self._forget(job)
+                    return
+
+            job.status = "completed_with_errors" if job.rows_failed else "completed"
+            logger.info(f"Ingested {job.rows_inserted} rows from {job.filename} in {job.chunks} chunks")
+            finished = True
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"Error ingesting {job.filename}: {str(e)}")
+            finished = True
+        finally:
+            if finished:
+                job.finished_at = time.time()
+                try:
+                    self._checkpoint(job)
+                except Exception as e:
+                    logger.error(f"Error saving ingestion job {job.job_id}: {str(e)}")
+                try:
+                    os.remove(job.path)
+                except OSError:
+                    pass
+                with self._lock:
+                    self._prune_locked()
+
+    def _ingest_chunk(self, job: IngestionJob, index: int, df: pd.DataFrame) -> None:
+        records = df.fillna("ไม่มี").to_dict('records')
+        job.rows_processed += len(records)
+        if not records:
+            return
+        try:
+            result = self.mongodb_manager.store_properties(records, job.job_id)
+        except Exception as e:
+            self._record_error(job, index, len(records), str(e))
+            return
+
+        job.rows_inserted += result["inserted"]
+        job.rows_updated += result["updated"]
+        job.rows_unchanged += result["unchanged"]
+        job.rows_duplicate += result["duplicates"]
+        if result["failed"]:
+            self._record_error(job, index, result["failed"], str(result["errors"])[:500])
+        # ประกาศที่ไม่เปลี่ยนแต่ไม่อยู่ใน index (เช่น embed ของ job ก่อนหน้าล้มเหลวหลังบันทึกแล้ว) ต้อง embed ด้วย
+        missing = self.vector_store.missing_ids(doc["_id"] for doc in result["kept"])
+        to_embed = result["changed"] + [doc for doc in result["kept"] if doc["_id"] in missing]
+        if to_embed:
+            self.embed(to_embed)
+        if result["retagged"]:
+            # ประกาศเดิมที่ไม่เปลี่ยนแปลง: ย้ายไปอยู่กับไฟล์ใหม่โดยไม่ต้อง embed ซ้ำ
+            self.vector_store.set_file_id(result["retagged"], job.job_id)
+
+    @staticmethod
+    def _record_error(job: IngestionJob, chunk: int, rows: int, message: str) -> None:
+        job.rows_failed += rows
+        if len(job.errors) < MAX_REPORTED_ERRORS:
+            job.errors.append({"chunk": chunk, "rows": rows, "error": message})
+        logger.error(f"Ingestion job {job.job_id}: chunk {chunk} failed for {rows} rows: {message}")
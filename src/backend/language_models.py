@@ -1,190 +1,466 @@
+import gc
 import logging
-from typing import Dict, Any, List
-from transformers import AutoTokenizer, AutoModelForCausalLM
+import threading
+import time
+from typing import Dict, Any, List, Optional, Iterator
+from transformers import (
+    AutoTokenizer, TextIteratorStreamer, StoppingCriteria, StoppingCriteriaList
+)
 # ใช้ meta-llama/Llama-3.2-1B สำหรับทุกการ generate
-from config import MODEL_CONFIG, CONSULTATION_STYLES
+from config import (
+    MODEL_CONFIG, GENERATION_SCHEDULER_CONFIG, PREFIX_CACHE_ENABLED,
+    GENERATOR_QUANTIZATION, QUANTIZED_MODEL_CACHE_DIR
+)
+from generation_scheduler import GenerationScheduler, SAMPLING_PARAMS, from_legacy_cache
+from prefix_cache import PromptPrefixCache
+from quantization import load_causal_lm, model_memory_bytes
+from executors import QueueFullError
 
 logger = logging.getLogger(__name__)
 
+# คำตอบสำรองแบบ hardcoded เมื่อโมเดลตอบกลับว่างเปล่า
+FALLBACK_RESPONSES = {
+    "formal": "ขออภัยครับ ทางเราไม่พบข้อมูลอสังหาริมทรัพย์ที่ตรงกับคำถาม กรุณาลองใช้คำค้นหาอื่น หรือติดต่อเจ้าหน้าที่เพื่อขอข้อมูลเพิ่มเติม",
+    "casual": "เราไม่เจอข้อมูลที่คุณถาม ลองถามใหม่ด้วยคำอื่นได้นะ หรือจะติดต่อเจ้าหน้าที่ก็ได้ครับ",
+    "friendly": "อุ๊ย! ขอโทษนะคะ ยังไม่เจอที่ตรงใจเลย ลองถามใหม่แบบอื่นไหมคะ หรือจะคุยกับพนักงานของเราโดยตรงก็ได้นะคะ",
+    "professional": "ผมขอแจ้งว่าไม่พบข้อมูลอสังหาริมทรัพย์ที่ตรงตามเงื่อนไขในระบบ ผมแนะนำให้ปรับเปลี่ยนคำค้นหา หรือหากต้องการความช่วยเหลือเพิ่มเติม สามารถติดต่อทีมงานมืออาชีพของเราได้ครับ"
+}
+
+# ส่วนต้นของ prompt ที่เหมือนกันทุก request: template ทุกตัวขึ้นต้นด้วยค่านี้
+# KV cache ของส่วนนี้คำนวณครั้งเดียวแล้วใช้ซ้ำ
+CONSULTANT_PREAMBLE = "\n            คุณเป็นที่ปรึกษาอสังหาริมทรัพย์ที่พูดภาษาไทย"
+PROMPT_PREFIXES = (CONSULTANT_PREAMBLE,)
+
+# ไม่พบอสังหาริมทรัพย์ที่ตรงเงื่อนไข (ใช้ทั้งใน _build_prompt และ generate_fallback_response)
+NO_MATCH_PROMPT = CONSULTANT_PREAMBLE + """
+            ลูกค้าถามว่า: {query}
+            แต่เราไม่พบอสังหาริมทรัพย์ที่ตรงตามเงื่อนไข
+            กรุณาตอบในรูปแบบ {style} โดยแสดงความเห็นอกเห็นใจและแนะนำทางเลือกอื่น
+            """
+
+MATCH_PROMPT = CONSULTANT_PREAMBLE + """
+            ลูกค้าถามว่า: {query}
+            \nคุณพบอสังหาริมทรัพย์ที่ตรงตามเงื่อนไขดังนี้:
+            {property_text}
+            \nกรุณาตอบในรูปแบบ {style} โดยแนะนำอสังหาริมทรัพย์เหล่านี้ให้ลูกค้า
+            """
+
+class _CancelledCriteria(StoppingCriteria):
+    def __init__(self, cancel_event: threading.Event):
+        """
+        Stops generation once cancel_event is set
+        """
+        self.cancel_event = cancel_event
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.cancel_event.is_set()
+
+class _LengthTracker(StoppingCriteria):
+    def __init__(self):
+        """
+        Records the sequence length at every step (never stops generation)
+        """
+        self.length = 0
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        self.length = input_ids.shape[-1]
+        return False
+
 class LanguageModelManager:
     # ระบบนี้รองรับเฉพาะภาษาไทยเท่านั้น (Thai only)
-    def __init__(self):
+    def __init__(self, quantization: Optional[str] = None):
         """
         Manages language model interactions for the AI property consultant
+
+        The model is loaded lazily on first use (or explicitly via load/warmup),
+        so constructing the manager is cheap. Use get_language_model() to share
+        a single instance across the process. `quantization` selects the CPU
+        execution mode ("none", "bf16" or "int8"; default from config).
         """
         self.model_config = MODEL_CONFIG
-        self.tokenizer = AutoTokenizer.from_pretrained("meta-llama/Llama-3.2-1B")
-        self.model = AutoModelForCausalLM.from_pretrained("meta-llama/Llama-3.2-1B")
-        # Ensure pad_token exists for generation
-        if self.tokenizer.pad_token is None:
-            if self.tokenizer.eos_token is not None:
-                self.tokenizer.pad_token = self.tokenizer.eos_token
-            else:
-                self.tokenizer.add_special_tokens({'pad_token': '[PAD]'})
-                self.model.resize_token_embeddings(len(self.tokenizer))
-        logger.info("Initialized LanguageModelManager with meta-llama/Llama-3.2-1B model (pad_token_id={})".format(self.tokenizer.pad_token_id))
-        
-    def generate_fallback_response(self, query: str, style: str) -> str:
+        self.model_name = MODEL_CONFIG['language_model']
+        self.requested_quantization = quantization or GENERATOR_QUANTIZATION
+        # mode ที่ใช้จริง (bf16 จะถอยกลับเป็น none ถ้า CPU ไม่รองรับ)
+        self.quantization: Optional[str] = None
+        self.memory_bytes: Optional[int] = None
+        self.tokenizer = None
+        self.model = None
+        # สถานะ: not_loaded -> loading -> ready (หรือ failed) -> closed
+        self.status = "not_loaded"
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self._load_lock = threading.Lock()
+        # continuous batching scheduler (สร้างเมื่อโหลดโมเดลแล้ว ถ้าเปิดใช้ใน config)
+        self.scheduler: Optional[GenerationScheduler] = None
+        self.prefix_cache: Optional[PromptPrefixCache] = None
+        # สถิติต่อ decoding profile: {ชื่อ profile: {requests, seconds, new_tokens}}
+        self._profile_stats: Dict[str, Dict[str, float]] = {}
+        self._stats_lock = threading.Lock()
+
+    def load(self) -> None:
         """
-        Generate fallback response using meta-llama/Llama-3.2-1B
+        Load tokenizer and weights (no-op if already loaded)
         """
-        try:
-            prompt = f"""
-            คุณเป็นที่ปรึกษาอสังหาริมทรัพย์ที่พูดภาษาไทย
-            ลูกค้าถามว่า: {query}
-            แต่เราไม่พบอสังหาริมทรัพย์ที่ตรงตามเงื่อนไข
-            กรุณาตอบในรูปแบบ {style} โดยแสดงความเห็นอกเห็นใจและแนะนำทางเลือกอื่น
-            """
+        if self.status == "ready":
+            return
+        with self._load_lock:
+            if self.status == "ready":
+                return
+            self.status = "loading"
+            started = time.perf_counter()
+            try:
+                tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                # Ensure pad_token exists for generation
+                vocab_size = None
+                if tokenizer.pad_token is None:
+                    if tokenizer.eos_token is not None:
+                        tokenizer.pad_token = tokenizer.eos_token
+                    else:
+                        tokenizer.add_special_tokens({'pad_token': '[PAD]'})
+                        vocab_size = len(tokenizer)
+                model, self.quantization = load_causal_lm(
+                    self.model_name,
+                    self.requested_quantization,
+                    cache_dir=QUANTIZED_MODEL_CACHE_DIR,
+                    vocab_size=vocab_size
+                )
+                self.memory_bytes = model_memory_bytes(model)
+                self.tokenizer = tokenizer
+                self.model = model
+                if PREFIX_CACHE_ENABLED:
+                    self.prefix_cache = PromptPrefixCache(model, tokenizer)
+                if GENERATION_SCHEDULER_CONFIG['enabled']:
+                    self.scheduler = GenerationScheduler(
+                        model,
+                        tokenizer,
+                        max_batch_size=GENERATION_SCHEDULER_CONFIG['max_batch_size'],
+                        max_pending=GENERATION_SCHEDULER_CONFIG['max_pending']
+                    )
+                    self.scheduler.prefix_cache = self.prefix_cache
+                    self.scheduler.start()
+                self.load_seconds = time.perf_counter() - started
+                self.error = None
+                self.status = "ready"
+                logger.info("Initialized LanguageModelManager with {} model ({}, {:.0f} MB) in {:.1f}s (pad_token_id={})".format(
+                    self.model_name, self.quantization, self.memory_bytes / 2**20, self.load_seconds,
+                    self.tokenizer.pad_token_id))
+            except Exception as e:
+                self.status = "failed"
+                self.error = str(e)
+                logger.error(f"Error loading language model: {str(e)}")
+                raise
+
+    def ensure_loaded(self) -> None:
+        """
+        Load the model on first use
+        """
+        if self.status != "ready":
+            self.load()
+
+    def warmup(self) -> None:
+        """
+        Load the model and run one tiny generation so the first request is not slow
+        """
+        self.ensure_loaded()
+        started = time.perf_counter()
+        inputs = self.tokenizer("สวัสดี", return_tensors="pt")
+        self.model.generate(
+            input_ids=inputs["input_ids"],
+            attention_mask=inputs["attention_mask"],
+            max_new_tokens=1,
+            pad_token_id=self.tokenizer.pad_token_id
+        )
+        if self.prefix_cache is not None:
+            self.prefix_cache.warm(list(PROMPT_PREFIXES))
+        self.warmup_seconds = time.perf_counter() - started
+        logger.info(f"Language model warm-up finished in {self.warmup_seconds:.2f}s")
+
+    def after_fork(self) -> None:
+        """
+        Reset per-process state in a forked worker; weights loaded before the fork stay shared copy-on-write
+        """
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        if self.scheduler is not None:
+            self.scheduler.after_fork()
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "status": self.status,
+            "error": self.error,
+            "quantization": self.quantization,
+            "memory_bytes": self.memory_bytes,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "scheduler": self.scheduler.stats() if self.scheduler is not None else None,
+            "prefix_cache": self.prefix_cache.stats() if self.prefix_cache is not None else None,
+            "decoding_profiles": self.decoding_stats()
+        }
+
+    def resolve_profile(self, endpoint: str, style: Optional[str] = None, profile: Optional[str] = None) -> str:
+        """
+        Pick the decoding profile: explicit name, then per-style override, then per-endpoint default
+        """
+        profiles = self.model_config['decoding_profiles']
+        name = profile or self.model_config['style_profiles'].get(style) or self.model_config['endpoint_profiles'].get(endpoint)
+        if name not in profiles:
+            logger.warning(f"Unknown decoding profile {name!r} for {endpoint}, using 'sampled'")
+            name = "sampled"
+        return name
+
+    def decoding_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Latency and token counts per decoding profile
+        """
+        with self._stats_lock:
+            return {
+                name: {
+                    "requests": int(stats["requests"]),
+                    "average_seconds": stats["seconds"] / stats["requests"],
+                    "average_new_tokens": stats["new_tokens"] / stats["requests"],
+                    "tokens_per_second": stats["new_tokens"] / stats["seconds"] if stats["seconds"] else 0.0
+                }
+                for name, stats in self._profile_stats.items()
+            }
+
+    def _record(self, profile: str, seconds: float, new_tokens: int) -> None:
+        with self._stats_lock:
+            stats = self._profile_stats.setdefault(profile, {"requests": 0, "seconds": 0.0, "new_tokens": 0})
+            stats["requests"] += 1
+            stats["seconds"] += seconds
+            stats["new_tokens"] += new_tokens
+
+    def _prompt_prefix(self, prompt: str) -> Optional[str]:
+        if self.prefix_cache is None:
+            return None
+        return next((prefix for prefix in PROMPT_PREFIXES if prompt.startswith(prefix)), None)
+
+    def _prefix_kwargs(self, prompt: str, input_ids) -> Dict[str, Any]:
+        """
+        past_key_values for model.generate when the prompt starts with a cached prefix
+        """
+        prefix = self._prompt_prefix(prompt)
+        if prefix is None:
+            return {}
+        cached = self.prefix_cache.lookup(input_ids[0].tolist(), prefix)
+        if cached is None:
+            return {}
+        # generate จะ prefill เฉพาะ token หลัง prefix
+        return {"past_key_values": from_legacy_cache(cached[1])}
+
+    def _generate(self, prompt: str, profile: str) -> str:
+        """
+        Generate a completion for prompt with a named decoding profile and record its stats
+
+        Only the generated continuation is decoded (the prompt is never
+        echoed), with or without the generation scheduler.
+        """
+        params = dict(self.model_config['decoding_profiles'][profile])
+        started = time.perf_counter()
+        if self.scheduler is not None and params.get("num_beams", 1) == 1:
+            # รวม decode กับ request อื่นที่กำลัง generate อยู่
+            batched = {key: value for key, value in params.items() if key in SAMPLING_PARAMS}
+            tokens = self.scheduler.submit(prompt, batched, prefix=self._prompt_prefix(prompt)).result()
+            new_tokens = len(tokens)
+        else:
             inputs = self.tokenizer(prompt, return_tensors="pt", max_length=512, truncation=True, padding=True)
+            # beam search ขยาย batch ของ input ภายใน generate จึงใช้ cache ของ prefix (batch 1) ไม่ได้
+            reuse = self._prefix_kwargs(prompt, inputs["input_ids"]) if params.get("num_beams", 1) == 1 else {}
             outputs = self.model.generate(
                 input_ids=inputs["input_ids"],
                 attention_mask=inputs["attention_mask"],
-                max_new_tokens=150,
-                min_new_tokens=30,
-                do_sample=True,
-                num_beams=3,
-                temperature=0.8,
-                top_p=0.95,
-                top_k=40,
-                repetition_penalty=1.3,
-                no_repeat_ngram_size=4,
-                length_penalty=1.2,
-                early_stopping=True,
-                pad_token_id=self.tokenizer.pad_token_id
+                pad_token_id=self.tokenizer.pad_token_id,
+                **reuse,
+                **params
             )
-            response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+            # ตัด prompt ออก ให้ได้เฉพาะส่วนที่ generate เหมือน scheduler
+            tokens = outputs[0][inputs["input_ids"].shape[-1]:]
+            new_tokens = len(tokens)
+        self._record(profile, time.perf_counter() - started, new_tokens)
+        return self.tokenizer.decode(tokens, skip_special_tokens=True)
+
+    def shutdown(self) -> None:
+        """
+        Release model weights
+        """
+        with self._load_lock:
+            if self.scheduler is not None:
+                self.scheduler.stop()
+                self.scheduler = None
+            self.prefix_cache = None
+            self.model = None
+            self.tokenizer = None
+            self.status = "closed"
+        gc.collect()
+        logger.info("Language model released")
+        
+    def generate_fallback_response(self, query: str, style: str, profile: Optional[str] = None) -> str:
+        """
+        Generate fallback response using meta-llama/Llama-3.2-1B
+        """
+        try:
+            self.ensure_loaded()
+            prompt = NO_MATCH_PROMPT.format(query=query, style=style)
+            response = self._generate(prompt, self.resolve_profile("fallback", style, profile))
             if not response.strip():
                 # ถ้ายังว่างเปล่าอีก ให้ใช้ fallback แบบ hardcoded
-                fallback_responses = {
-                    "formal": "ขออภัยครับ ทางเราไม่พบข้อมูลอสังหาริมทรัพย์ที่ตรงกับคำถาม กรุณาลองใช้คำค้นหาอื่น หรือติดต่อเจ้าหน้าที่เพื่อขอข้อมูลเพิ่มเติม",
-                    "casual": "เราไม่เจอข้อมูลที่คุณถาม ลองถามใหม่ด้วยคำอื่นได้นะ หรือจะติดต่อเจ้าหน้าที่ก็ได้ครับ",
-                    "friendly": "อุ๊ย! ขอโทษนะคะ ยังไม่เจอที่ตรงใจเลย ลองถามใหม่แบบอื่นไหมคะ หรือจะคุยกับพนักงานของเราโดยตรงก็ได้นะคะ",
-                    "professional": "ผมขอแจ้งว่าไม่พบข้อมูลอสังหาริมทรัพย์ที่ตรงตามเงื่อนไขในระบบ ผมแนะนำให้ปรับเปลี่ยนคำค้นหา หรือหากต้องการความช่วยเหลือเพิ่มเติม สามารถติดต่อทีมงานมืออาชีพของเราได้ครับ"
-                }
-                return fallback_responses.get(style, fallback_responses["formal"])
+                return FALLBACK_RESPONSES.get(style, FALLBACK_RESPONSES["formal"])
             return response
+        except QueueFullError:
+            raise
         except Exception as e:
             logger.error(f"Error generating fallback response: {str(e)}")
             return "ขออภัย เกิดข้อผิดพลาดในการประมวลผลคำตอบ กรุณาลองใหม่อีกครั้ง"
         
+    def _build_prompt(self, query: str, properties: List[Dict[str, Any]], style: str) -> str:
+        """
+        Build the consultant prompt for the query and matched properties
+        """
+        if not properties:
+            return NO_MATCH_PROMPT.format(query=query, style=style)
+        # Create property description based on the data
+        property_descriptions = []
+        for i, prop in enumerate(properties):
+            desc = f"{i+1}. "
+            if "ประเภท" in prop:
+                desc += f"{prop['ประเภท']} "
+            if "โครงการ" in prop:
+                desc += f"{prop['โครงการ']} "
+            if "ราคา" in prop:
+                desc += f"ราคา {prop['ราคา']} บาท "
+            if "รูปแบบ" in prop:
+                desc += f"({prop['รูปแบบ']}) "
+            nearby = []
+            if "สถานศึกษา" in prop and prop["สถานศึกษา"] != "ไม่มี":
+                nearby.append(f"ใกล้{prop['สถานศึกษา']}")
+            if "สถานีรถไฟฟ้า" in prop and prop["สถานีรถไฟฟ้า"] != "ไม่มี":
+                nearby.append(f"ใกล้{prop['สถานีรถไฟฟ้า']}")
+            if "ห้างสรรพสินค้า" in prop and prop["ห้างสรรพสินค้า"] != "ไม่มี":
+                nearby.append(f"ใกล้{prop['ห้างสรรพสินค้า']}")
+            if nearby:
+                desc += f" {', '.join(nearby)}"
+            property_descriptions.append(desc)
+        property_text = "\n".join(property_descriptions)
+        return MATCH_PROMPT.format(query=query, property_text=property_text, style=style)
+
     def generate_response(self, 
                           query: str, 
                           properties: List[Dict[str, Any]], 
                           style: str = "formal", 
-                          context: List[Dict[str, Any]] = None) -> str:
+                          context: List[Dict[str, Any]] = None,
+                          profile: Optional[str] = None) -> str:
         """
         Generate AI response based on query, matched properties, and consultation style (meta-llama/Llama-3.2-1B)
         """
         try:
-            # Check if we found any properties
-            if not properties:
-                prompt = f"""
-                คุณเป็นที่ปรึกษาอสังหาริมทรัพย์ที่พูดภาษาไทย
-                ลูกค้าถามว่า: {query}
-                แต่เราไม่พบอสังหาริมทรัพย์ที่ตรงตามเงื่อนไข
-                กรุณาตอบในรูปแบบ {style} โดยแสดงความเห็นอกเห็นใจและแนะนำทางเลือกอื่น
-                """
-                inputs = self.tokenizer(prompt, return_tensors="pt", max_length=512, truncation=True, padding=True)
-                outputs = self.model.generate(
-                    input_ids=inputs["input_ids"],
-                    attention_mask=inputs["attention_mask"],
-                    max_new_tokens=150,
-                    min_new_tokens=30,
-                    do_sample=True,
-                    num_beams=3,
-                    temperature=0.8,
-                    top_p=0.95,
-                    top_k=40,
-                    repetition_penalty=1.3,
-                    no_repeat_ngram_size=4,
-                    length_penalty=1.2,
-                    early_stopping=True,
-                    pad_token_id=self.tokenizer.pad_token_id
-                )
-                response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-                # ตรวจสอบว่าคำตอบไม่ว่างเปล่า
-                if not response.strip():
-                    logger.warning("Empty response from model, using fallback response")
-                    return self.generate_fallback_response(query, style)
-                return response
-            # Create property description based on the data
-            property_descriptions = []
-            for i, prop in enumerate(properties):
-                desc = f"{i+1}. "
-                if "ประเภท" in prop:
-                    desc += f"{prop['ประเภท']} "
-                if "โครงการ" in prop:
-                    desc += f"{prop['โครงการ']} "
-                if "ราคา" in prop:
-                    desc += f"ราคา {prop['ราคา']} บาท "
-                if "รูปแบบ" in prop:
-                    desc += f"({prop['รูปแบบ']}) "
-                nearby = []
-                if "สถานศึกษา" in prop and prop["สถานศึกษา"] != "ไม่มี":
-                    nearby.append(f"ใกล้{prop['สถานศึกษา']}")
-                if "สถานีรถไฟฟ้า" in prop and prop["สถานีรถไฟฟ้า"] != "ไม่มี":
-                    nearby.append(f"ใกล้{prop['สถานีรถไฟฟ้า']}")
-                if "ห้างสรรพสินค้า" in prop and prop["ห้างสรรพสินค้า"] != "ไม่มี":
-                    nearby.append(f"ใกล้{prop['ห้างสรรพสินค้า']}")
-                if nearby:
-                    desc += f" {', '.join(nearby)}"
-                property_descriptions.append(desc)
-            property_text = "\n".join(property_descriptions)
-            prompt = f"""
-            คุณเป็นที่ปรึกษาอสังหาริมทรัพย์ที่พูดภาษาไทย
-            ลูกค้าถามว่า: {query}
-            \nคุณพบอสังหาริมทรัพย์ที่ตรงตามเงื่อนไขดังนี้:
-            {property_text}
-            \nกรุณาตอบในรูปแบบ {style} โดยแนะนำอสังหาริมทรัพย์เหล่านี้ให้ลูกค้า
-            """
-            inputs = self.tokenizer(prompt, return_tensors="pt", max_length=512, truncation=True, padding=True)
-            outputs = self.model.generate(
-                input_ids=inputs["input_ids"],
-                attention_mask=inputs["attention_mask"],
-                max_new_tokens=150,
-                min_new_tokens=30,
-                do_sample=True,
-                num_beams=3,
-                temperature=0.8,
-                top_p=0.95,
-                top_k=40,
-                repetition_penalty=1.3,
-                no_repeat_ngram_size=4,
-                length_penalty=1.2,
-                early_stopping=True,
-                pad_token_id=self.tokenizer.pad_token_id
-            )
-            response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+            self.ensure_loaded()
+            prompt = self._build_prompt(query, properties, style)
+            response = self._generate(prompt, self.resolve_profile("chat", style, profile))
             # ตรวจสอบว่าคำตอบไม่ว่างเปล่า
             if not response.strip():
                 logger.warning("Empty response from model, using fallback response")
                 return self.generate_fallback_response(query, style)
             return response
+        except QueueFullError:
+            raise
         except Exception as e:
             logger.error(f"Error generating response: {str(e)}")
             return "ขออภัย เกิดข้อผิดพลาดในการประมวลผลคำตอบ กรุณาลองใหม่อีกครั้ง"
+
+    def stream_response(self,
+                        query: str,
+                        properties: List[Dict[str, Any]],
+                        style: str = "formal",
+                        cancel_event: Optional[threading.Event] = None,
+                        profile: Optional[str] = None) -> Iterator[str]:
+        """
+        Yield response text pieces as they are generated
+
+        Generation runs in a background thread (or in the continuous-batching
+        scheduler when enabled) feeding a TextIteratorStreamer. Streaming
+        cannot be combined with beam search, so a beam profile is decoded
+        with a single beam here. Setting cancel_event stops generation early
+        (e.g. when the client disconnects).
+        """
+        self.ensure_loaded()
+        prompt = self._build_prompt(query, properties, style)
+        profile = self.resolve_profile("stream", style, profile)
+        params = {
+            key: value for key, value in self.model_config['decoding_profiles'][profile].items()
+            if key not in ("num_beams", "length_penalty", "early_stopping")
+        }
+        started = time.perf_counter()
+        if self.scheduler is not None:
+            streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=False, skip_special_tokens=True)
+            batched = {key: value for key, value in params.items() if key in SAMPLING_PARAMS}
+            future = self.scheduler.submit(
+                prompt, batched, cancel_event=cancel_event, streamer=streamer, prefix=self._prompt_prefix(prompt))
+            thread = None
+        else:
+            inputs = self.tokenizer(prompt, return_tensors="pt", max_length=512, truncation=True, padding=True)
+            streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+            reuse = self._prefix_kwargs(prompt, inputs["input_ids"])
+            tracker = _LengthTracker()
+            stopping_criteria = StoppingCriteriaList([
+                _CancelledCriteria(cancel_event or threading.Event()), tracker
+            ])
+
+            def _generate():
+                try:
+                    self.model.generate(
+                        input_ids=inputs["input_ids"],
+                        attention_mask=inputs["attention_mask"],
+                        num_beams=1,
+                        pad_token_id=self.tokenizer.pad_token_id,
+                        streamer=streamer,
+                        stopping_criteria=stopping_criteria,
+                        **reuse,
+                        **params
+                    )
+                except Exception as e:
+                    logger.error(f"Error streaming response: {str(e)}")
+                    # ปลดล็อกผู้ที่รอ token อยู่
+                    streamer.end()
+
+            thread = threading.Thread(target=_generate, name="stream-generate", daemon=True)
+            thread.start()
+        produced = False
+        for text in streamer:
+            if text:
+                produced = True
+                yield text
+        if thread is not None:
+            thread.join()
+            new_tokens = max(0, tracker.length - inputs["input_ids"].shape[-1])
+        else:
+            new_tokens = len(future.result()) if future.exception() is None else 0
+        self._record(profile, time.perf_counter() - started, new_tokens)
+        if not produced and not (cancel_event and cancel_event.is_set()):
+            logger.warning("Empty streamed response from model, using fallback response")
+            yield FALLBACK_RESPONSES.get(style, FALLBACK_RESPONSES["formal"])
             
-    def translate(self, text: str, target_language: str = "en") -> str:
+    def translate(self, text: str, target_language: str = "en", profile: Optional[str] = None) -> str:
         """
         แปลข้อความโดยใช้ meta-llama/Llama-3.2-1B (ควร fine-tune เพิ่มเติมกรณี production)
         """
         logger.info(f"Translation requested to {target_language}")
+        self.ensure_loaded()
         prompt = f"Translate the following text to {target_language}: {text}"
-        inputs = self.tokenizer(prompt, return_tensors="pt", max_length=512, truncation=True, padding=True)
-        outputs = self.model.generate(
-            input_ids=inputs["input_ids"],
-            attention_mask=inputs["attention_mask"],
-            max_new_tokens=150,
-            min_new_tokens=30,
-            do_sample=True,
-            num_beams=3,
-            temperature=0.8,
-            top_p=0.95,
-            top_k=40,
-            repetition_penalty=1.3,
-            no_repeat_ngram_size=4,
-            length_penalty=1.2,
-            early_stopping=True,
-            pad_token_id=self.tokenizer.pad_token_id
-        )
-        return self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+        return self._generate(prompt, self.resolve_profile("translate", profile=profile))
+
+
+_language_model: Optional[LanguageModelManager] = None
+_language_model_lock = threading.Lock()
+
+def get_language_model() -> LanguageModelManager:
+    """
+    Process-wide shared LanguageModelManager (weights are loaded lazily)
+    """
+    global _language_model
+    if _language_model is None:
+        with _language_model_lock:
+            if _language_model is None:
+                _language_model = LanguageModelManager()
+    return _language_model
@@ -0,0 +1,115 @@
+"""
+Concurrent write load test for chat room and user persistence
+
+    python load_test_chat_writes.py --writers 100 --turns 20
+
+Starts `writers` threads that all save chat turns (a user and an assistant
+message, as /api/chat does) into the same new chat room, and the same number
+of threads that save one user record concurrently. Reports p50/p95/max
+latency of save_chat_room per turn, then checks the invariants the atomic
+upserts must keep: exactly one room document, message_count equal to the
+messages written, every seq present exactly once, and a single user
+document. Exits with status 1 if any check fails. The test documents are
+deleted afterwards unless --keep is given.
+"""
+import argparse
+import json
+import secrets
+import sys
+import threading
+import time
+from typing import Any, Dict, List
+from mongodb_manager import MongoDBManager
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+def run(writers: int, turns: int, keep: bool) -> Dict[str, Any]:
+    manager = MongoDBManager()
+    manager.ensure_indexes()
+    chat_room_id = f"loadtest_{secrets.token_hex(6)}"
+    user_id = f"loadtest_user_{secrets.token_hex(6)}"
+    latencies: List[float] = []
+    failures = []
+    lock = threading.Lock()
+    start = threading.Barrier(writers * 2)
+
+    def write_turns(writer: int) -> None:
+        start.wait()
+        for turn in range(turns):
+            messages = [
+                {"role": "user", "content": f"คำถาม {writer}-{turn}", "timestamp": int(time.time() * 1000)},
+                {"role": "assistant", "content": f"คำตอบ {writer}-{turn}", "timestamp": int(time.time() * 1000)}
+            ]
+            started = time.perf_counter()
+            ok = manager.save_chat_room(chat_room_id, messages, user_id)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    failures.append((writer, turn))
+
+    def write_user(writer: int) -> None:
+        start.wait()
+        manager.save_user({"id": user_id, "email": f"{user_id}@example.com", "name": f"writer {writer}", "password": "x"})
+
+    threads = [threading.Thread(target=write_turns, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=write_user, args=(i,)) for i in range(writers)]
+    wall_started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall_started
+
+    expected = writers * turns * 2
+    rooms = manager.chat_rooms.count_documents({"chat_room_id": chat_room_id})
+    room = manager.get_chat_room(chat_room_id) or {}
+    seqs = [message["seq"] for bucket in manager.chat_messages.find({"chat_room_id": chat_room_id}, {"messages.seq": 1})
+            for message in bucket["messages"]]
+    users = manager.users.count_documents({"id": user_id})
+
+    result = {
+        "writers": writers,
+        "turns_per_writer": turns,
+        "failed_writes": len(failures),
+        "turns_per_second": len(latencies) / wall if wall > 0 else None,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p95_ms": _percentile(latencies, 0.95) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else 0.0,
+        "room_documents": rooms,
+        "message_count": room.get("message_count"),
+        "messages_stored": len(seqs),
+        "expected_messages": expected,
+        "duplicate_seqs": len(seqs) - len(set(seqs)),
+        "user_documents": users
+    }
+    result["passed"] = (
+        not failures
+        and rooms == 1
+        and room.get("message_count") == expected
+        and sorted(seqs) == list(range(expected))
+        and users == 1
+    )
+
+    if not keep:
+        manager.chat_rooms.delete_many({"chat_room_id": chat_room_id})
+        manager.chat_messages.delete_many({"chat_room_id": chat_room_id})
+        manager.users.delete_many({"id": user_id})
+    manager.close()
+    return result
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--keep", action="store_true", help="keep the test documents for inspection")
+    args = parser.parse_args()
+
+    result = run(args.writers, args.turns, args.keep)
+    print(json.dumps(result, ensure_ascii=False))
+    return 0 if result["passed"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,34 @@
+import time
+# เวลาเริ่ม process (ก่อน import ไลบรารีหนัก) สำหรับวัด cold start
+PROCESS_STARTED_AT = time.monotonic()
 from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.security import APIKeyHeader
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
-import pandas as pd
-import io
 import logging
 import os
 from datetime import datetime, timedelta
-import time
 import secrets
 import traceback
 import random
 import json
+import asyncio
+import threading
+import gc
 from mongodb_manager import MongoDBManager
 from vector_store import VectorStore
-from language_models import LanguageModelManager
+from language_models import get_language_model
+from property_watcher import PropertyChangeWatcher
+from executors import BoundedExecutor, QueueFullError
+from readiness import ReadinessTracker
+from ingestion import IngestionPipeline, read_header, missing_columns
+from chat_write_buffer import ChatWriteBuffer
+from config import (
+    PROPERTY_WATCH_ENABLED, EXECUTOR_CONFIG, GENERATION_SCHEDULER_CONFIG, MODEL_CONFIG,
+    STARTUP_READY_BUDGET_SECONDS, PRELOAD_MODELS, INGESTION_CONFIG, CHAT_WRITE_BUFFER_CONFIG, MONGODB_DRIVER
+)
 # Thai only: ใช้ Llama-3.2-1B สำหรับทุกการ generate
 
 # Setup logging
@@ -26,7 +39,7 @@ logger = logging.getLogger(__name__)
 app = FastAPI(title="AI Property Consultant API")
 
 # Configure CORS
-app.add_middleware
+app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allows all origins in development
     allow_credentials=True,
@@ -36,8 +49,92 @@ app.add_middleware
 
 # Initialize MongoDB manager
 mongodb_manager = MongoDBManager()
-# Thai only: สร้าง instance ของ Llama-3.2-1B LanguageModelManager
-model_manager = LanguageModelManager()
+# บันทึกข้อความแชทแบบ write-behind (ไม่ให้เวลาเขียน MongoDB ไปอยู่ใน latency ของผู้ใช้)
+chat_writes = ChatWriteBuffer(
+    mongodb_manager,
+    mode=CHAT_WRITE_BUFFER_CONFIG['mode'],
+    max_batch_messages=CHAT_WRITE_BUFFER_CONFIG['max_batch_messages'],
+    flush_interval=CHAT_WRITE_BUFFER_CONFIG['flush_interval_ms'] / 1000,
+    max_pending_messages=CHAT_WRITE_BUFFER_CONFIG['max_pending_messages'],
+    ack_timeout=CHAT_WRITE_BUFFER_CONFIG['ack_timeout'],
+    fallback_path=CHAT_WRITE_BUFFER_CONFIG['fallback_path']
+)
+# Thai only: instance เดียวของ Llama-3.2-1B LanguageModelManager ที่ใช้ร่วมกันทุก request
+model_manager = get_language_model()
+# Shared property index: สร้างครั้งเดียวตอนเริ่มระบบ และใช้ร่วมกันทุก request (โหลด encoder ใน background)
+property_index = VectorStore(lazy=True)
+# สถานะการเริ่มระบบของแต่ละ component (ดูได้ที่ /api/ready)
+readiness = ReadinessTracker(
+    ["mongo", "mongo_setup", "embedder", "index", "generator"],
+    started_at=PROCESS_STARTED_AT,
+    budget_seconds=STARTUP_READY_BUDGET_SECONDS
+)
+# ติดตามการแก้ไขข้อมูลใน MongoDB โดยตรง (เปิดใช้ผ่าน PROPERTY_WATCH_ENABLED)
+property_watcher = PropertyChangeWatcher(mongodb_manager.properties, property_index)
+
+# งานที่บล็อก (inference ของโมเดล และ I/O กับ MongoDB) ไม่รันบน event loop โดยตรง
+inference_executor = BoundedExecutor(
+    "inference",
+    max_workers=EXECUTOR_CONFIG['inference_workers'],
+    max_queue=EXECUTOR_CONFIG['inference_queue_size']
+)
+io_executor = BoundedExecutor(
+    "mongo-io",
+    max_workers=EXECUTOR_CONFIG['io_workers'],
+    max_queue=EXECUTOR_CONFIG['io_queue_size']
+)
+# batcher ส่ง batch ทีละชุด: pool แยกทำให้ encode คำค้นหาไม่ต้องรอ generation ที่ครอง inference worker อยู่
+embedding_executor = BoundedExecutor(
+    "embedding",
+    max_workers=EXECUTOR_CONFIG['embedding_workers'],
+    max_queue=EXECUTOR_CONFIG['embedding_queue_size']
+)
+property_index.embedding_batcher.executor = embedding_executor
+if GENERATION_SCHEDULER_CONFIG['enabled']:
+    # generation ทำใน scheduler thread เดียว: worker เหล่านี้แค่รอผลลัพธ์ จึงต้องมีพอสำหรับทุก request ที่ batch รับได้
+    generation_executor = BoundedExecutor(
+        "generation",
+        max_workers=GENERATION_SCHEDULER_CONFIG['max_batch_size'] + GENERATION_SCHEDULER_CONFIG['max_pending'],
+        max_queue=0
+    )
+else:
+    generation_executor = inference_executor
+
+# MONGODB_DRIVER=motor: handler await MongoDB โดยตรง (สร้างใน startup hook เพราะผูกกับ event loop ของ worker)
+async_mongodb_manager = None
+
+async def mongo_call(method: str, *args) -> Any:
+    """
+    เรียก method ของ MongoDBManager: ผ่าน motor ถ้าเปิดใช้ ไม่เช่นนั้นรัน pymongo บน io executor
+    """
+    if async_mongodb_manager is not None:
+        return await getattr(async_mongodb_manager, method)(*args)
+    return await io_executor.run(getattr(mongodb_manager, method), *args)
+
+def index_ingested_rows(records: List[Dict[str, Any]]) -> None:
+    # embed แต่ละ chunk ผ่าน inference executor (ประกาศที่ถูกแก้ไขจะแทนที่ entry เดิมที่มี _id เดียวกัน)
+    # รอคิวว่างแทนการล้มเหลวด้วย QueueFullError เมื่อมีแชทเข้ามามาก เพราะแถวถูกบันทึกลง MongoDB ไปแล้ว
+    inference_executor.submit_wait(property_index.upsert_properties, records).result()
+
+# นำเข้าไฟล์อัพโหลดทีละ chunk ใน background (ติดตามผลผ่าน /api/upload/jobs/{job_id})
+ingestion = IngestionPipeline(
+    mongodb_manager,
+    property_index,
+    embed=index_ingested_rows,
+    chunk_rows=INGESTION_CONFIG['chunk_rows'],
+    max_queued_jobs=INGESTION_CONFIG['max_queued_jobs'],
+    lease_seconds=INGESTION_CONFIG['lease_seconds'],
+    finished_job_ttl=INGESTION_CONFIG['finished_job_ttl'],
+    max_finished_jobs=INGESTION_CONFIG['max_finished_jobs']
+)
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, please retry shortly"},
+        headers={"Retry-After": "1"}
+    )
 
 # Create models for request/response
 class PropertyQuery(BaseModel):
@@ -48,6 +145,9 @@ class PropertyQuery(BaseModel):
     save_message: Optional[bool] = False
     timestamp: Optional[int] = None
     get_history: Optional[bool] = False
+    # แบ่งหน้าประวัติ: ดึงข้อความที่ seq น้อยกว่า history_before (ไม่ระบุ = ล่าสุด)
+    history_before: Optional[int] = None
+    history_limit: Optional[int] = None
     language: Optional[str] = None
     user_id: Optional[str] = None
 
@@ -57,8 +157,23 @@ class ChatResponse(BaseModel):
     chat_room_id: Optional[str] = None
     properties: Optional[List[Dict[str, Any]]] = None
     messages: Optional[List[Dict[str, Any]]] = None
+    next_before: Optional[int] = None
+
+class ChatMessagesResponse(BaseModel):
+    chat_room_id: str
+    messages: List[Dict[str, Any]]
+    next_before: Optional[int] = None
 
 class UploadResponse(BaseModel):
+    message: str
+    file_id: str
+    # ไฟล์ถูกนำเข้าใน background: ตอนตอบกลับยังไม่มีแถวที่นำเข้า (เป็น 0 เสมอ)
+    # จำนวนแถวจริงดูได้จาก /api/upload/jobs/{job_id} (rows_inserted/rows_updated/rows_unchanged)
+    num_records: int
+    job_id: Optional[str] = None
+    status: Optional[str] = None
+
+class DeleteUploadResponse(BaseModel):
     message: str
     file_id: str
     num_records: int
@@ -120,27 +235,29 @@ def calculate_relevance(query: str, item_text: str) -> float:
         logger.error(f"Error calculating relevance: {str(e)}")
         return 0
 
-def vector_search(query: str, top_k: int = 3, language: str = "thai") -> List[Dict[str, Any]]:
+def load_property_index() -> int:
+    """
+    โหลดข้อมูลอสังหาริมทรัพย์ทั้งหมดจาก MongoDB เข้าสู่ property index ที่ใช้ร่วมกัน
+    """
+    # ดึงข้อมูลทั้งหมดจาก MongoDB
+    properties = list(mongodb_manager.properties.find())
+    
+    # แปลง ObjectId เป็น string
+    for prop in properties:
+        if '_id' in prop:
+            prop['_id'] = str(prop['_id'])
+    
+    # สร้าง index ใหม่ทั้งหมด (search ที่กำลังทำงานอยู่จะใช้ index เดิมจนกว่าจะสร้างเสร็จ)
+    property_index.rebuild(properties)
+    return len(properties)
+
+async def vector_search(query: str, top_k: int = 3, language: str = "thai") -> List[Dict[str, Any]]:
     """
     ค้นหาข้อมูลอสังหาริมทรัพย์ที่เกี่ยวข้องกับคำค้นหาโดยใช้ Vector Search
     """
     try:
-        # สร้าง instance ของ VectorStore
-        vector_store = VectorStore()
-        
-        # ดึงข้อมูลทั้งหมดจาก MongoDB
-        properties = list(mongodb_manager.properties.find())
-        
-        # แปลง ObjectId เป็น string
-        for prop in properties:
-            if '_id' in prop:
-                prop['_id'] = str(prop['_id'])
-        
-        # เพิ่มข้อมูลลงใน vector store
-        vector_store.add_properties(properties)
-        
-        # ค้นหาข้อมูลที่เกี่ยวข้อง
-        results = vector_store.search(query, top_k=top_k)
+        # ค้นหาจาก property index ที่โหลดไว้แล้ว (embed เฉพาะคำค้นหา โดยรวม batch กับ request อื่น)
+        results = await property_index.search_async(query, top_k=top_k)
         
         # แปลงข้อมูลเป็นภาษาอังกฤษถ้าต้องการ
         if language == "english":
@@ -339,14 +456,14 @@ def generate_ai_response(query: str, properties: List[Dict[str, Any]], consultat
                 return "เข้าใจว่าคุณกำลังมองหาสิ่งพิเศษค่ะ "
 
     if not properties:
-        # Initialize language model manager
-        language_model = LanguageModelManager()
+        # ใช้ language model ที่โหลดไว้แล้ว
+        model_manager.ensure_loaded()
         
-        # Generate response using Flan-T5 model
+        # Generate response using the shared model
         prompt = f"Generate a {consultation_style} response in Thai for a property consultant when no properties match the user's requirements. The response should be empathetic and suggest alternative options."
-        inputs = language_model.tokenizer(prompt, return_tensors="pt", max_length=512, truncation=True)
-        outputs = language_model.model.generate(**inputs, max_length=200)
-        return language_model.tokenizer.decode(outputs[0], skip_special_tokens=True)
+        inputs = model_manager.tokenizer(prompt, return_tensors="pt", max_length=512, truncation=True)
+        outputs = model_manager.model.generate(**inputs, max_length=200)
+        return model_manager.tokenizer.decode(outputs[0][inputs["input_ids"].shape[-1]:], skip_special_tokens=True)
 
     # สร้าง response templates ตาม style และภาษา
     if language == "english":
@@ -450,49 +567,241 @@ def format_nearby_facilities(property_data: Dict[str, Any], language: str = "tha
     
     return " | ".join(facilities)
 
+def check_mongo() -> bool:
+    ok = mongodb_manager.ping()
+    readiness.set("mongo", "ready" if ok else "unavailable", None if ok else "ping failed")
+    return ok
+
+def setup_mongo_schema() -> None:
+    mongodb_manager.ensure_indexes()
+    migrated = mongodb_manager.migrate_legacy_chat_rooms()
+    if migrated:
+        logger.info(f"Moved messages of {migrated} chat rooms into buckets")
+    scans = [plan for plan in mongodb_manager.verify_query_plans() if plan["collscan"]]
+    if scans:
+        logger.warning(f"{len(scans)} MongoDB query shapes still use a collection scan")
+
+# การเตรียม MongoDB ทำครั้งเดียวตอนเริ่มระบบ (ลองใหม่จาก /api/ready ได้ไม่ถี่กว่า MONGO_SETUP_RETRY_SECONDS)
+MONGO_SETUP_RETRY_SECONDS = 30
+mongo_setup_lock = threading.Lock()
+mongo_setup_attempted_at: Optional[float] = None
+
+def prepare_mongo() -> None:
+    """
+    One-time MongoDB setup: indexes, legacy chat migration, plan check and chat write replay
+
+    Runs at startup and records its outcome as the "mongo_setup" readiness
+    component. If MongoDB was down or the setup failed, /api/ready schedules
+    another attempt, at most once every MONGO_SETUP_RETRY_SECONDS.
+    """
+    global mongo_setup_attempted_at
+    if not mongo_setup_lock.acquire(blocking=False):
+        return
+    try:
+        mongo_setup_attempted_at = time.monotonic()
+        if not check_mongo():
+            return
+        try:
+            readiness.run("mongo_setup", setup_mongo_schema)
+        except Exception as e:
+            logger.error(f"Error preparing MongoDB: {str(e)}")
+        try:
+            # ข้อความที่ค้างจากการ shutdown ครั้งก่อน
+            chat_writes.replay()
+        except Exception as e:
+            logger.error(f"Error replaying pending chat writes: {str(e)}")
+    finally:
+        mongo_setup_lock.release()
+
+def initialize_search() -> None:
+    """
+    โหลด embedding encoder แล้วสร้าง property index
+    """
+    try:
+        readiness.run("embedder", property_index.load_encoder)
+        count = readiness.run("index", load_property_index)
+        logger.info(f"Property index ready with {count} properties")
+    except Exception as e:
+        logger.error(f"Error building property index: {str(e)}")
+    
+    # job ที่ค้างจาก process ที่ล่มไป ทำต่อหลัง index พร้อมแล้ว
+    ingestion.resume_pending()
+    
+    if PROPERTY_WATCH_ENABLED:
+        property_watcher.start()
+
+def initialize_language_model() -> None:
+    try:
+        readiness.run("generator", model_manager.warmup)
+    except Exception as e:
+        # ถ้าโหลดไม่สำเร็จ จะลองโหลดใหม่อีกครั้งเมื่อมี request แรก
+        logger.error(f"Error warming up language model: {str(e)}")
+
+def preload_components() -> None:
+    """
+    โหลด encoder, property index และโมเดล generate ก่อน fork worker (gunicorn preload_app)
+
+    Worker ทุกตัวจะใช้หน้าหน่วยความจำของน้ำหนักโมเดลและ embedding matrix ร่วมกัน
+    แบบ copy-on-write แทนการโหลดแยกกันคนละชุด
+    """
+    readiness.run("embedder", property_index.load_encoder)
+    count = readiness.run("index", load_property_index)
+    readiness.run("generator", model_manager.load)
+    # object ที่มีอยู่ตอนนี้จะไม่ถูก GC สแกน (การสแกนเขียน header ของ object ทำให้หน้าถูก copy ในแต่ละ worker)
+    gc.freeze()
+    logger.info(f"Preloaded models and {count} properties before forking workers")
+
+def after_fork() -> None:
+    """
+    เรียกใน worker หลัง fork: สร้าง connection และ thread ใหม่ (ของเหล่านี้ใช้ข้าม fork ไม่ได้)
+    """
+    mongodb_manager.reconnect()
+    chat_writes.after_fork()
+    property_watcher.collection = mongodb_manager.properties
+    model_manager.after_fork()
+
+if PRELOAD_MODELS:
+    preload_components()
+
+@app.on_event("startup")
+async def start_background_initialization():
+    global async_mongodb_manager
+    if MONGODB_DRIVER == "motor":
+        try:
+            from async_mongodb_manager import AsyncMongoDBManager
+            async_mongodb_manager = AsyncMongoDBManager()
+        except ImportError as e:
+            logger.error(f"{str(e)}, using pymongo")
+    # ไม่รอให้โมเดลโหลดเสร็จ: API ตอบ request ได้ทันที ส่วน component ต่างๆ โหลดใน background
+    # (inference executor รันตามลำดับ: index พร้อมก่อน แล้วจึงโหลดโมเดล generate)
+    io_executor.submit(prepare_mongo)
+    if not PRELOAD_MODELS:
+        inference_executor.submit(initialize_search)
+    elif PROPERTY_WATCH_ENABLED:
+        # index โหลดไว้แล้วก่อน fork: แต่ละ worker ติดตามการเปลี่ยนแปลงของตัวเอง
+        property_watcher.start()
+    if PRELOAD_MODELS:
+        io_executor.submit(ingestion.resume_pending)
+    # กรณี preload แล้วจะเหลือแค่ warm-up generation ใน worker
+    inference_executor.submit(initialize_language_model)
+    readiness.mark_api_ready()
+
+@app.on_event("shutdown")
+async def stop_search_services():
+    if PROPERTY_WATCH_ENABLED:
+        property_watcher.stop()
+    await property_index.embedding_batcher.stop()
+
+@app.on_event("shutdown")
+async def close_async_mongodb():
+    if async_mongodb_manager is not None:
+        async_mongodb_manager.close()
+
+@app.on_event("shutdown")
+async def shutdown_language_model():
+    model_manager.shutdown()
+
+@app.on_event("shutdown")
+async def shutdown_executors():
+    ingestion.shutdown()
+    inference_executor.shutdown(wait=False)
+    embedding_executor.shutdown(wait=False)
+    if generation_executor is not inference_executor:
+        generation_executor.shutdown(wait=False)
+    io_executor.shutdown(wait=True)
+    # เขียนข้อความแชทที่ค้างอยู่ให้หมดก่อนปิด (SIGTERM -> graceful shutdown)
+    # หลัง io executor เพื่อให้ข้อความจากงานที่ยังค้างในคิวถูกรวมไปด้วย
+    await asyncio.get_running_loop().run_in_executor(None, chat_writes.close)
+
 @app.get("/")
 async def root():
     return {"message": "AI Property Consultant API is running"}
 
+def resolve_chat_session(query: PropertyQuery):
+    """
+    หา session_id และ chat_room_id ของคำขอ (สร้างใหม่ถ้ายังไม่มี)
+    """
+    # Generate or retrieve session ID
+    session_id = query.session_id
+    chat_room_id = query.chat_room_id
+    
+    # ถ้ามี chat_room_id แต่ไม่มี session_id ให้ใช้ chat_room_id เป็น session_id
+    if chat_room_id and not session_id:
+        session_id = chat_room_id
+    
+    # ถ้ามี session_id แต่ไม่มี chat_room_id ให้ใช้ session_id เป็น chat_room_id
+    if session_id and not chat_room_id:
+        chat_room_id = session_id
+        
+    if not session_id:
+        session_id = f"session_{secrets.token_hex(8)}"
+        chat_room_id = session_id
+        user_sessions[session_id] = {
+            "created_at": datetime.now(),
+            "queries": []
+        }
+    elif session_id not in user_sessions:
+        user_sessions[session_id] = {
+            "created_at": datetime.now(),
+            "queries": []
+        }
+    
+    return session_id, chat_room_id
+
+def save_chat_turn(query: PropertyQuery, session_id: str, chat_room_id: str, response: str, formatted_properties: List[Dict[str, Any]]) -> None:
+    """
+    บันทึกข้อความของผู้ใช้และ AI ลง memory และ MongoDB
+    """
+    if "messages" not in user_sessions[session_id]:
+        user_sessions[session_id]["messages"] = []
+        
+    # สร้างข้อความของผู้ใช้
+    user_message = {
+        "role": "user",
+        "content": query.query,
+        "timestamp": query.timestamp or int(time.time() * 1000)
+    }
+    
+    # สร้างข้อความของ AI
+    assistant_message = {
+        "role": "assistant",
+        "content": response,
+        "timestamp": int(time.time() * 1000),
+        "properties": formatted_properties if formatted_properties else None
+    }
+    
+    # บันทึกลง memory
+    user_sessions[session_id]["messages"].append(user_message)
+    user_sessions[session_id]["messages"].append(assistant_message)
+    
+    # บันทึกลง MongoDB
+    try:
+        chat_writes.save_chat_room(chat_room_id, [user_message, assistant_message], query.user_id)
+    except Exception as e:
+        logger.error(f"Error saving to MongoDB: {str(e)}")
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """
+    จัดรูปแบบข้อมูลเป็น Server-Sent Event
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(query: PropertyQuery):
     try:
-        # Generate or retrieve session ID
-        session_id = query.session_id
-        chat_room_id = query.chat_room_id
-        user_id = query.user_id
-        
-        # ถ้ามี chat_room_id แต่ไม่มี session_id ให้ใช้ chat_room_id เป็น session_id
-        if chat_room_id and not session_id:
-            session_id = chat_room_id
-        
-        # ถ้ามี session_id แต่ไม่มี chat_room_id ให้ใช้ session_id เป็น chat_room_id
-        if session_id and not chat_room_id:
-            chat_room_id = session_id
-            
-        if not session_id:
-            session_id = f"session_{secrets.token_hex(8)}"
-            chat_room_id = session_id
-            user_sessions[session_id] = {
-                "created_at": datetime.now(),
-                "queries": []
-            }
-        elif session_id not in user_sessions:
-            user_sessions[session_id] = {
-                "created_at": datetime.now(),
-                "queries": []
-            }
+        session_id, chat_room_id = resolve_chat_session(query)
         
         # ถ้าต้องการดึงประวัติการสนทนา
         if query.get_history:
-            # ลองดึงจาก MongoDB ก่อน
-            chat_room = mongodb_manager.get_chat_room(chat_room_id)
-            if chat_room and "messages" in chat_room:
+            # ลองดึงจาก MongoDB ก่อน (ทีละหน้า)
+            page = await mongo_call("get_chat_messages", chat_room_id, query.history_before, query.history_limit)
+            if page["messages"]:
                 return ChatResponse(
                     response="",
                     session_id=session_id,
                     chat_room_id=chat_room_id,
-                    messages=chat_room["messages"]
+                    messages=page["messages"],
+                    next_before=page["next_before"]
                 )
             
             # ถ้าไม่มีใน MongoDB ให้ดึงจาก memory
@@ -511,14 +820,12 @@ async def chat(query: PropertyQuery):
         })
         
         # Search for relevant properties
-        relevant_properties = vector_search(query.query, language=query.language or "thai")
+        relevant_properties = await vector_search(query.query, language=query.language or "thai")
         formatted_properties = format_property_response(relevant_properties)
         
-        # Initialize language model manager
-        language_model = LanguageModelManager()
-        
         # Generate AI response
-        response = language_model.generate_response(
+        response = await generation_executor.run(
+            model_manager.generate_response,
             query=query.query,
             properties=formatted_properties,
             style=query.consultation_style,
@@ -527,33 +834,7 @@ async def chat(query: PropertyQuery):
         
         # บันทึกข้อความลงในประวัติการสนทนา
         if query.save_message:
-            if "messages" not in user_sessions[session_id]:
-                user_sessions[session_id]["messages"] = []
-                
-            # สร้างข้อความของผู้ใช้
-            user_message = {
-                "role": "user",
-                "content": query.query,
-                "timestamp": query.timestamp or int(time.time() * 1000)
-            }
-            
-            # สร้างข้อความของ AI
-            assistant_message = {
-                "role": "assistant",
-                "content": response,
-                "timestamp": int(time.time() * 1000),
-                "properties": formatted_properties if formatted_properties else None
-            }
-            
-            # บันทึกลง memory
-            user_sessions[session_id]["messages"].append(user_message)
-            user_sessions[session_id]["messages"].append(assistant_message)
-            
-            # บันทึกลง MongoDB
-            try:
-                mongodb_manager.save_chat_room(chat_room_id, [user_message, assistant_message], user_id)
-            except Exception as e:
-                logger.error(f"Error saving to MongoDB: {str(e)}")
+            await io_executor.run(save_chat_turn, query, session_id, chat_room_id, response, formatted_properties)
         
         return ChatResponse(
             response=response,
@@ -562,67 +843,196 @@ async def chat(query: PropertyQuery):
             properties=formatted_properties if formatted_properties else None
         )
         
+    except QueueFullError:
+        raise
     except Exception as e:
         logger.error(f"Error processing chat request: {str(e)}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.post("/api/chat/stream")
+async def chat_stream(query: PropertyQuery):
+    """
+    ส่งคำตอบแบบ Server-Sent Events: properties ก่อน ตามด้วย token ทีละส่วน และ done เมื่อจบ
+    """
+    session_id, chat_room_id = resolve_chat_session(query)
+    
+    # Log the query
+    user_sessions[session_id]["queries"].append({
+        "query": query.query,
+        "timestamp": datetime.now()
+    })
+    
+    # ค้นหาก่อนเริ่ม stream เพื่อให้ event แรกส่งได้ทันทีหลังการค้นหา
+    relevant_properties = await vector_search(query.query, language=query.language or "thai")
+    formatted_properties = format_property_response(relevant_properties)
+    
+    async def event_stream():
+        loop = asyncio.get_running_loop()
+        cancel_event = threading.Event()
+        tokens: asyncio.Queue = asyncio.Queue()
+        sentinel = object()
+        pieces = []
+        finished = False
+        
+        def pump_tokens():
+            # รันใน inference executor: ส่ง token กลับเข้า event loop ทีละส่วน
+            try:
+                for text in model_manager.stream_response(
+                    query=query.query,
+                    properties=formatted_properties,
+                    style=query.consultation_style,
+                    cancel_event=cancel_event
+                ):
+                    loop.call_soon_threadsafe(tokens.put_nowait, text)
+            finally:
+                try:
+                    loop.call_soon_threadsafe(tokens.put_nowait, sentinel)
+                except RuntimeError:
+                    # event loop ปิดไปแล้ว
+                    pass
+        
+        try:
+            yield format_sse("properties", {
+                "session_id": session_id,
+                "chat_room_id": chat_room_id,
+                "properties": formatted_properties
+            })
+            
+            generation = generation_executor.submit(pump_tokens)
+            while True:
+                text = await tokens.get()
+                if text is sentinel:
+                    break
+                pieces.append(text)
+                yield format_sse("token", {"text": text})
+            # แจ้ง error ที่เกิดระหว่าง generate (ถ้ามี)
+            await asyncio.wrap_future(generation)
+            
+            finished = True
+            yield format_sse("done", {
+                "response": "".join(pieces),
+                "session_id": session_id,
+                "chat_room_id": chat_room_id
+            })
+        except QueueFullError:
+            yield format_sse("error", {"detail": "Server is busy, please retry shortly"})
+        except Exception as e:
+            logger.error(f"Error streaming chat response: {str(e)}")
+            logger.error(traceback.format_exc())
+            yield format_sse("error", {"detail": "Internal server error"})
+        finally:
+            # client ตัดการเชื่อมต่อ: หยุด generate
+            cancel_event.set()
+            if query.save_message and pieces:
+                if not finished:
+                    logger.info(f"Stream for {chat_room_id} ended early, saving partial response")
+                try:
+                    io_executor.submit(save_chat_turn, query, session_id, chat_room_id, "".join(pieces), formatted_properties)
+                except QueueFullError:
+                    logger.error(f"Dropped chat history for {chat_room_id}: I/O queue is full")
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/api/upload", response_model=UploadResponse)
-async def upload_file(file: UploadFile = File(...), consultation_style: str = "formal"):
+async def upload_file(file: UploadFile = File(...), consultation_style: str = "formal", replace_file_id: Optional[str] = None):
+    spool_path = None
     try:
-        global property_data
-        
         # Validate file type
         file_ext = file.filename.split('.')[-1].lower()
         if file_ext not in ['csv', 'xlsx', 'xls']:
             raise HTTPException(status_code=400, detail="Only CSV or Excel files are accepted")
         
-        # Read the file content
-        content = await file.read()
-        
-        if file_ext == 'csv':
-            df = pd.read_csv(io.BytesIO(content))
-        else:  # Excel file
-            df = pd.read_excel(io.BytesIO(content))
-            
-        # Validate expected columns
-        expected_columns = [
-            'ประเภท', 'โครงการ', 'ราคา', 'รูปแบบ', 'รูป', 'ตำแหน่ง', 
-            'สถานศึกษา', 'สถานีรถไฟฟ้า', 'ห้างสรรพสินค้า', 'โรงพยาบาล', 'สนามบิน'
-        ]
-        
-        for col in expected_columns:
-            if col not in df.columns:
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Missing required column: {col}"
-                )
-                
-        # Convert DataFrame to list of dicts for our database
-        property_data = df.fillna("ไม่มี").to_dict('records')
-        
         # Generate a unique file ID
         file_id = f"upload_{secrets.token_hex(8)}"
         
-        # บันทึกลง MongoDB
-        try:
-            mongodb_manager.store_properties(property_data, file_id)
-        except Exception as e:
-            logger.error(f"Error storing properties in MongoDB: {str(e)}")
+        # เขียนไฟล์ลง disk ทีละส่วน แทนการอ่านทั้งไฟล์เข้าหน่วยความจำ
+        os.makedirs(INGESTION_CONFIG['spool_dir'], exist_ok=True)
+        # เก็บ path แบบเต็ม เพราะ job ที่ค้างอาจถูกทำต่อโดย worker อื่น
+        spool_path = os.path.abspath(os.path.join(INGESTION_CONFIG['spool_dir'], f"{file_id}.{file_ext}"))
+        with open(spool_path, "wb") as out:
+            while True:
+                chunk = await file.read(1024 * 1024)
+                if not chunk:
+                    break
+                await io_executor.run(out.write, chunk)
+        
+        # Validate expected columns (อ่านเฉพาะแถวหัวตาราง)
+        columns = await io_executor.run(read_header, spool_path, file_ext)
+        missing = missing_columns(columns)
+        if missing:
+            raise HTTPException(
+                status_code=400, 
+                detail=f"Missing required column: {missing[0]}"
+            )
+        
+        # แยกเป็น chunk, บันทึกลง MongoDB และเพิ่มเข้า property index ใน background
+        job = await io_executor.run(ingestion.submit, spool_path, file_ext, file_id, file.filename, replace_file_id)
+        spool_path = None
         
         return UploadResponse(
-            message="อัพโหลดข้อมูลอสังหาริมทรัพย์สำเร็จ",
+            message="ได้รับไฟล์แล้ว กำลังนำเข้าข้อมูลอสังหาริมทรัพย์",
             file_id=file_id,
-            num_records=len(property_data)
+            num_records=job.rows_processed,
+            job_id=job.job_id,
+            status=job.status
         )
         
-    except HTTPException:
+    except (HTTPException, QueueFullError):
         # Re-raise HTTP exceptions
         raise
     except Exception as e:
         logger.error(f"Error processing file upload: {str(e)}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail="Error processing file: " + str(e))
+    finally:
+        # ไฟล์ที่ไม่ได้ส่งต่อให้ ingestion job (เช่น header ไม่ถูกต้อง) ลบทิ้ง
+        if spool_path and os.path.exists(spool_path):
+            os.remove(spool_path)
+
+@app.get("/api/upload/jobs/{job_id}")
+async def get_upload_job(job_id: str):
+    """
+    ความคืบหน้าของการนำเข้าไฟล์: จำนวนแถว, อัตราแถวต่อวินาที, ข้อผิดพลาด และเวลาที่คาดว่าจะเสร็จ
+    """
+    job = await io_executor.run(ingestion.status, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    return job
+
+@app.delete("/api/upload/{file_id}", response_model=DeleteUploadResponse)
+async def delete_upload(file_id: str):
+    try:
+        deleted = await mongo_call("delete_properties", file_id)
+        property_index.remove_by_file_id(file_id)
+        
+        if not deleted:
+            raise HTTPException(status_code=404, detail="File not found")
+        
+        return DeleteUploadResponse(
+            message="ลบข้อมูลอสังหาริมทรัพย์สำเร็จ",
+            file_id=file_id,
+            num_records=deleted
+        )
+        
+    except (HTTPException, QueueFullError):
+        raise
+    except Exception as e:
+        logger.error(f"Error deleting upload: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail="Error deleting file: " + str(e))
+
+@app.get("/api/chat/rooms/{chat_room_id}/messages", response_model=ChatMessagesResponse)
+async def get_chat_messages(chat_room_id: str, before: Optional[int] = None, limit: Optional[int] = None):
+    """
+    ประวัติการสนทนาแบบแบ่งหน้า: ส่ง next_before ที่ได้กลับมาเป็น before เพื่อดึงหน้าที่เก่ากว่า
+    """
+    page = await mongo_call("get_chat_messages", chat_room_id, before, limit)
+    return ChatMessagesResponse(chat_room_id=chat_room_id, messages=page["messages"], next_before=page["next_before"])
 
 @app.post("/api/save_history")
 async def save_chat_history(history_request: ChatHistoryRequest):
@@ -632,7 +1042,7 @@ async def save_chat_history(history_request: ChatHistoryRequest):
         user_id = history_request.user_id
         
         # บันทึกลง MongoDB
-        success = mongodb_manager.save_chat_room(chat_room_id, messages, user_id)
+        success = await io_executor.run(chat_writes.save_chat_room, chat_room_id, messages, user_id)
         
         if not success:
             # ถ้าบันทึกลง MongoDB ไม่สำเร็จ ให้บันทึกลง memory
@@ -658,6 +1068,73 @@ async def save_chat_history(history_request: ChatHistoryRequest):
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail="Error saving chat history: " + str(e))
 
+@app.get("/api/health")
+async def health():
+    return {
+        "generator": model_manager.health(),
+        "property_index": {
+            "size": len(property_index),
+            "version": property_index.index_version,
+            "encoder": property_index.encoder_backend,
+            "encoder_status": property_index.encoder_status
+        }
+    }
+
+@app.get("/api/metrics/queues")
+async def get_queue_metrics():
+    """
+    ความลึกของคิวงานแต่ละ executor (ใช้เป็นสัญญาณสำหรับ autoscale)
+    """
+    return {
+        "inference": inference_executor.stats(),
+        "io": io_executor.stats(),
+        "embedding": embedding_executor.stats(),
+        "generation": generation_executor.stats() if generation_executor is not inference_executor else None,
+        "generation_scheduler": model_manager.scheduler.stats() if model_manager.scheduler is not None else None,
+        "query_embedding_batcher": property_index.embedding_batcher.stats(),
+        "chat_writes": chat_writes.stats()
+    }
+
+@app.get("/api/stats/search-cache")
+async def get_search_cache_stats():
+    return property_index.cache_stats()
+
+@app.get("/api/ready")
+async def get_readiness():
+    """
+    สถานะความพร้อมของแต่ละ component (503 จนกว่าทุก component จะพร้อม)
+    """
+    try:
+        await asyncio.wait_for(io_executor.run(check_mongo), timeout=2)
+    except (asyncio.TimeoutError, QueueFullError):
+        readiness.set("mongo", "unavailable", "ping timed out")
+    # probe เรียกถี่ จึงทำแค่ ping: การเตรียม MongoDB จะถูกลองใหม่เฉพาะเมื่อยังไม่สำเร็จ
+    if (readiness.status("mongo") == "ready"
+            and readiness.status("mongo_setup") in ("pending", "failed")
+            and time.monotonic() - (mongo_setup_attempted_at or 0) >= MONGO_SETUP_RETRY_SECONDS):
+        try:
+            io_executor.submit(prepare_mongo)
+        except QueueFullError:
+            pass
+    # โมเดลอาจถูกโหลดสำเร็จภายหลังจาก request แรก แม้ตอนเริ่มระบบจะล้มเหลว
+    if property_index.encoder_status == "ready":
+        readiness.set("embedder", "ready")
+    if model_manager.status == "ready":
+        readiness.set("generator", "ready")
+    snapshot = readiness.snapshot()
+    return JSONResponse(status_code=200 if snapshot["ready"] else 503, content=snapshot)
+
+@app.get("/api/stats/decoding")
+async def get_decoding_stats():
+    """
+    Latency และจำนวน token ต่อ decoding profile พร้อม profile ที่แต่ละ endpoint ใช้
+    """
+    return {
+        "endpoint_profiles": MODEL_CONFIG['endpoint_profiles'],
+        "style_profiles": MODEL_CONFIG['style_profiles'],
+        "profiles": model_manager.decoding_stats()
+    }
+
 @app.get("/api/styles")
 async def get_consultation_styles():
     return CONSULTATION_STYLES
@@ -667,7 +1144,7 @@ async def get_consultation_styles():
 async def register_user(user_data: UserRegisterRequest):
     try:
         # ตรวจสอบว่ามีอีเมลนี้ในระบบแล้วหรือไม่
-        existing_user = mongodb_manager.get_user_by_email(user_data.email)
+        existing_user = await mongo_call("get_user_by_email", user_data.email)
         
         if existing_user:
             return UserResponse(
@@ -689,7 +1166,7 @@ async def register_user(user_data: UserRegisterRequest):
         }
         
         # บันทึกลง MongoDB
-        success = mongodb_manager.save_user(new_user)
+        success = await mongo_call("save_user", new_user)
         
         if success:
             return UserResponse(
@@ -724,7 +1201,7 @@ async def register_user(user_data: UserRegisterRequest):
 async def login_user(user_data: UserLoginRequest):
     try:
         # ค้นหาผู้ใช้จากอีเมล
-        user = mongodb_manager.get_user_by_email(user_data.email)
+        user = await mongo_call("get_user_by_email", user_data.email)
         
         if not user:
             return UserResponse(
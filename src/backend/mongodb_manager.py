@@ -1,42 +1,491 @@
+import hashlib
 import logging
-from typing import Dict, List, Any, Optional
-from pymongo import MongoClient
+import time
+from itertools import groupby
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+from pymongo import ASCENDING, DESCENDING, MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import pandas as pd
-from config import MONGODB_URL, MONGODB_DB
+from config import MONGODB_URL, MONGODB_DB, MONGODB_CLIENT_CONFIG, PROPERTY_WRITE_BATCH_SIZE, CHAT_HISTORY_CONFIG
 
 logger = logging.getLogger(__name__)
 
+# คอลัมน์ที่ใช้ระบุว่าเป็นประกาศเดียวกัน (อัพโหลดซ้ำแล้วไม่เกิดข้อมูลซ้ำ)
+FINGERPRINT_FIELDS = ('โครงการ', 'ตำแหน่ง', 'ประเภท', 'ราคา')
+MAX_REPORTED_WRITE_ERRORS = 20
+
+# index ของแต่ละ collection ตามรูปแบบการค้นหาที่ใช้จริง: (keys, options)
+INDEXES = {
+    "sessions": [
+        ([("session_id", ASCENDING)], {"name": "session_id_unique", "unique": True}),
+    ],
+    "chat_rooms": [
+        ([("chat_room_id", ASCENDING)], {"name": "chat_room_id_unique", "unique": True}),
+        ([("user_id", ASCENDING), ("updated_at", DESCENDING)], {"name": "user_id_updated_at"}),
+    ],
+    "chat_messages": [
+        ([("chat_room_id", ASCENDING), ("bucket", DESCENDING)], {"name": "chat_room_bucket_unique", "unique": True}),
+    ],
+    "users": [
+        ([("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+        ([("email", ASCENDING)], {"name": "email_unique", "unique": True}),
+    ],
+    "properties": [
+        ([("file_id", ASCENDING)], {"name": "file_id"}),
+        # เอกสารเดิมที่ยังไม่มี fingerprint ไม่ถูกบังคับ unique
+        ([("fingerprint", ASCENDING)], {"name": "fingerprint_unique", "unique": True,
+                                        "partialFilterExpression": {"fingerprint": {"$exists": True}}}),
+    ],
+    "ingestion_jobs": [
+        ([("job_id", ASCENDING)], {"name": "job_id_unique", "unique": True}),
+        ([("status", ASCENDING)], {"name": "status"}),
+    ],
+}
+
+# คำค้นที่ระบบใช้จริง สำหรับตรวจ query plan ว่าไม่มี COLLSCAN: (collection, filter, projection)
+QUERY_SHAPES = [
+    ("sessions", {"session_id": "_"}, {"_id": 0}),
+    ("chat_rooms", {"chat_room_id": "_"}, {"_id": 0}),
+    ("chat_rooms", {"user_id": "_"}, {"_id": 0, "messages": 0}),
+    ("chat_messages", {"chat_room_id": "_", "first_seq": {"$lt": 1}}, {"_id": 0, "messages": 1}),
+    ("users", {"id": "_"}, {"_id": 0}),
+    ("users", {"email": "_"}, {"_id": 0}),
+    ("properties", {"file_id": "_"}, {"_id": 1}),
+    ("properties", {"fingerprint": {"$in": ["_"]}}, None),
+    ("ingestion_jobs", {"job_id": "_"}, {"_id": 0}),
+    ("ingestion_jobs", {"status": {"$in": ["queued", "running"]}}, {"_id": 0}),
+]
+
+# field ที่แต่ละเส้นทางการอ่านต้องใช้ (ไม่ดึงทั้งเอกสาร)
+CHAT_ROOM_FIELDS = {"_id": 0, "chat_room_id": 1, "user_id": 1, "message_count": 1, "last_message": 1,
+                    "created_at": 1, "updated_at": 1}
+CHAT_ROOM_SUMMARY_FIELDS = {"_id": 0, "messages": 0}
+USER_FIELDS = {"_id": 0, "id": 1, "email": 1, "name": 1, "password": 1}
+PROPERTY_FIELDS = {"_id": 0, "fingerprint": 0}
+
+def listing_fingerprint(prop: Dict[str, Any]) -> str:
+    """
+    Stable hash identifying a listing by project, location, type and price
+    """
+    parts = []
+    for field in FINGERPRINT_FIELDS:
+        value = prop.get(field)
+        if field == 'ราคา':
+            # 4500000, 4500000.0 และ "4,500,000" ถือเป็นราคาเดียวกัน
+            try:
+                number = float(str(value).replace(",", ""))
+                value = int(number) if number.is_integer() else number
+            except ValueError:
+                pass
+        parts.append(" ".join(str(value).split()).lower())
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+def client_options() -> Dict[str, Any]:
+    """
+    MongoClient keyword arguments from MONGODB_CLIENT_CONFIG (unset values are left to the driver)
+    """
+    return {key: value for key, value in MONGODB_CLIENT_CONFIG.items() if value not in (None, "")}
+
+# ส่วนที่ไม่ขึ้นกับ driver: ใช้ร่วมกันระหว่าง MongoDBManager (pymongo) และ AsyncMongoDBManager (motor)
+def reserve_update(messages: List[Dict[str, Any]], user_id: Optional[str]) -> Dict[str, Any]:
+    """
+    Upsert of a chat room summary that reserves seq numbers for `messages`
+    """
+    now = pd.Timestamp.now()
+    update = {
+        "$setOnInsert": {"user_id": user_id, "created_at": now},
+        "$set": {"updated_at": now},
+        "$inc": {"message_count": len(messages)}
+    }
+    if messages:
+        update["$set"]["last_message"] = messages[-1]
+    return update
+
+def bucket_operations(chat_room_id: str, messages: List[Dict[str, Any]], seqs: Sequence[int]) -> List[UpdateOne]:
+    """
+    Bucket upserts that append `messages` numbered with the reserved `seqs`
+
+    $addToSet makes the writes idempotent: retrying with the same seqs after
+    a partially failed bulk write does not store a message twice.
+    """
+    bucket_size = CHAT_HISTORY_CONFIG['bucket_size']
+    now = pd.Timestamp.now()
+    operations = []
+    numbered = [{**message, "seq": seq} for seq, message in zip(seqs, messages)]
+    for bucket, group in groupby(numbered, key=lambda message: message["seq"] // bucket_size):
+        items = list(group)
+        operations.append(UpdateOne(
+            {"chat_room_id": chat_room_id, "bucket": bucket},
+            {
+                "$addToSet": {"messages": {"$each": items}},
+                "$min": {"first_seq": items[0]["seq"]},
+                "$max": {"last_seq": items[-1]["seq"]},
+                "$setOnInsert": {"created_at": now}
+            },
+            upsert=True
+        ))
+    return operations
+
+def reserve_filter(chat_room_id: str) -> Dict[str, Any]:
+    # ห้องที่ยังมี messages แบบเดิมจะไม่ match จึงชน unique index ของ chat_room_id แทน
+    return {"chat_room_id": chat_room_id, "messages": {"$exists": False}}
+
+# find_one_and_update ของการจอง seq: ได้ message_count หลังจองกลับมา
+RESERVE_OPTIONS = {"projection": {"_id": 0, "message_count": 1}, "upsert": True, "return_document": ReturnDocument.AFTER}
+BUCKET_FIELDS = {"_id": 0, "messages": 1}
+
+class ChatRoomsWrite:
+    def __init__(self,
+                 rooms: Dict[str, Tuple[List[Dict[str, Any]], Optional[str]]],
+                 reserved: Optional[Dict[str, List[int]]] = None):
+        """
+        Driver-independent part of save_chat_rooms
+
+        Turns each room's seq reservation into bucket operations and maps the
+        outcome of the reservations and of the single bulk write back to a
+        success flag per room. The managers only perform the I/O.
+
+        `reserved` maps a room to the seqs already reserved for the first
+        messages of its list by an earlier, failed attempt. Those messages
+        keep their seqs and only the rest are reserved again. The dict is
+        updated in place with every reservation made, so a caller that
+        retries a failed room passes it back.
+        """
+        self.rooms = rooms
+        self.reserved_seqs = reserved if reserved is not None else {}
+        self.results: Dict[str, bool] = {}
+        self.operations: List[UpdateOne] = []
+        self._owners: List[str] = []
+
+    def unreserved(self, chat_room_id: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Messages of the room that still need seq numbers; None when an earlier attempt reserved them all
+        """
+        messages, _ = self.rooms[chat_room_id]
+        seqs = self.reserved_seqs.get(chat_room_id)
+        if seqs is not None and len(seqs) >= len(messages):
+            return None
+        return messages[len(seqs or ()):]
+
+    def reserved(self, chat_room_id: str, room: Optional[Dict[str, Any]]) -> None:
+        """
+        Queue the bucket writes for a room whose summary upsert returned `room` (None if none was needed)
+        """
+        messages, _ = self.rooms[chat_room_id]
+        seqs = list(self.reserved_seqs.get(chat_room_id, ()))
+        new = len(messages) - len(seqs)
+        if new:
+            seqs += range(room["message_count"] - new, room["message_count"])
+        self.reserved_seqs[chat_room_id] = seqs
+        operations = bucket_operations(chat_room_id, messages, seqs)
+        self.operations += operations
+        self._owners += [chat_room_id] * len(operations)
+        self.results[chat_room_id] = True
+
+    def failed(self, chat_room_id: str, error: Exception) -> None:
+        if isinstance(error, DuplicateKeyError):
+            logger.error(f"Chat room {chat_room_id} still uses embedded messages, not saved")
+        else:
+            logger.error(f"Error saving chat room {chat_room_id}: {str(error)}")
+        self.results[chat_room_id] = False
+
+    def written(self, error: Optional[Exception] = None) -> Dict[str, bool]:
+        """
+        Record the outcome of the bulk write of `operations`; returns success per room
+        """
+        if isinstance(error, BulkWriteError):
+            for write_error in error.details.get("writeErrors", []):
+                self.results[self._owners[write_error["index"]]] = False
+            logger.error(f"Error saving chat messages: {str(error.details.get('writeErrors'))[:500]}")
+        elif error is not None:
+            for chat_room_id in self._owners:
+                self.results[chat_room_id] = False
+            logger.error(f"Error saving chat messages: {str(error)}")
+        return self.results
+
+class HistoryPage:
+    def __init__(self, chat_room_id: str, before: Optional[int], limit: Optional[int]):
+        """
+        Driver-independent part of get_chat_messages: feed buckets newest first until add() returns True
+        """
+        self.before = before
+        self.limit = min(limit or CHAT_HISTORY_CONFIG['page_size'], CHAT_HISTORY_CONFIG['max_page_size'])
+        self.query = bucket_query(chat_room_id, before)
+        self.messages: List[Dict[str, Any]] = []
+
+    def add(self, bucket: Dict[str, Any]) -> bool:
+        return take_messages(bucket, self.before, self.messages, self.limit)
+
+    def result(self) -> Dict[str, Any]:
+        return history_page(self.messages)
+
+def bucket_query(chat_room_id: str, before: Optional[int]) -> Dict[str, Any]:
+    query = {"chat_room_id": chat_room_id}
+    if before is not None:
+        query["first_seq"] = {"$lt": before}
+    return query
+
+def take_messages(bucket: Dict[str, Any], before: Optional[int], collected: List[Dict[str, Any]], limit: int) -> bool:
+    """
+    Add a bucket's messages older than `before` to collected (newest first); True once limit is reached
+    """
+    # writer ที่ทำพร้อมกันอาจ push เข้า bucket เดียวกันสลับลำดับ จึงเรียงตาม seq อีกครั้ง
+    for message in sorted(bucket["messages"], key=lambda m: m["seq"], reverse=True):
+        if before is not None and message["seq"] >= before:
+            continue
+        collected.append(message)
+        if len(collected) >= limit:
+            return True
+    return False
+
+def history_page(collected: List[Dict[str, Any]]) -> Dict[str, Any]:
+    collected.reverse()
+    next_before = collected[0]["seq"] if collected and collected[0]["seq"] > 0 else None
+    return {"messages": collected, "next_before": next_before}
+
+def user_upsert(user_data: Dict[str, Any]) -> Dict[str, Any]:
+    now = pd.Timestamp.now()
+    profile = {field: user_data[field] for field in ("email", "name", "password")}
+    extra = {k: v for k, v in user_data.items() if k not in profile and k not in ("id", "_id", "created_at", "updated_at")}
+    return {
+        "$set": {**profile, "updated_at": now},
+        "$setOnInsert": {**extra, "created_at": now}
+    }
+
 class MongoDBManager:
     def __init__(self):
+        self._connect()
+
+    def _connect(self) -> None:
         try:
-            self.client = MongoClient(MONGODB_URL)
+            self.client = MongoClient(MONGODB_URL, **client_options())
             self.db = self.client[MONGODB_DB]
             self.properties = self.db["properties"]
             self.sessions = self.db["sessions"]
             self.users = self.db["users"]
             self.uploads = self.db["uploads"]
             self.chat_rooms = self.db["chat_rooms"]
+            # ข้อความแชทแยกเป็น bucket (ห้องแชทเก็บเฉพาะข้อมูลสรุป)
+            self.chat_messages = self.db["chat_messages"]
+            self.ingestion_jobs = self.db["ingestion_jobs"]
+            self._indexes_ready = False
             logger.info(f"Connected to MongoDB at {MONGODB_URL}")
         except Exception as e:
             logger.error(f"Failed to connect to MongoDB: {str(e)}")
             raise
 
-    def store_properties(self, properties: List[Dict[str, Any]], file_id: str) -> str:
+    def reconnect(self) -> None:
         """
-        Store property data from uploaded file
+        Open a fresh client in a forked worker
+
+        MongoClient is not fork-safe: its sockets and monitor threads belong to
+        the parent, so the child must not use (or close) the inherited client.
         """
+        self._connect()
+
+    def store_properties(self, properties: List[Dict[str, Any]], file_id: str, batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Upsert property data from an uploaded file, keyed on the listing fingerprint
+
+        Existing listings are looked up by fingerprint once per batch, then the
+        batch is written with one unordered bulk_write: new listings are
+        upserted, listings whose fields changed are updated, and identical
+        listings only have their file_id moved to this upload. Rows repeated
+        within the same call keep the last occurrence.
+
+        Returns counts (inserted / updated / unchanged / duplicates / failed),
+        the write errors, `changed`: stored documents (with string `_id`) that
+        need (re-)embedding, `retagged`: ids of unchanged documents whose
+        file_id was moved, and `kept`: all unchanged documents (with string
+        `_id`), so a caller can embed any that its index is missing.
+        """
+        batch_size = batch_size or PROPERTY_WRITE_BATCH_SIZE
+        summary = {"inserted": 0, "updated": 0, "unchanged": 0, "duplicates": 0, "failed": 0,
+                   "errors": [], "changed": [], "retagged": [], "kept": []}
         try:
-            # Add file_id to each property
+            if not self._indexes_ready:
+                # fingerprint ต้องมี unique index รองรับ upsert ที่ทำพร้อมกันหลาย worker
+                self.ensure_indexes()
+            by_fingerprint = {}
             for prop in properties:
-                prop["file_id"] = file_id
-            
-            # Insert properties
-            result = self.properties.insert_many(properties)
-            return str(result.inserted_ids)
+                # สร้างเอกสารจากสำเนา ไม่แก้ dict ของผู้เรียก
+                doc = {**prop, "file_id": file_id}
+                doc["fingerprint"] = listing_fingerprint(doc)
+                by_fingerprint[doc["fingerprint"]] = doc
+            summary["duplicates"] = len(properties) - len(by_fingerprint)
+
+            unique = list(by_fingerprint.values())
+            for start in range(0, len(unique), batch_size):
+                self._upsert_batch(unique[start:start + batch_size], file_id, summary)
+            return summary
         except Exception as e:
             logger.error(f"Error storing properties: {str(e)}")
             raise
 
+    def _upsert_batch(self, batch: List[Dict[str, Any]], file_id: str, summary: Dict[str, Any]) -> None:
+        existing = {
+            doc["fingerprint"]: doc
+            for doc in self.properties.find({"fingerprint": {"$in": [prop["fingerprint"] for prop in batch]}})
+        }
+        operations, planned = [], []
+        for prop in batch:
+            doc = existing.get(prop["fingerprint"])
+            if doc is None:
+                operations.append(UpdateOne({"fingerprint": prop["fingerprint"]}, {"$setOnInsert": prop}, upsert=True))
+                planned.append(("inserted", prop, None))
+            elif any(doc.get(key) != value for key, value in prop.items() if key != "file_id"):
+                operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": prop}))
+                planned.append(("updated", prop, doc))
+            elif doc.get("file_id") != file_id:
+                operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"file_id": file_id}}))
+                planned.append(("retagged", prop, doc))
+            else:
+                summary["unchanged"] += 1
+                summary["kept"].append({**doc, "_id": str(doc["_id"])})
+        if not operations:
+            return
+
+        try:
+            details = self.properties.bulk_write(operations, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            # unordered: operation อื่นใน batch ยังถูกเขียน มีเพียงรายการที่ผิดพลาดเท่านั้นที่ไม่สำเร็จ
+            details = e.details
+        failed = {}
+        for error in details.get("writeErrors", []):
+            failed[error["index"]] = error.get("errmsg", str(error))
+        upserted = {item["index"]: item["_id"] for item in details.get("upserted", [])}
+
+        for index, (kind, prop, doc) in enumerate(planned):
+            if index in failed:
+                summary["failed"] += 1
+                if len(summary["errors"]) < MAX_REPORTED_WRITE_ERRORS:
+                    summary["errors"].append({"fingerprint": prop["fingerprint"], "error": failed[index]})
+            elif kind == "inserted":
+                if index not in upserted:
+                    # writer อื่นเพิ่มประกาศเดียวกันไปแล้วระหว่างนั้น
+                    summary["unchanged"] += 1
+                    continue
+                summary["inserted"] += 1
+                summary["changed"].append({**prop, "_id": str(upserted[index])})
+            elif kind == "updated":
+                summary["updated"] += 1
+                summary["changed"].append({**prop, "_id": str(doc["_id"])})
+            else:
+                summary["unchanged"] += 1
+                summary["retagged"].append(str(doc["_id"]))
+                summary["kept"].append({**doc, "_id": str(doc["_id"]), "file_id": file_id})
+
+    def ensure_indexes(self) -> Dict[str, List[str]]:
+        """
+        Create the indexes in INDEXES if missing; returns index names per collection
+
+        Unique indexes back correctness, not just speed (the chat room
+        reservation upsert, the user email upsert, the listing fingerprint
+        upsert), so a unique index that cannot be built, typically because
+        the collection already holds duplicates, raises RuntimeError after
+        the other indexes are created. The indexes are only marked ready once
+        every unique index exists.
+        """
+        created, failed = {}, []
+        for collection_name, specs in INDEXES.items():
+            collection = self.db[collection_name]
+            names = []
+            for keys, options in specs:
+                try:
+                    names.append(collection.create_index(keys, **options))
+                except (DuplicateKeyError, OperationFailure) as e:
+                    if options.get("unique") and self._replace_plain_index(collection, keys, options):
+                        names.append(options["name"])
+                        continue
+                    logger.error(f"Cannot create index {options['name']} on {collection_name}: {str(e)}")
+                    if options.get("unique"):
+                        failed.append(f"{collection_name}.{options['name']}")
+            created[collection_name] = names
+        if failed:
+            self._indexes_ready = False
+            raise RuntimeError(f"Unique indexes could not be built (remove the duplicates first): {', '.join(failed)}")
+        self._indexes_ready = True
+        logger.info(f"MongoDB indexes ensured: {created}")
+        return created
+
+    def _replace_plain_index(self, collection, keys: List[Tuple[str, int]], options: Dict[str, Any]) -> bool:
+        """
+        Swap a leftover non-unique index on the same keys for the unique one; False if that still fails
+        """
+        # เวอร์ชันก่อนสร้าง index แบบไม่ unique แทนเมื่อมีข้อมูลซ้ำ ซึ่งกันไม่ให้สร้าง unique index บน key เดียวกัน
+        plain_name = options["name"].replace("_unique", "")
+        plain = collection.index_information().get(plain_name)
+        if not plain or plain.get("unique") or [tuple(key) for key in plain["key"]] != keys:
+            return False
+        collection.drop_index(plain_name)
+        try:
+            collection.create_index(keys, **options)
+            return True
+        except (DuplicateKeyError, OperationFailure):
+            # ยังมีข้อมูลซ้ำอยู่: คืน index เดิมไว้ให้ค้นหาได้เร็วจนกว่าจะลบข้อมูลซ้ำ
+            collection.create_index(keys, name=plain_name)
+            return False
+
+    def verify_query_plans(self) -> List[Dict[str, Any]]:
+        """
+        Explain every query shape in QUERY_SHAPES and report whether its winning plan scans the whole collection
+        """
+        results = []
+        for collection_name, query, projection in QUERY_SHAPES:
+            plan = self.db[collection_name].find(query, projection).explain()
+            winning = plan.get("queryPlanner", {}).get("winningPlan", {})
+            stages = sorted(_plan_stages(winning))
+            results.append({
+                "collection": collection_name,
+                "query": query,
+                "stages": stages,
+                "collscan": "COLLSCAN" in stages
+            })
+            if "COLLSCAN" in stages:
+                logger.warning(f"Query on {collection_name} {query} uses a collection scan")
+        return results
+
+    def delete_properties(self, file_id: str) -> int:
+        """
+        Delete every property stored from the given upload batch
+        """
+        try:
+            result = self.properties.delete_many({"file_id": file_id})
+            return result.deleted_count
+        except Exception as e:
+            logger.error(f"Error deleting properties: {str(e)}")
+            raise
+
+    def save_ingestion_job(self, job: Dict[str, Any]) -> None:
+        """
+        Create or replace the persisted state of an ingestion job
+        """
+        self.ingestion_jobs.replace_one({"job_id": job["job_id"]}, job, upsert=True)
+
+    def update_ingestion_job(self, job_id: str, owner: str, fields: Dict[str, Any]) -> bool:
+        """
+        Checkpoint an ingestion job; only succeeds while `owner` still holds the job
+        """
+        result = self.ingestion_jobs.update_one({"job_id": job_id, "owner": owner}, {"$set": fields})
+        return result.matched_count > 0
+
+    def claim_ingestion_job(self, job_id: str, expected_owner: Optional[str], new_owner: str) -> Optional[Dict[str, Any]]:
+        """
+        Take over an unfinished ingestion job if it is still held by expected_owner (compare-and-swap)
+        """
+        return self.ingestion_jobs.find_one_and_update(
+            {"job_id": job_id, "owner": expected_owner, "status": {"$in": ["queued", "running"]}},
+            {"$set": {"owner": new_owner, "heartbeat_at": time.time()}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def get_ingestion_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.ingestion_jobs.find_one({"job_id": job_id}, {"_id": 0})
+
+    def get_unfinished_ingestion_jobs(self) -> List[Dict[str, Any]]:
+        return list(self.ingestion_jobs.find({"status": {"$in": ["queued", "running"]}}, {"_id": 0}))
+
     def get_properties(self, query: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         """
         Retrieve properties based on query
@@ -44,7 +493,7 @@ class MongoDBManager:
         try:
             if query is None:
                 query = {}
-            return list(self.properties.find(query, {"_id": 0}))
+            return list(self.properties.find(query, PROPERTY_FIELDS))
         except Exception as e:
             logger.error(f"Error retrieving properties: {str(e)}")
             raise
@@ -80,6 +529,18 @@ class MongoDBManager:
             logger.error(f"Error adding message: {str(e)}")
             raise
 
+    def add_session_messages(self, messages: Dict[str, List[Dict[str, Any]]]) -> int:
+        """
+        Append messages to several sessions with one unordered bulk_write; returns sessions updated
+        """
+        operations = [
+            UpdateOne({"session_id": session_id}, {"$push": {"messages": {"$each": items}}})
+            for session_id, items in messages.items() if items
+        ]
+        if not operations:
+            return 0
+        return self.sessions.bulk_write(operations, ordered=False).modified_count
+
     def get_session(self, session_id: str) -> Dict[str, Any]:
         """
         Retrieve a chat session
@@ -93,6 +554,15 @@ class MongoDBManager:
     def save_chat_room(self, chat_room_id: str, messages: List[Dict[str, Any]], user_id: Optional[str] = None) -> bool:
         """
         บันทึกหรืออัปเดตห้องแชทใน MongoDB
+
+        เอกสารห้องแชทเก็บเฉพาะข้อมูลสรุป (last_message, message_count) ส่วนข้อความ
+        เก็บใน collection chat_messages เป็น bucket ละ bucket_size ข้อความ
+        แต่ละข้อความได้เลขลำดับ seq จากการ $inc message_count แบบ atomic
+        
+        ไม่มีการ find_one ก่อนเขียน: ห้องแชทถูกสร้างหรืออัปเดตด้วย upsert ครั้งเดียว
+        ($setOnInsert/$set/$inc) และข้อความถูก $push เข้า bucket ด้วย bulk_write
+        ครั้งเดียว unique index ของ chat_room_id และ (chat_room_id, bucket)
+        ป้องกันเอกสารซ้ำเมื่อมีหลาย request เขียนห้องเดียวกันพร้อมกัน
         
         Args:
             chat_room_id: รหัสห้องแชท
@@ -102,42 +572,80 @@ class MongoDBManager:
         Returns:
             bool: True ถ้าบันทึกสำเร็จ, False ถ้าไม่สำเร็จ
         """
+        return self.save_chat_rooms({chat_room_id: (messages, user_id)})[chat_room_id]
+
+    def save_chat_rooms(self,
+                        rooms: Dict[str, Tuple[List[Dict[str, Any]], Optional[str]]],
+                        reserved: Optional[Dict[str, List[int]]] = None) -> Dict[str, bool]:
+        """
+        Save new messages of several chat rooms at once; returns success per room
+
+        Each room's summary is upserted on its own (the returned message_count
+        assigns the seq numbers), then the messages of every room are pushed
+        into their buckets with a single unordered bulk_write. To retry failed
+        rooms, pass the same `reserved` dict again (see ChatRoomsWrite): the
+        retry reuses the seqs reserved by the failed attempt.
+        """
+        write = ChatRoomsWrite(rooms, reserved)
+        for chat_room_id, (_, user_id) in rooms.items():
+            messages = write.unreserved(chat_room_id)
+            try:
+                try:
+                    room = self._reserve_messages(chat_room_id, messages, user_id) if messages is not None else None
+                except DuplicateKeyError:
+                    # ห้องแชทรูปแบบเดิม (messages เป็น array ในเอกสารห้อง): ย้ายข้อความไปเป็น bucket ก่อน
+                    self._migrate_legacy_room(chat_room_id)
+                    room = self._reserve_messages(chat_room_id, messages, user_id)
+                write.reserved(chat_room_id, room)
+            except Exception as e:
+                write.failed(chat_room_id, e)
+        if not write.operations:
+            return write.results
+
         try:
-            # ตรวจสอบว่ามีห้องแชทนี้อยู่แล้วหรือไม่
-            existing_room = self.chat_rooms.find_one({"chat_room_id": chat_room_id})
-            
-            if existing_room:
-                # อัปเดตห้องแชทที่มีอยู่
-                result = self.chat_rooms.update_one(
-                    {"chat_room_id": chat_room_id},
-                    {
-                        "$set": {
-                            "updated_at": pd.Timestamp.now(),
-                            "last_message": messages[-1] if messages else None
-                        },
-                        "$push": {"messages": {"$each": messages}}
-                    }
-                )
-                return result.modified_count > 0
-            else:
-                # สร้างห้องแชทใหม่
-                chat_room_data = {
-                    "chat_room_id": chat_room_id,
-                    "user_id": user_id,
-                    "created_at": pd.Timestamp.now(),
-                    "updated_at": pd.Timestamp.now(),
-                    "messages": messages,
-                    "last_message": messages[-1] if messages else None
-                }
-                self.chat_rooms.insert_one(chat_room_data)
-                return True
+            self.chat_messages.bulk_write(write.operations, ordered=False)
         except Exception as e:
-            logger.error(f"Error saving chat room: {str(e)}")
-            return False
+            return write.written(e)
+        return write.written()
+
+    def _reserve_messages(self, chat_room_id: str, messages: List[Dict[str, Any]], user_id: Optional[str]) -> Dict[str, Any]:
+        return self.chat_rooms.find_one_and_update(
+            reserve_filter(chat_room_id), reserve_update(messages, user_id), **RESERVE_OPTIONS)
+
+    def _migrate_legacy_room(self, chat_room_id: str) -> None:
+        room = self.chat_rooms.find_one({"chat_room_id": chat_room_id, "messages": {"$exists": True}}, {"messages": 1})
+        if room is None:
+            return
+        messages = room.get("messages") or []
+        bucket_size = CHAT_HISTORY_CONFIG['bucket_size']
+        numbered = [{**message, "seq": seq} for seq, message in enumerate(messages)]
+        for bucket, group in groupby(numbered, key=lambda message: message["seq"] // bucket_size):
+            items = list(group)
+            # replace ทั้ง bucket เพื่อให้ทำซ้ำได้ถ้าการย้ายถูกขัดจังหวะ
+            self.chat_messages.replace_one(
+                {"chat_room_id": chat_room_id, "bucket": bucket},
+                {"chat_room_id": chat_room_id, "bucket": bucket, "messages": items,
+                 "first_seq": items[0]["seq"], "last_seq": items[-1]["seq"], "created_at": pd.Timestamp.now()},
+                upsert=True
+            )
+        self.chat_rooms.update_one(
+            {"_id": room["_id"], "messages": {"$exists": True}},
+            {"$set": {"message_count": len(messages)}, "$unset": {"messages": ""}}
+        )
+        logger.info(f"Moved {len(messages)} messages of chat room {chat_room_id} into buckets")
+
+    def migrate_legacy_chat_rooms(self) -> int:
+        """
+        Move every chat room that still embeds its messages array into bucket documents
+        """
+        rooms = [room["chat_room_id"] for room in self.chat_rooms.find({"messages": {"$exists": True}}, {"chat_room_id": 1})]
+        for chat_room_id in rooms:
+            self._migrate_legacy_room(chat_room_id)
+        return len(rooms)
             
     def get_chat_room(self, chat_room_id: str) -> Dict[str, Any]:
         """
-        ดึงข้อมูลห้องแชทจาก MongoDB
+        ดึงข้อมูลสรุปของห้องแชทจาก MongoDB (ไม่รวมข้อความ ใช้ get_chat_messages)
         
         Args:
             chat_room_id: รหัสห้องแชท
@@ -146,10 +654,40 @@ class MongoDBManager:
             Dict[str, Any]: ข้อมูลห้องแชท หรือ None ถ้าไม่พบ
         """
         try:
-            return self.chat_rooms.find_one({"chat_room_id": chat_room_id}, {"_id": 0})
+            return self.chat_rooms.find_one({"chat_room_id": chat_room_id}, CHAT_ROOM_FIELDS)
         except Exception as e:
             logger.error(f"Error retrieving chat room: {str(e)}")
             return None
+
+    def get_chat_messages(self, chat_room_id: str, before: Optional[int] = None, limit: Optional[int] = None) -> Dict[str, Any]:
+        """
+        ดึงข้อความในห้องแชทแบบแบ่งหน้า ย้อนจากข้อความล่าสุด
+        
+        Args:
+            chat_room_id: รหัสห้องแชท
+            before: ดึงเฉพาะข้อความที่ seq น้อยกว่าค่านี้ (None = จากข้อความล่าสุด)
+            limit: จำนวนข้อความสูงสุด
+            
+        Returns:
+            Dict[str, Any]: messages (เรียงจากเก่าไปใหม่) และ next_before สำหรับหน้าถัดไป (None ถ้าไม่มีแล้ว)
+        """
+        try:
+            page = self._collect_messages(HistoryPage(chat_room_id, before, limit))
+            if not page.messages and before is None and self.chat_rooms.count_documents(
+                    {"chat_room_id": chat_room_id, "messages": {"$exists": True}}, limit=1):
+                self._migrate_legacy_room(chat_room_id)
+                page = self._collect_messages(HistoryPage(chat_room_id, before, limit))
+            return page.result()
+        except Exception as e:
+            logger.error(f"Error retrieving chat messages: {str(e)}")
+            return history_page([])
+
+    def _collect_messages(self, page: HistoryPage) -> HistoryPage:
+        # ใหม่ไปเก่า: อ่านทีละ bucket จนได้ครบ limit
+        for bucket in self.chat_messages.find(page.query, BUCKET_FIELDS).sort("bucket", DESCENDING):
+            if page.add(bucket):
+                break
+        return page
             
     def get_user_chat_rooms(self, user_id: str) -> List[Dict[str, Any]]:
         """
@@ -162,7 +700,8 @@ class MongoDBManager:
             List[Dict[str, Any]]: รายการห้องแชท
         """
         try:
-            return list(self.chat_rooms.find({"user_id": user_id}, {"_id": 0}))
+            # รายการห้องแชทไม่ต้องส่งข้อความทั้งหมดของแต่ละห้อง
+            return list(self.chat_rooms.find({"user_id": user_id}, CHAT_ROOM_SUMMARY_FIELDS).sort("updated_at", DESCENDING))
         except Exception as e:
             logger.error(f"Error retrieving user chat rooms: {str(e)}")
             return []
@@ -178,29 +717,13 @@ class MongoDBManager:
             bool: True ถ้าบันทึกสำเร็จ, False ถ้าไม่สำเร็จ
         """
         try:
-            # ตรวจสอบว่ามีผู้ใช้นี้อยู่แล้วหรือไม่
-            existing_user = self.users.find_one({"id": user_data["id"]})
-            
-            if existing_user:
-                # อัปเดตข้อมูลผู้ใช้ที่มีอยู่
-                result = self.users.update_one(
-                    {"id": user_data["id"]},
-                    {
-                        "$set": {
-                            "email": user_data["email"],
-                            "name": user_data["name"],
-                            "password": user_data["password"],
-                            "updated_at": pd.Timestamp.now()
-                        }
-                    }
-                )
-                return result.modified_count > 0
-            else:
-                # สร้างผู้ใช้ใหม่
-                user_data["created_at"] = pd.Timestamp.now()
-                user_data["updated_at"] = pd.Timestamp.now()
-                self.users.insert_one(user_data)
-                return True
+            # upsert ครั้งเดียวแบบ atomic (ไม่ต้อง find_one ก่อน) โดยมี unique index ของ id และ email รองรับ
+            result = self.users.update_one({"id": user_data["id"]}, user_upsert(user_data), upsert=True)
+            return result.upserted_id is not None or result.modified_count > 0
+        except DuplicateKeyError as e:
+            # อีเมลนี้ถูกใช้โดยผู้ใช้อื่นแล้ว (เช่น ลงทะเบียนพร้อมกัน)
+            logger.warning(f"User {user_data.get('id')} conflicts with an existing user: {str(e)}")
+            return False
         except Exception as e:
             logger.error(f"Error saving user: {str(e)}")
             return False
@@ -216,7 +739,7 @@ class MongoDBManager:
             Dict[str, Any]: ข้อมูลผู้ใช้ หรือ None ถ้าไม่พบ
         """
         try:
-            return self.users.find_one({"id": user_id}, {"_id": 0})
+            return self.users.find_one({"id": user_id}, USER_FIELDS)
         except Exception as e:
             logger.error(f"Error retrieving user: {str(e)}")
             return None
@@ -232,14 +755,41 @@ class MongoDBManager:
             Dict[str, Any]: ข้อมูลผู้ใช้ หรือ None ถ้าไม่พบ
         """
         try:
-            return self.users.find_one({"email": email}, {"_id": 0})
+            return self.users.find_one({"email": email}, USER_FIELDS)
         except Exception as e:
             logger.error(f"Error retrieving user by email: {str(e)}")
             return None
 
+    def ping(self) -> bool:
+        """
+        Check that the MongoDB server is reachable
+        """
+        try:
+            self.client.admin.command("ping")
+            return True
+        except Exception as e:
+            logger.error(f"MongoDB ping failed: {str(e)}")
+            return False
+
     def close(self):
         """
         Close the MongoDB connection
         """
         if hasattr(self, 'client'):
             self.client.close()
+
+
+def _plan_stages(plan: Any) -> set:
+    """
+    Every `stage` name in an explain plan tree
+    """
+    stages = set()
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.add(plan["stage"])
+        for value in plan.values():
+            stages |= _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            stages |= _plan_stages(item)
+    return stages
@@ -0,0 +1,73 @@
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import torch
+from generation_scheduler import to_legacy_cache
+
+logger = logging.getLogger(__name__)
+
+class PromptPrefixCache:
+    def __init__(self, model, tokenizer, max_entries: int = 16):
+        """
+        Attention key/value state of static prompt prefixes, computed once and reused
+
+        Each entry holds the token ids of a prefix (including BOS) and the
+        legacy per-layer (key, value) tensors from a single forward pass over
+        it. A prompt reuses an entry only if its own tokenization starts with
+        exactly those ids, so tokenizer merges across the prefix boundary can
+        never produce a wrong cache.
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self._entries: Dict[str, Tuple[List[int], list]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.mismatches = 0
+        self.tokens_saved = 0
+
+    def lookup(self, prompt_ids: List[int], prefix: str) -> Optional[Tuple[int, list]]:
+        """
+        Return (prefix length, cached key/values) if prompt_ids start with the prefix tokens
+        """
+        ids, cache = self._entry(prefix)
+        if len(prompt_ids) > len(ids) and prompt_ids[:len(ids)] == ids:
+            self.hits += 1
+            self.tokens_saved += len(ids)
+            return len(ids), cache
+        self.mismatches += 1
+        return None
+
+    def warm(self, prefixes: List[str]) -> None:
+        for prefix in prefixes:
+            self._entry(prefix)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "prefix_tokens": {len(ids): prefix.strip()[:40] for prefix, (ids, _) in self._entries.items()},
+            "hits": self.hits,
+            "mismatches": self.mismatches,
+            "tokens_saved": self.tokens_saved
+        }
+
+    def _entry(self, prefix: str) -> Tuple[List[int], list]:
+        entry = self._entries.get(prefix)
+        if entry is not None:
+            return entry
+        with self._lock:
+            entry = self._entries.get(prefix)
+            if entry is None:
+                ids = list(self.tokenizer(prefix)["input_ids"])
+                with torch.inference_mode():
+                    outputs = self.model(input_ids=torch.tensor([ids], dtype=torch.long), use_cache=True)
+                entry = (ids, to_legacy_cache(outputs.past_key_values))
+                if len(self._entries) >= self.max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+                self._entries[prefix] = entry
+                logger.info(f"Cached key/value state for a {len(ids)}-token prompt prefix")
+            return entry
@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+from typing import Dict, Any, Optional
+from pymongo.errors import OperationFailure, PyMongoError
+from config import PROPERTY_WATCH_MAX_AWAIT_MS
+
+logger = logging.getLogger(__name__)
+
+class PropertyChangeWatcher:
+    def __init__(self, collection, vector_store, retry_delay: float = 5.0):
+        """
+        Keeps a VectorStore in sync with edits made directly to the properties collection
+
+        Listens to the MongoDB change stream in a background thread and applies
+        inserts, updates and deletes to the index without a full rebuild.
+        Change streams require a replica set; on a standalone server the watcher
+        logs the error and stops.
+        """
+        self.collection = collection
+        self.vector_store = vector_store
+        self.retry_delay = retry_delay
+        self._resume_token = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        Start watching in a daemon thread
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="property-change-watcher", daemon=True)
+        self._thread.start()
+        logger.info("Started property change watcher")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Stop watching and wait for the background thread to exit
+        """
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        logger.info("Stopped property change watcher")
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                with self.collection.watch(
+                    full_document="updateLookup",
+                    resume_after=self._resume_token,
+                    max_await_time_ms=PROPERTY_WATCH_MAX_AWAIT_MS
+                ) as stream:
+                    while not self._stop_event.is_set() and stream.alive:
+                        change = stream.try_next()
+                        self._resume_token = stream.resume_token
+                        if change is not None:
+                            self._apply_change(change)
+            except OperationFailure as e:
+                # เช่น MongoDB แบบ standalone ไม่รองรับ change stream
+                logger.error(f"Property change stream is not available: {str(e)}")
+                return
+            except PyMongoError as e:
+                logger.warning(f"Property change stream interrupted, retrying: {str(e)}")
+                time.sleep(self.retry_delay)
+            except Exception as e:
+                logger.error(f"Error in property change watcher: {str(e)}")
+                time.sleep(self.retry_delay)
+
+    def _apply_change(self, change: Dict[str, Any]) -> None:
+        operation = change.get("operationType")
+        document_key = change.get("documentKey") or {}
+        property_id = str(document_key.get("_id")) if "_id" in document_key else None
+
+        if operation == "insert":
+            # ข้อมูลที่เพิ่มผ่าน /api/upload ถูก index ไปแล้ว ไม่ต้อง embed ซ้ำ
+            if property_id and self.vector_store.contains(property_id):
+                return
+            self._upsert(change.get("fullDocument"))
+        elif operation in ("update", "replace"):
+            updated_fields = (change.get("updateDescription") or {}).get("updatedFields") or {}
+            if operation == "update" and set(updated_fields) == {"file_id"} and property_id \
+                    and self.vector_store.contains(property_id):
+                # อัพโหลดซ้ำแล้วประกาศไม่เปลี่ยน: ย้ายแค่ file_id ไม่ต้อง embed ใหม่
+                self.vector_store.set_file_id([property_id], updated_fields["file_id"])
+                return
+            document = change.get("fullDocument")
+            if document is None and property_id:
+                # เอกสารถูกลบไปก่อนที่จะ lookup ได้
+                self.vector_store.remove_by_ids([property_id])
+            else:
+                self._upsert(document)
+        elif operation == "delete":
+            if property_id:
+                self.vector_store.remove_by_ids([property_id])
+        elif operation in ("drop", "invalidate"):
+            logger.warning(f"Properties collection {operation} event received, clearing index")
+            self.vector_store.rebuild([])
+            self._resume_token = None
+
+    def _upsert(self, document: Optional[Dict[str, Any]]) -> None:
+        if not document:
+            return
+        document["_id"] = str(document["_id"])
+        self.vector_store.upsert_properties([document])
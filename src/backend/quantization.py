@@ -0,0 +1,107 @@
+import itertools
+import logging
+import os
+import re
+import time
+from typing import Optional, Tuple
+import torch
+import transformers
+from transformers import AutoModelForCausalLM
+
+logger = logging.getLogger(__name__)
+
+# none = fp32 แบบเดิม, bf16 = น้ำหนัก bfloat16 (CPU ที่รองรับ AVX512-BF16/AMX), int8 = dynamic quantization ของ Linear
+QUANTIZATION_MODES = ("none", "bf16", "int8")
+
+def bf16_supported() -> bool:
+    """
+    True when the CPU has native bfloat16 matmul support (otherwise bf16 is emulated and slower than fp32)
+    """
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+def load_causal_lm(model_name: str,
+                   mode: str = "none",
+                   cache_dir: Optional[str] = None,
+                   vocab_size: Optional[int] = None) -> Tuple[torch.nn.Module, str]:
+    """
+    Load a causal LM in the requested execution mode; returns (model, mode actually used)
+
+    int8 models are converted once with torch dynamic quantization and the
+    converted module is saved under cache_dir, so later starts load the int8
+    weights directly instead of loading fp32 and converting again. The cache
+    file name includes the model, vocabulary size and torch/transformers
+    versions, because a pickled module is only valid for the versions that
+    wrote it.
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode {mode!r}, expected one of {QUANTIZATION_MODES}")
+    if mode == "bf16" and not bf16_supported():
+        logger.warning("bf16 requested but this CPU has no native bfloat16 support, using fp32")
+        mode = "none"
+
+    if mode == "bf16":
+        model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.bfloat16)
+        _resize(model, vocab_size)
+        return model.eval(), mode
+
+    if mode == "none":
+        model = AutoModelForCausalLM.from_pretrained(model_name)
+        _resize(model, vocab_size)
+        return model.eval(), mode
+
+    cache_path = _cache_path(cache_dir, model_name, mode, vocab_size) if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            started = time.perf_counter()
+            model = torch.load(cache_path, weights_only=False)
+            logger.info(f"Loaded {mode} model from {cache_path} in {time.perf_counter() - started:.1f}s")
+            return model.eval(), mode
+        except Exception as e:
+            logger.error(f"Error loading quantized model cache {cache_path}, converting again: {str(e)}")
+
+    started = time.perf_counter()
+    model = AutoModelForCausalLM.from_pretrained(model_name)
+    _resize(model, vocab_size)
+    model.eval()
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    logger.info(f"Converted {model_name} to {mode} in {time.perf_counter() - started:.1f}s")
+
+    if cache_path:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            # เขียนไฟล์ชั่วคราวก่อนแล้วค่อย rename เพื่อให้ worker อื่นไม่เห็นไฟล์ที่เขียนไม่เสร็จ
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            torch.save(model, tmp_path)
+            os.replace(tmp_path, cache_path)
+            logger.info(f"Saved {mode} model to {cache_path}")
+        except Exception as e:
+            logger.error(f"Error saving quantized model cache: {str(e)}")
+    return model, mode
+
+def model_memory_bytes(model: torch.nn.Module) -> int:
+    """
+    Bytes held by parameters, buffers and packed int8 Linear weights
+    """
+    total = sum(t.numel() * t.element_size() for t in itertools.chain(model.parameters(), model.buffers()))
+    for module in model.modules():
+        if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+            weight = module.weight()
+            total += weight.numel() * weight.element_size()
+            bias = module.bias()
+            if bias is not None:
+                total += bias.numel() * bias.element_size()
+    return total
+
+def _resize(model: torch.nn.Module, vocab_size: Optional[int]) -> None:
+    if vocab_size is not None and model.get_input_embeddings().num_embeddings != vocab_size:
+        model.resize_token_embeddings(vocab_size)
+
+def _cache_path(cache_dir: str, model_name: str, mode: str, vocab_size: Optional[int]) -> str:
+    safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "--", model_name)
+    return os.path.join(
+        cache_dir,
+        f"{safe_name}-{mode}-vocab{vocab_size or 'default'}-torch{torch.__version__}-tf{transformers.__version__}.pt"
+    )
@@ -0,0 +1,82 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class ReadinessTracker:
+    def __init__(self, components: List[str], started_at: float, budget_seconds: float):
+        """
+        Per-component startup status plus cold-start timing
+
+        `started_at` is a time.monotonic() reading taken as early as possible
+        in the process. The tracker records when the API started answering and
+        when every component first became ready, and warns when the latter
+        exceeds `budget_seconds`.
+        """
+        self.started_at = started_at
+        self.budget_seconds = budget_seconds
+        self.api_ready_seconds: Optional[float] = None
+        self.ready_seconds: Optional[float] = None
+        self._components = {
+            name: {"status": "pending", "error": None, "seconds": None} for name in components
+        }
+        self._lock = threading.Lock()
+
+    def mark_api_ready(self) -> None:
+        self.api_ready_seconds = time.monotonic() - self.started_at
+        logger.info(f"API accepting requests {self.api_ready_seconds:.2f}s after process start")
+
+    def set(self, component: str, status: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            entry = self._components[component]
+            entry["status"] = status
+            entry["error"] = error
+            if status == "ready" and entry["seconds"] is None:
+                entry["seconds"] = time.monotonic() - self.started_at
+        self._check_ready()
+
+    def run(self, component: str, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run a startup step, recording loading/ready/failed for the component
+        """
+        self.set(component, "loading")
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.set(component, "failed", str(e))
+            raise
+        self.set(component, "ready")
+        return result
+
+    def status(self, component: str) -> str:
+        with self._lock:
+            return self._components[component]["status"]
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return all(entry["status"] == "ready" for entry in self._components.values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            components = {name: dict(entry) for name, entry in self._components.items()}
+        return {
+            "ready": all(entry["status"] == "ready" for entry in components.values()),
+            "components": components,
+            "uptime_seconds": time.monotonic() - self.started_at,
+            "api_ready_seconds": self.api_ready_seconds,
+            "ready_seconds": self.ready_seconds,
+            "budget_seconds": self.budget_seconds,
+            "within_budget": self.ready_seconds <= self.budget_seconds if self.ready_seconds is not None else None
+        }
+
+    def _check_ready(self) -> None:
+        if self.ready_seconds is not None or not self.ready:
+            return
+        self.ready_seconds = time.monotonic() - self.started_at
+        if self.ready_seconds > self.budget_seconds:
+            logger.warning(f"Cold start took {self.ready_seconds:.1f}s, over the {self.budget_seconds:.0f}s budget")
+        else:
+            logger.info(f"All components ready {self.ready_seconds:.1f}s after process start")
@@ -1,5 +1,7 @@
 
+import os
 import uvicorn
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # reload ใช้ระหว่างพัฒนาเท่านั้น (API_RELOAD=false สำหรับ production)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=os.getenv("API_RELOAD", "true").lower() == "true")
@@ -8,12 +8,16 @@ import json
 logger = logging.getLogger(__name__)
 
 class SessionManager:
-    def __init__(self, mongodb_manager=None):
+    def __init__(self, mongodb_manager=None, write_buffer=None):
         """
         Manages chat sessions for the AI property consultant
+
+        With a ChatWriteBuffer, message writes are batched in the background
+        instead of one update_one per message.
         """
         self.sessions = {}  # In-memory sessions (would use MongoDB in production)
         self.mongodb_manager = mongodb_manager
+        self.write_buffer = write_buffer
         logger.info("Initialized SessionManager")
         
     def create_session(self, user_id: Optional[str] = None) -> str:
@@ -82,7 +86,9 @@ class SessionManager:
                 self.sessions[session_id]["last_activity"] = timestamp
                 
             # Update in MongoDB if available
-            if self.mongodb_manager:
+            if self.write_buffer:
+                self.write_buffer.add_session_message(session_id, message)
+            elif self.mongodb_manager:
                 self.mongodb_manager.add_message(session_id, message)
                 
             return True
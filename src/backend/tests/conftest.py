@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import zlib
+import numpy as np
+import pytest
+
+# โมดูลของ backend import กันแบบ flat (from config import ...) จึงต้องเพิ่ม src/backend ลงใน path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubEncoder:
+    """
+    Deterministic stand-in for the SentenceTransformer encoder: same text, same vector
+    """
+    dimension = 16
+    backend = "stub"
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts):
+        self.encoded.extend(texts)
+        # ช่องว่างไม่มีผล เหมือน normalize_query ของคำค้นหา
+        return np.stack([
+            np.random.default_rng(zlib.crc32(" ".join(text.split()).encode("utf-8"))).standard_normal(self.dimension)
+            for text in texts
+        ]).astype(np.float32)
+
+
+@pytest.fixture
+def stub_vector_store():
+    """
+    VectorStore with a StubEncoder and no on-disk embedding cache
+    """
+    from vector_store import VectorStore
+    store = VectorStore(lazy=True)
+    store.encoder = StubEncoder()
+    store.encoder_status = "ready"
+    store.dimension = StubEncoder.dimension
+    store.matrix = np.zeros((0, StubEncoder.dimension), dtype=np.float32)
+    return store
+
+
+@pytest.fixture
+def mongomock_manager(monkeypatch):
+    """
+    MongoDBManager backed by an in-memory mongomock client (a fresh database per test)
+    """
+    mongomock = pytest.importorskip("mongomock")
+    pytest.importorskip("pandas")
+    import mongodb_manager
+    monkeypatch.setattr(mongodb_manager, "MongoClient", mongomock.MongoClient)
+    manager = mongodb_manager.MongoDBManager()
+    # mongomock คืน None เมื่อ find_one_and_update มี projection ที่ตัด _id ออกและขอเอกสารหลังแก้ไข
+    find_one_and_update = manager.ingestion_jobs.find_one_and_update
+
+    def find_one_and_update_without_id(*args, projection=None, **kwargs):
+        document = find_one_and_update(*args, **kwargs)
+        if document is not None and projection == {"_id": 0}:
+            document.pop("_id", None)
+        return document
+
+    monkeypatch.setattr(manager.ingestion_jobs, "find_one_and_update", find_one_and_update_without_id)
+    return manager
+
+
+@pytest.fixture
+def ingestion_pipeline(mongomock_manager, stub_vector_store):
+    """
+    IngestionPipeline over mongomock that embeds straight into the stub vector store (2 rows per chunk)
+    """
+    from ingestion import IngestionPipeline
+    pipeline = IngestionPipeline(mongomock_manager, stub_vector_store, embed=stub_vector_store.upsert_properties,
+                                 chunk_rows=2)
+    yield pipeline
+    pipeline.shutdown()
+
+
+@pytest.fixture
+def listing_csv(tmp_path):
+    """
+    Factory writing an upload CSV with one listing per project name
+    """
+    import pandas as pd
+    from ingestion import EXPECTED_COLUMNS
+
+    def write(name, projects):
+        rows = [{column: "ไม่มี" for column in EXPECTED_COLUMNS} for _ in projects]
+        for row, project in zip(rows, projects):
+            row.update({"ประเภท": "คอนโด", "โครงการ": project, "ราคา": 1000000, "ตำแหน่ง": "บางนา"})
+        path = str(tmp_path / name)
+        pd.DataFrame(rows, columns=EXPECTED_COLUMNS).to_csv(path, index=False)
+        return path
+
+    return write
+
+
+def wait_for_jobs(pipeline, count, timeout=10.0):
+    """
+    Block until the pipeline's worker has finished `count` jobs in total
+    """
+    deadline = time.monotonic() + timeout
+    while pipeline.executor.completed + pipeline.executor.failed < count:
+        assert time.monotonic() < deadline, "ingestion jobs did not finish in time"
+        time.sleep(0.01)
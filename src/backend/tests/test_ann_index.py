@@ -0,0 +1,51 @@
+import numpy as np
+from ann_index import IVFIndex, build_inverted_lists, gather_candidates
+
+
+def _normalized(rng, n, dim, centers):
+    vectors = centers[rng.integers(0, len(centers), size=n)] + 0.3 * rng.standard_normal((n, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def _ann_top_k(index, lists, matrix, query, k, nprobe):
+    rows = gather_candidates(*lists, index.probe(query, nprobe))
+    scores = matrix[rows] @ query
+    return rows[np.argsort(-scores, kind="stable")[:k]]
+
+
+def test_inverted_lists_cover_every_row():
+    assignments = np.array([2, 0, 2, 1, 0], dtype=np.int32)
+    order, offsets = build_inverted_lists(assignments, 4)
+    assert offsets.tolist() == [0, 2, 3, 5, 5]
+    assert gather_candidates(order, offsets, np.array([0, 2])).tolist() == [0, 1, 2, 4]
+    assert gather_candidates(order, offsets, np.array([3])).tolist() == []
+    assert gather_candidates(order, offsets, np.arange(4)).tolist() == list(range(5))
+
+
+def test_ann_recall_against_exact():
+    rng = np.random.default_rng(42)
+    dim, k = 32, 10
+    centers = rng.standard_normal((16, dim))
+    matrix = _normalized(rng, 4000, dim, centers)
+    queries = _normalized(rng, 50, dim, centers)
+
+    index = IVFIndex.train(matrix, nlist=32, iterations=10)
+    lists = build_inverted_lists(index.assign(matrix), index.nlist)
+
+    hits = 0
+    for query in queries:
+        exact = np.argsort(-(matrix @ query), kind="stable")[:k]
+        approx = _ann_top_k(index, lists, matrix, query, k, nprobe=8)
+        hits += len(set(exact.tolist()) & set(approx.tolist()))
+    assert hits / (k * len(queries)) >= 0.9
+
+
+def test_probing_every_list_is_exact():
+    rng = np.random.default_rng(7)
+    dim = 16
+    matrix = _normalized(rng, 500, dim, rng.standard_normal((4, dim)))
+    index = IVFIndex.train(matrix, nlist=8)
+    lists = build_inverted_lists(index.assign(matrix), index.nlist)
+    query = matrix[0]
+    exact = np.argsort(-(matrix @ query), kind="stable")[:20]
+    assert _ann_top_k(index, lists, matrix, query, 20, nprobe=index.nlist).tolist() == exact.tolist()
@@ -0,0 +1,54 @@
+import pytest
+
+pytest.importorskip("pymongo")
+pytest.importorskip("pandas")
+
+from mongodb_manager import HistoryPage, history_page, take_messages
+
+
+def _bucket(seqs):
+    # ลำดับใน bucket ไม่จำเป็นต้องเรียงตาม seq (writer พร้อมกัน)
+    return {"messages": [{"seq": seq, "content": f"m{seq}"} for seq in seqs]}
+
+
+def test_take_messages_newest_first_until_limit():
+    collected = []
+    assert take_messages(_bucket([8, 9, 7]), None, collected, 5) is False
+    assert take_messages(_bucket([5, 4, 6, 3]), None, collected, 5) is True
+    assert [m["seq"] for m in collected] == [9, 8, 7, 6, 5]
+
+
+def test_take_messages_skips_seqs_at_or_after_before():
+    collected = []
+    assert take_messages(_bucket([4, 5, 6, 7]), 6, collected, 10) is False
+    assert [m["seq"] for m in collected] == [5, 4]
+
+
+def test_history_page_is_oldest_first_with_cursor():
+    page = history_page([{"seq": 9}, {"seq": 8}, {"seq": 7}])
+    assert [m["seq"] for m in page["messages"]] == [7, 8, 9]
+    assert page["next_before"] == 7
+
+
+def test_history_page_ends_at_first_message():
+    assert history_page([{"seq": 1}, {"seq": 0}])["next_before"] is None
+    assert history_page([]) == {"messages": [], "next_before": None}
+
+
+def test_history_page_walks_back_through_buckets():
+    buckets = [_bucket(range(10, 15)), _bucket(range(5, 10)), _bucket(range(0, 5))]
+    seen = []
+    before = None
+    while True:
+        page = HistoryPage("room", before, 4)
+        for bucket in buckets:
+            if before is not None and min(m["seq"] for m in bucket["messages"]) >= before:
+                continue
+            if page.add(bucket):
+                break
+        result = page.result()
+        seen = [m["seq"] for m in result["messages"]] + seen
+        before = result["next_before"]
+        if before is None:
+            break
+    assert seen == list(range(15))
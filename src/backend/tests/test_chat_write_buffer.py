@@ -0,0 +1,99 @@
+import json
+import threading
+from chat_write_buffer import ChatWriteBuffer
+
+
+class FakeManager:
+    """
+    Stand-in for MongoDBManager: reserves seqs like ChatRoomsWrite and records every write
+    """
+    def __init__(self):
+        self.next_seq = {}
+        self.written = {}
+        self.calls = []
+        self.fail_next = 0
+        self.block = None
+
+    def save_chat_rooms(self, rooms, reserved=None):
+        reserved = reserved if reserved is not None else {}
+        results = {}
+        for chat_room_id, (messages, _) in rooms.items():
+            seqs = list(reserved.get(chat_room_id, []))
+            start = self.next_seq.get(chat_room_id, 0)
+            new = list(range(start, start + len(messages) - len(seqs)))
+            self.next_seq[chat_room_id] = start + len(new)
+            reserved[chat_room_id] = seqs + new
+            self.calls.append((chat_room_id, [m["content"] for m in messages], seqs + new))
+        if self.block is not None:
+            entered, release = self.block
+            self.block = None
+            entered.set()
+            release.wait(5)
+        if self.fail_next:
+            self.fail_next -= 1
+            raise RuntimeError("bulk write failed")
+        for chat_room_id, (messages, _) in rooms.items():
+            for message, seq in zip(messages, reserved[chat_room_id]):
+                self.written.setdefault(chat_room_id, {})[seq] = message["content"]
+            results[chat_room_id] = True
+        return results
+
+    def add_session_messages(self, messages):
+        return len(messages)
+
+    def add_message(self, session_id, message):
+        return True
+
+
+def _message(content):
+    return {"role": "user", "content": content}
+
+
+def _buffer(manager, **kwargs):
+    return ChatWriteBuffer(manager, mode="ack", flush_interval=0.01, retry_delay=0.01, **kwargs)
+
+
+def test_requeued_messages_stay_ahead_of_newer_ones():
+    manager = FakeManager()
+    manager.fail_next = 1
+    entered, release = threading.Event(), threading.Event()
+    manager.block = (entered, release)
+    buffer = _buffer(manager)
+
+    first = buffer.submit_chat_room("room", [_message("a"), _message("b")])
+    assert entered.wait(5)
+    # ข้อความใหม่เข้ามาระหว่างที่ flush แรกกำลังล้มเหลว
+    second = buffer.submit_chat_room("room", [_message("c")])
+    release.set()
+
+    assert first.result(5) is True
+    assert second.result(5) is True
+    buffer.close()
+
+    assert manager.written["room"] == {0: "a", 1: "b", 2: "c"}
+    # รอบที่ลองใหม่ใช้ seq เดิมของ a, b และจองเพิ่มเฉพาะ c
+    assert manager.calls[0] == ("room", ["a", "b"], [0, 1])
+    assert manager.calls[-1] == ("room", ["a", "b", "c"], [0, 1, 2])
+    assert manager.next_seq["room"] == 3
+
+
+def test_close_spills_and_replay_reuses_seqs(tmp_path):
+    path = str(tmp_path / "chat_writes.jsonl")
+    manager = FakeManager()
+    manager.fail_next = 1000
+    buffer = _buffer(manager, fallback_path=path)
+    future = buffer.submit_chat_room("room", [_message("a")], "u1")
+    buffer.close()
+    assert future.result(5) is False
+
+    with open(path, encoding="utf-8") as f:
+        entry = json.loads(f.readline())
+    assert entry["chat_room_id"] == "room"
+    assert entry["seqs"] == [0]
+
+    manager.fail_next = 0
+    restarted = _buffer(manager, fallback_path=path)
+    assert restarted.replay() == 1
+    restarted.close()
+    assert manager.written["room"] == {0: "a"}
+    assert manager.next_seq["room"] == 1
@@ -0,0 +1,29 @@
+import numpy as np
+from embedding_cache import EmbeddingCache
+
+
+def _vectors(n, dim=4, offset=0):
+    return np.arange(offset, offset + n * dim, dtype=np.float32).reshape(n, dim)
+
+
+def test_put_many_skips_repeated_and_cached_texts(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "stub-model", 4)
+    cache.put_many(["a", "b", "a"], _vectors(3))
+    assert len(cache) == 2
+    cache.put_many(["b", "c"], _vectors(2, offset=100))
+    assert len(cache) == 3
+
+    embeddings, missing = cache.get_many(["a", "b", "c", "d"])
+    assert missing == [3]
+    assert embeddings[0].tolist() == _vectors(1).tolist()[0]
+    assert embeddings[2].tolist() == _vectors(2, offset=100).tolist()[1]
+
+
+def test_rows_appended_by_another_instance_are_visible(tmp_path):
+    first = EmbeddingCache(str(tmp_path), "stub-model", 4)
+    second = EmbeddingCache(str(tmp_path), "stub-model", 4)
+    first.put_many(["a"], _vectors(1))
+    second.put_many(["b"], _vectors(1, offset=10))
+    _, missing = second.get_many(["a", "b"])
+    assert missing == []
+    assert len(second) == 2
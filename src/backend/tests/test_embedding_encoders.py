@@ -0,0 +1,35 @@
+import embedding_encoders
+from embedding_encoders import _write_meta, create_encoder
+
+
+class _Reference:
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+
+def test_broken_export_that_passed_parity_is_reexported(tmp_path, monkeypatch):
+    model_dir = tmp_path / "stub-model"
+    model_dir.mkdir()
+    _write_meta(str(model_dir), {"model_name": "stub-model",
+                                 "parity": {"onnx": {"passed": True, "min_cosine": 0.999}}})
+    exports, loads = [], []
+
+    def onnx_encoder(export_dir, quantized=False):
+        loads.append(export_dir)
+        if not exports:
+            raise RuntimeError("truncated model.onnx")
+        return "onnx-encoder"
+
+    def export_onnx(reference, export_dir):
+        exports.append(export_dir)
+        _write_meta(export_dir, {"model_name": reference.model_name})
+
+    monkeypatch.setattr(embedding_encoders, "SentenceTransformerEncoder", _Reference)
+    monkeypatch.setattr(embedding_encoders, "OnnxEncoder", onnx_encoder)
+    monkeypatch.setattr(embedding_encoders, "export_onnx", export_onnx)
+    monkeypatch.setattr(embedding_encoders, "check_parity",
+                        lambda reference, candidate, texts, tolerance: {"passed": True, "min_cosine": 0.999})
+
+    assert create_encoder("stub-model", backend="onnx", export_dir=str(tmp_path)) == "onnx-encoder"
+    assert exports == [str(model_dir)]
+    assert len(loads) == 2
@@ -0,0 +1,39 @@
+def _prop(property_id, project, file_id):
+    return {"_id": property_id, "ประเภท": "คอนโด", "โครงการ": project, "ตำแหน่ง": "บางนา", "file_id": file_id}
+
+
+def _search_own_text(store, prop):
+    # StubEncoder ให้เวกเตอร์เดียวกันกับข้อความเดียวกัน: ค้นด้วยข้อความของประกาศเองจึงเจอแน่นอน
+    return store.search(store._get_property_text(prop), top_k=1)
+
+
+def test_set_file_id_invalidates_cached_results(stub_vector_store):
+    store = stub_vector_store
+    prop = _prop("a", "A", "f1")
+    store.rebuild([prop, _prop("b", "B", "f1")])
+    assert _search_own_text(store, prop)[0]["file_id"] == "f1"
+    version = store.index_version
+
+    assert store.set_file_id(["a"], "f2") == 1
+    assert store.index_version > version
+    assert len(store.result_cache) == 0
+    assert _search_own_text(store, prop)[0]["file_id"] == "f2"
+
+    # ไม่มีอะไรย้าย: index และ cache ไม่เปลี่ยน
+    version = store.index_version
+    assert store.set_file_id(["missing"], "f3") == 0
+    assert store.index_version == version
+    assert len(store.result_cache) == 1
+
+
+def test_remove_by_file_id_invalidates_cached_results(stub_vector_store):
+    store = stub_vector_store
+    prop = _prop("a", "A", "f1")
+    store.rebuild([prop, _prop("b", "B", "f2")])
+    assert [result["_id"] for result in _search_own_text(store, prop)] == ["a"]
+    version = store.index_version
+
+    assert store.remove_by_file_id("f1") == 1
+    assert store.index_version > version
+    assert len(store.result_cache) == 0
+    assert all(result["_id"] != "a" for result in _search_own_text(store, prop))
@@ -0,0 +1,33 @@
+from conftest import wait_for_jobs
+
+
+def test_reupload_of_identical_rows_is_not_reembedded(ingestion_pipeline, listing_csv, stub_vector_store):
+    projects = ["A", "B", "C", "D", "E"]
+    ingestion_pipeline.submit(listing_csv("first.csv", projects), "csv", "job1", "first.csv")
+    wait_for_jobs(ingestion_pipeline, 1)
+    status = ingestion_pipeline.status("job1")
+    assert status["status"] == "completed"
+    assert (status["chunks"], status["rows_inserted"]) == (3, 5)
+    encoded = len(stub_vector_store.encoder.encoded)
+    assert encoded == 5
+
+    ingestion_pipeline.submit(listing_csv("again.csv", projects), "csv", "job2", "again.csv")
+    wait_for_jobs(ingestion_pipeline, 2)
+    status = ingestion_pipeline.status("job2")
+    assert (status["rows_inserted"], status["rows_unchanged"]) == (0, 5)
+    assert len(stub_vector_store.encoder.encoded) == encoded
+    assert len(stub_vector_store) == 5
+    # ประกาศเดิมถูกย้ายไปอยู่กับไฟล์ใหม่ทั้งใน MongoDB และใน index
+    assert {prop["file_id"] for prop in stub_vector_store.property_data} == {"job2"}
+
+
+def test_unchanged_rows_missing_from_the_index_are_embedded(ingestion_pipeline, listing_csv, stub_vector_store):
+    ingestion_pipeline.submit(listing_csv("first.csv", ["A", "B"]), "csv", "job1", "first.csv")
+    wait_for_jobs(ingestion_pipeline, 1)
+    # เช่น embed ของ job ก่อนล้มเหลวหลังบันทึกลง MongoDB แล้ว
+    stub_vector_store.remove_by_ids([stub_vector_store.property_data[0]["_id"]])
+
+    ingestion_pipeline.submit(listing_csv("again.csv", ["A", "B"]), "csv", "job2", "again.csv")
+    wait_for_jobs(ingestion_pipeline, 2)
+    assert len(stub_vector_store) == 2
+    assert len(stub_vector_store.encoder.encoded) == 3
@@ -0,0 +1,48 @@
+import time
+from conftest import wait_for_jobs
+
+
+def test_resume_skips_committed_chunks(ingestion_pipeline, listing_csv, mongomock_manager, stub_vector_store):
+    path = listing_csv("upload.csv", ["A", "B", "C", "D", "E"])
+    # job ของ worker ที่ล่มไปหลัง commit chunk แรก (heartbeat เก่ากว่า lease)
+    mongomock_manager.save_ingestion_job({
+        "job_id": "job1", "filename": "upload.csv", "path": path, "file_ext": "csv", "replace_file_id": None,
+        "status": "running", "owner": "other-host:1:dead", "chunks": 1, "rows_processed": 2, "rows_inserted": 2,
+        "heartbeat_at": 0, "created_at": 0, "started_at": 0
+    })
+
+    assert ingestion_pipeline.resume_pending() == 1
+    wait_for_jobs(ingestion_pipeline, 1)
+
+    status = ingestion_pipeline.status("job1")
+    assert status["status"] == "completed"
+    assert (status["chunks"], status["rows_processed"], status["rows_inserted"], status["resumed"]) == (3, 5, 5, 1)
+    # chunk แรกถูกข้าม: ไม่ถูกอ่านซ้ำ จึงไม่มีใน MongoDB ของ test นี้
+    assert sorted(doc["โครงการ"] for doc in mongomock_manager.properties.find()) == ["C", "D", "E"]
+    assert sorted(prop["โครงการ"] for prop in stub_vector_store.property_data) == ["C", "D", "E"]
+    assert mongomock_manager.get_ingestion_job("job1")["owner"] == ingestion_pipeline.owner
+
+
+def test_live_jobs_are_not_resumed(ingestion_pipeline, mongomock_manager):
+    mongomock_manager.save_ingestion_job({
+        "job_id": "job1", "filename": "upload.csv", "path": "/nonexistent.csv", "file_ext": "csv",
+        "status": "running", "owner": "other-host:1:alive", "chunks": 0, "heartbeat_at": time.time()
+    })
+    assert ingestion_pipeline.resume_pending() == 0
+
+
+def test_finished_jobs_are_pruned(ingestion_pipeline, listing_csv):
+    ingestion_pipeline.max_finished_jobs = 1
+    for index in range(3):
+        ingestion_pipeline.submit(listing_csv(f"upload{index}.csv", [f"P{index}"]), "csv", f"job{index}", "upload.csv")
+        wait_for_jobs(ingestion_pipeline, index + 1)
+    assert list(ingestion_pipeline.jobs) == ["job2"]
+    # job ที่ถูกล้างจากหน่วยความจำยังอ่านสถานะจาก MongoDB ได้
+    assert ingestion_pipeline.status("job0")["status"] == "completed"
+
+    ingestion_pipeline.finished_job_ttl = 0.01
+    time.sleep(0.02)
+    # การรับ job ใหม่จะล้าง job ที่เสร็จนานเกิน finished_job_ttl
+    ingestion_pipeline.submit(listing_csv("upload3.csv", ["P3"]), "csv", "job3", "upload.csv")
+    assert "job2" not in ingestion_pipeline.jobs
+    wait_for_jobs(ingestion_pipeline, 4)
@@ -0,0 +1,29 @@
+import pytest
+
+
+@pytest.fixture
+def manager(mongomock_manager):
+    return mongomock_manager
+
+
+def test_ensure_indexes_marks_ready(manager):
+    created = manager.ensure_indexes()
+    assert "email_unique" in created["users"]
+    assert "chat_room_id_unique" in created["chat_rooms"]
+    assert manager._indexes_ready
+
+
+def test_duplicate_emails_fail_instead_of_a_plain_index(manager):
+    manager.ensure_indexes()
+    manager.db["users"].drop_index("email_unique")
+    manager.db["users"].insert_many([{"id": "a", "email": "x@example.com"}, {"id": "b", "email": "x@example.com"}])
+
+    with pytest.raises(RuntimeError, match="users.email_unique"):
+        manager.ensure_indexes()
+    assert not manager._indexes_ready
+    assert "email" not in manager.db["users"].index_information()
+
+    manager.db["users"].delete_one({"id": "b"})
+    manager.ensure_indexes()
+    assert manager._indexes_ready
+    assert manager.db["users"].index_information()["email_unique"]["unique"]
@@ -0,0 +1,17 @@
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from config import CONSULTATION_STYLES
+from language_models import PROMPT_PREFIXES, LanguageModelManager
+
+PROPERTIES = [{"ประเภท": "คอนโด", "โครงการ": "A", "ราคา": 1000000, "สถานีรถไฟฟ้า": "BTS บางนา"}]
+
+
+@pytest.mark.parametrize("style", sorted(CONSULTATION_STYLES))
+@pytest.mark.parametrize("properties", [PROPERTIES, []], ids=["matches", "no_matches"])
+def test_prompt_starts_with_a_cached_prefix(style, properties):
+    # สร้าง manager ได้โดยไม่โหลดโมเดล
+    prompt = LanguageModelManager()._build_prompt("หาคอนโดใกล้รถไฟฟ้า", properties, style)
+    assert any(prompt.startswith(prefix) for prefix in PROMPT_PREFIXES)
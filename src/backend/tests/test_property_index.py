@@ -0,0 +1,46 @@
+import asyncio
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("pymongo")
+pytest.importorskip("pandas")
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import main
+import vector_store
+
+
+class _NoReads:
+    """
+    Collection stand-in that fails the test on any access
+    """
+    def __getattr__(self, name):
+        raise AssertionError(f"vector_search read MongoDB ({name})")
+
+
+def _fail(*args, **kwargs):
+    raise AssertionError("vector_search built a new VectorStore")
+
+
+def test_vector_search_reuses_shared_property_index(monkeypatch):
+    calls = []
+
+    async def search_async(query, top_k=3):
+        calls.append((query, top_k))
+        return [{"_id": "p1", "ประเภท": "คอนโด"}]
+
+    index = main.property_index
+    monkeypatch.setattr(index, "search_async", search_async)
+    monkeypatch.setattr(main, "VectorStore", _fail)
+    monkeypatch.setattr(vector_store.VectorStore, "__init__", _fail)
+    monkeypatch.setattr(main.mongodb_manager, "properties", _NoReads())
+    monkeypatch.setattr(main.mongodb_manager, "get_properties", _fail)
+
+    # vector_search กลืน exception แล้วคืน [] จึงตรวจผลลัพธ์ด้วย
+    first = asyncio.run(main.vector_search("คอนโดบางนา", top_k=2))
+    second = asyncio.run(main.vector_search("บ้านเดี่ยว"))
+
+    assert first == second == [{"_id": "p1", "ประเภท": "คอนโด"}]
+    assert calls == [("คอนโดบางนา", 2), ("บ้านเดี่ยว", 3)]
+    assert main.property_index is index
@@ -0,0 +1,29 @@
+import pytest
+
+pymongo = pytest.importorskip("pymongo")
+pytest.importorskip("pandas")
+
+from config import MONGODB_URL
+from mongodb_manager import MongoDBManager
+
+
+@pytest.fixture(scope="module")
+def manager():
+    probe = pymongo.MongoClient(MONGODB_URL, serverSelectionTimeoutMS=1000)
+    try:
+        probe.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip(f"no mongod reachable at {MONGODB_URL}")
+    finally:
+        probe.close()
+    manager = MongoDBManager()
+    yield manager
+    manager.close()
+
+
+def test_query_shapes_use_an_index(manager):
+    manager.ensure_indexes()
+    results = manager.verify_query_plans()
+    assert results
+    scans = [(result["collection"], result["query"]) for result in results if result["collscan"]]
+    assert not scans, f"query shapes using COLLSCAN: {scans}"
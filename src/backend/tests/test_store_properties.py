@@ -0,0 +1,45 @@
+def _row(project, price, layout="1 ห้องนอน"):
+    return {"ประเภท": "คอนโด", "โครงการ": project, "ราคา": price, "รูปแบบ": layout, "ตำแหน่ง": "บางนา"}
+
+
+def _counts(summary):
+    return {key: summary[key] for key in ("inserted", "updated", "unchanged", "duplicates", "failed")}
+
+
+def test_store_properties_counts(mongomock_manager):
+    manager = mongomock_manager
+    rows = [_row("A", "1,000,000"), _row("B", 2000000), _row("A", 1000000)]
+
+    # ราคา "1,000,000" กับ 1000000 เป็นประกาศเดียวกัน: เก็บรายการสุดท้าย
+    first = manager.store_properties(rows, "f1")
+    assert _counts(first) == {"inserted": 2, "updated": 0, "unchanged": 0, "duplicates": 1, "failed": 0}
+    assert len(first["changed"]) == 2
+    assert manager.properties.count_documents({}) == 2
+
+    # อัพโหลดซ้ำโดยแก้รูปแบบของ B: A ไม่เปลี่ยน (แค่ย้าย file_id), B ถูก update
+    # (batch_size=1: mongomock รายงาน index ของ upsert ผิดเมื่อ bulk_write มีหลาย operation)
+    second = manager.store_properties([_row("A", 1000000), _row("B", 2000000, "2 ห้องนอน"), _row("C", 3000000)], "f2",
+                                      batch_size=1)
+    assert _counts(second) == {"inserted": 1, "updated": 1, "unchanged": 1, "duplicates": 0, "failed": 0}
+    assert sorted(doc["โครงการ"] for doc in second["changed"]) == ["B", "C"]
+    assert [doc["โครงการ"] for doc in second["kept"]] == ["A"]
+    assert second["retagged"] == [second["kept"][0]["_id"]]
+    assert manager.properties.count_documents({}) == 3
+    assert manager.properties.count_documents({"file_id": "f2"}) == 3
+
+
+def test_identical_reupload_needs_no_embedding(mongomock_manager):
+    manager = mongomock_manager
+    rows = [_row("A", 1000000), _row("B", 2000000)]
+    manager.store_properties(rows, "f1")
+
+    again = manager.store_properties(rows, "f1")
+    assert _counts(again) == {"inserted": 0, "updated": 0, "unchanged": 2, "duplicates": 0, "failed": 0}
+    assert again["changed"] == []
+    assert again["retagged"] == []
+
+
+def test_store_properties_leaves_caller_rows_untouched(mongomock_manager):
+    rows = [_row("A", 1000000)]
+    mongomock_manager.store_properties(rows, "f1")
+    assert rows == [_row("A", 1000000)]
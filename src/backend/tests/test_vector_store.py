@@ -0,0 +1,49 @@
+import numpy as np
+from vector_store import VectorStore, _CategoryColumn
+
+
+def test_category_column_encodes_missing_as_zero():
+    column = _CategoryColumn("ประเภท")
+    codes = column.encode([{"ประเภท": "คอนโด"}, {}, {"ประเภท": "บ้าน"}, {"ประเภท": "คอนโด"}])
+    assert codes.tolist() == [1, 0, 2, 1]
+    assert column.values == ["คอนโด", "บ้าน"]
+
+
+def test_category_column_boosts_exact_and_query():
+    column = _CategoryColumn("ประเภท")
+    column.encode([{"ประเภท": "คอนโด"}, {"ประเภท": "บ้าน"}, {"ประเภท": "ร้านค้า"}])
+    boosts = column.boosts("คอนโด", 2.5, "หาบ้านหรือคอนโด", 1.5)
+    # code 0 (ไม่มีฟิลด์) ไม่ได้ boost, exact ชนะ query
+    assert boosts.tolist() == [1.0, 2.5, 1.5, 1.0]
+
+
+def test_category_column_boosts_contains():
+    column = _CategoryColumn("ตำแหน่ง")
+    column.encode([{"ตำแหน่ง": "บางนา กรุงเทพ"}, {"ตำแหน่ง": "สุขุมวิท"}])
+    boosts = column.boosts("บางนา", 2.0, "แถวสุขุมวิท", 2.3, contains=True)
+    assert boosts.tolist() == [1.0, 2.0, np.float32(2.3)]
+
+
+def test_category_column_boosts_empty():
+    assert _CategoryColumn("ประเภท").boosts("คอนโด", 2.5, "คอนโด", 1.5).tolist() == [1.0]
+
+
+def test_top_k_orders_by_score_then_row():
+    scores = np.array([0.5, 0.9, 0.5, 0.7, 0.5, 0.9], dtype=np.float32)
+    assert VectorStore._top_k(scores, 3).tolist() == [1, 5, 3]
+    # อันดับที่ k เสมอกันหลายแถว: เลือกแถวที่มาก่อนเหมือน stable sort
+    assert VectorStore._top_k(scores, 4).tolist() == [1, 5, 3, 0]
+    assert VectorStore._top_k(scores, 5).tolist() == [1, 5, 3, 0, 2]
+
+
+def test_top_k_matches_stable_sort():
+    rng = np.random.default_rng(0)
+    scores = rng.integers(0, 5, size=200).astype(np.float32)
+    expected = np.argsort(-scores, kind="stable")
+    for k in (1, 7, 50, 200, 500):
+        assert VectorStore._top_k(scores, k).tolist() == expected[:k].tolist()
+
+
+def test_top_k_empty():
+    assert VectorStore._top_k(np.zeros(0, dtype=np.float32), 5).tolist() == []
+    assert VectorStore._top_k(np.ones(3, dtype=np.float32), 0).tolist() == []
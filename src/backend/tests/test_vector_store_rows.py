@@ -0,0 +1,38 @@
+import numpy as np
+
+
+def _prop(property_id, location="บางนา", file_id="f1"):
+    return {"_id": property_id, "ประเภท": "คอนโด", "ตำแหน่ง": location, "file_id": file_id}
+
+
+def test_upsert_replaces_rows_in_place(stub_vector_store):
+    store = stub_vector_store
+    store.upsert_properties([_prop("a"), _prop("b"), _prop("c")])
+    matrix = store.matrix
+
+    store.upsert_properties([_prop("b", location="สุขุมวิท"), _prop("d"), _prop("d", location="ลาดพร้าว")])
+
+    assert [prop["_id"] for prop in store.property_data] == ["a", "b", "c", "d"]
+    assert store.property_data[1]["ตำแหน่ง"] == "สุขุมวิท"
+    assert store.property_data[3]["ตำแหน่ง"] == "ลาดพร้าว"
+    assert len(store.matrix) == 4
+    assert np.array_equal(store.matrix[[0, 2]], matrix[[0, 2]])
+    assert not np.array_equal(store.matrix[1], matrix[1])
+    # snapshot เดิมไม่ถูกแก้
+    assert matrix.shape == (3, store.dimension)
+
+
+def test_id_lookups_follow_inserts_and_removals(stub_vector_store):
+    store = stub_vector_store
+    store.rebuild([_prop("a"), _prop("b", file_id="f2"), _prop("c")])
+    assert store.contains("b")
+    assert store.missing_ids(["a", "x", "c", "y"]) == {"x", "y"}
+
+    assert store.remove_by_file_id("f2") == 1
+    assert not store.contains("b")
+    assert store.set_file_id(["c", "b"], "f3") == 1
+    assert store.property_data[1] == _prop("c", file_id="f3")
+
+    store.upsert_properties([_prop("c", location="สุขุมวิท")])
+    assert len(store) == 2
+    assert store.missing_ids(["a", "c"]) == set()
@@ -1,43 +1,486 @@
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Iterable, Set, Tuple, NamedTuple
 import numpy as np
 import json
 import os
-from sentence_transformers import SentenceTransformer
-from config import MODEL_CONFIG, VECTOR_SIMILARITY_THRESHOLD, MAX_RESULTS
+import threading
+from config import (
+    MODEL_CONFIG, VECTOR_SIMILARITY_THRESHOLD, MAX_RESULTS, VECTOR_INDEX_CONFIG,
+    EMBEDDING_CACHE_ENABLED, EMBEDDING_CACHE_DIR, QUERY_CACHE_CONFIG, EMBEDDING_BATCH_CONFIG,
+    EMBEDDING_ENCODER_CONFIG
+)
+from ann_index import IVFIndex, build_inverted_lists, gather_candidates
+from embedding_cache import EmbeddingCache
+from query_cache import LRUCache
+from embedding_service import EmbeddingBatcher
+from embedding_encoders import create_encoder, check_parity, load_parity_texts, SentenceTransformerEncoder
 
 logger = logging.getLogger(__name__)
 
+class _CategoryColumn:
+    def __init__(self, field: str):
+        """
+        Dictionary-encoded property field used for vectorized boosts
+
+        Code 0 means the field is missing on the property; other codes index
+        into `values` (offset by one). Values are only ever appended, so codes
+        held by an older index snapshot stay valid.
+        """
+        self.field = field
+        self.values: List[str] = []
+        self._codes: Dict[str, int] = {}
+        self._values_array = np.array([], dtype=str)
+
+    def encode(self, properties: List[Dict[str, Any]]) -> np.ndarray:
+        codes = np.zeros(len(properties), dtype=np.int32)
+        for i, prop in enumerate(properties):
+            if self.field not in prop:
+                continue
+            value = str(prop[self.field])
+            code = self._codes.get(value)
+            if code is None:
+                self.values.append(value)
+                code = len(self.values)
+                self._codes[value] = code
+            codes[i] = code
+        if len(self._values_array) != len(self.values):
+            self._values_array = np.array(self.values, dtype=str)
+        return codes
+
+    def boosts(self,
+               exact: str,
+               exact_boost: float,
+               query: str,
+               query_boost: float,
+               contains: bool = False) -> np.ndarray:
+        """
+        Per-code multiplier: exact_boost when the value matches `exact`
+        (equality, or substring when contains=True), otherwise query_boost
+        when the value appears in the query text
+        """
+        values = self._values_array
+        out = np.ones(len(values) + 1, dtype=np.float32)
+        if not len(values):
+            return out
+        in_query = np.char.find(query, values) >= 0
+        out[1:][in_query] = query_boost
+        if exact:
+            if contains:
+                matched = np.char.find(values, exact) >= 0
+            else:
+                matched = values == exact
+            out[1:][matched] = exact_boost
+        return out
+
+
+class _Snapshot(NamedTuple):
+    property_data: List[Dict[str, Any]]
+    matrix: np.ndarray
+    type_codes: np.ndarray
+    location_codes: np.ndarray
+    type_column: _CategoryColumn
+    location_column: _CategoryColumn
+    ann: Optional[IVFIndex]
+    ann_lists: Optional[Tuple[np.ndarray, np.ndarray]]
+    version: int
+
+
 class VectorStore:
-    def __init__(self, embedding_model_name: str = None):
+    def __init__(self, embedding_model_name: str = None, encoder_backend: str = None, lazy: bool = False):
         """
         Initialize vector store for property data using Sentence Transformers
+
+        `encoder_backend` picks the embedding encoder ("torch", "onnx" or
+        "onnx-int8"; default from config). ONNX backends are only used after
+        passing a parity check against the SentenceTransformer reference.
+        With lazy=True the encoder is loaded by load_encoder() or on first
+        use instead of in the constructor.
         """
         self.embedding_model_name = embedding_model_name or MODEL_CONFIG['embedding_model']
-        self.model = SentenceTransformer(self.embedding_model_name)
-        self.vectors = []
+        self.encoder_backend = encoder_backend or EMBEDDING_ENCODER_CONFIG['backend']
+        self.encoder = None
+        # สถานะ encoder: not_loaded -> loading -> ready (หรือ failed)
+        self.encoder_status = "not_loaded"
+        self.encoder_error: Optional[str] = None
+        self._encoder_lock = threading.Lock()
+        self.dimension = 0
+        # cache embedding ของ property บน disk เพื่อไม่ต้อง encode ข้อความเดิมซ้ำหลัง restart/อัพโหลดซ้ำ
+        self.embedding_cache = None
+        # เวกเตอร์ทั้งหมดเก็บเป็น matrix float32 ที่ normalize แล้ว (1 แถวต่อ 1 property)
+        self.matrix = np.zeros((0, self.dimension), dtype=np.float32)
         self.property_data = []
-        logger.info(f"Initialized VectorStore with model: {self.embedding_model_name}")
+        # _id -> แถวใน property_data/matrix (ถ้า _id ซ้ำ ชี้ไปแถวล่าสุด)
+        self._rows_by_id: Dict[str, int] = {}
+        # คอลัมน์ประเภท/ตำแหน่งแบบ categorical สำหรับคำนวณ boost แบบ vectorized
+        self._type_column = _CategoryColumn('ประเภท')
+        self._location_column = _CategoryColumn('ตำแหน่ง')
+        self._type_codes = np.zeros(0, dtype=np.int32)
+        self._location_codes = np.zeros(0, dtype=np.int32)
+        # ANN (IVF) index: cluster ของแต่ละแถว และ inverted lists สำหรับดึง candidate
+        self.index_config = dict(VECTOR_INDEX_CONFIG)
+        self._ann: Optional[IVFIndex] = None
+        self._ann_trained_size = 0
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._ann_lists: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        # จำนวนคำค้นหาที่ใช้ ANN, ที่ต้องขยาย nprobe และที่ต้องสแกนทุกแถว
+        self._ann_stats = {"ann_queries": 0, "widened_queries": 0, "exact_fallbacks": 0}
+        self._ann_stats_lock = threading.Lock()
+        # cache ของคำค้นหาที่ถูกถามซ้ำบ่อย: embedding และผลลัพธ์ (ผลลัพธ์ผูกกับ index_version)
+        self.index_version = 0
+        self.query_embedding_cache = LRUCache(QUERY_CACHE_CONFIG['embedding_maxsize'], QUERY_CACHE_CONFIG['embedding_ttl'])
+        self.result_cache = LRUCache(QUERY_CACHE_CONFIG['result_maxsize'], QUERY_CACHE_CONFIG['result_ttl'])
+        # รวมการ encode คำค้นหาจากหลาย request ที่เข้ามาพร้อมกันเป็น batch เดียว
+        self.embedding_batcher = EmbeddingBatcher(
+            self._encode,
+            max_batch_size=EMBEDDING_BATCH_CONFIG['max_batch_size'],
+            max_wait_ms=EMBEDDING_BATCH_CONFIG['max_wait_ms']
+        )
+        # ป้องกันการอ่าน/เขียน index พร้อมกันเมื่อใช้ instance เดียวร่วมกันทั้ง process
+        self._lock = threading.RLock()
+        if not lazy:
+            self.load_encoder()
+
+    def load_encoder(self) -> None:
+        """
+        Load the embedding encoder and its on-disk cache (no-op once loaded)
+        """
+        if self.encoder is not None:
+            return
+        with self._encoder_lock:
+            if self.encoder is not None:
+                return
+            self.encoder_status = "loading"
+            try:
+                encoder = create_encoder(
+                    self.embedding_model_name,
+                    backend=self.encoder_backend,
+                    export_dir=EMBEDDING_ENCODER_CONFIG['export_dir'],
+                    parity_texts=load_parity_texts(EMBEDDING_ENCODER_CONFIG['parity_texts_file']),
+                    tolerance=EMBEDDING_ENCODER_CONFIG['parity_tolerance']
+                )
+                if EMBEDDING_CACHE_ENABLED:
+                    self.embedding_cache = EmbeddingCache(EMBEDDING_CACHE_DIR, encoder.cache_name, encoder.dimension)
+                with self._lock:
+                    self.dimension = encoder.dimension
+                    if not len(self.property_data):
+                        self.matrix = np.zeros((0, self.dimension), dtype=np.float32)
+                self.encoder_backend = encoder.backend
+                self.encoder = encoder
+                self.encoder_status = "ready"
+                self.encoder_error = None
+                logger.info(f"Initialized VectorStore with model: {self.embedding_model_name} ({encoder.backend})")
+            except Exception as e:
+                self.encoder_status = "failed"
+                self.encoder_error = str(e)
+                logger.error(f"Error loading embedding encoder: {str(e)}")
+                raise
         
     def add_properties(self, properties: List[Dict[str, Any]]) -> None:
         """
         Add properties to the vector store
         """
+        self._insert(properties, replace_existing=False)
+
+    def upsert_properties(self, properties: List[Dict[str, Any]]) -> None:
+        """
+        Add properties, replacing any indexed entries that share the same `_id`
+        """
+        self._insert(properties, replace_existing=True)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed texts into a contiguous, L2-normalized float32 matrix
+        """
+        self.load_encoder()
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return self._normalize(self.encoder.encode(texts))
+
+    def _encode_properties(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed property texts, reusing vectors from the on-disk cache when possible
+        """
+        self.load_encoder()
+        if self.embedding_cache is None or not texts:
+            return self._encode(texts)
+
+        embeddings, missing = self.embedding_cache.get_many(texts)
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            encoded = self.encoder.encode(missing_texts)
+            embeddings[missing] = encoded
+            self.embedding_cache.put_many(missing_texts, encoded)
+            logger.info(f"Encoded {len(missing)} of {len(texts)} property texts (rest from cache)")
+        return self._normalize(embeddings)
+
+    @staticmethod
+    def _normalize(embeddings: np.ndarray) -> np.ndarray:
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return embeddings / norms
+
+    def _insert(self, properties: List[Dict[str, Any]], replace_existing: bool) -> None:
         try:
-            # Store the property data
-            self.property_data.extend(properties)
-            
+            if not properties:
+                return
+            if replace_existing:
+                # _id ซ้ำกันใน batch เดียวกัน ใช้รายการสุดท้าย
+                last = {str(prop["_id"]): i for i, prop in enumerate(properties) if "_id" in prop}
+                properties = [prop for i, prop in enumerate(properties) if "_id" not in prop or last[str(prop["_id"])] == i]
+
             # Create text representations for embedding
             texts = [self._get_property_text(prop) for prop in properties]
             
             # Generate real embeddings using Sentence Transformers
-            embeddings = self.model.encode(texts, convert_to_numpy=True)
-            self.vectors.extend(embeddings)
+            embeddings = self._encode_properties(texts)
+
+            # Store the property data together with its vectors
+            # (สร้าง array ใหม่แทนการแก้ไขของเดิม เพื่อให้ snapshot ที่กำลังค้นหาอยู่ไม่เปลี่ยน)
+            with self._lock:
+                replaced_rows, replacing, appended = [], [], []
+                for i, prop in enumerate(properties):
+                    row = self._rows_by_id.get(str(prop["_id"])) if replace_existing and "_id" in prop else None
+                    if row is None:
+                        appended.append(i)
+                    else:
+                        replaced_rows.append(row)
+                        replacing.append(i)
+
+                property_data = list(self.property_data)
+                matrix, type_codes, location_codes = self.matrix, self._type_codes, self._location_codes
+                assignments = self._assignments
+                if replacing:
+                    # ประกาศที่มี _id อยู่แล้วเขียนทับแถวเดิม แถวอื่นไม่ต้องเลื่อน (_rows_by_id ยังใช้ได้)
+                    replaced = [properties[i] for i in replacing]
+                    for row, prop in zip(replaced_rows, replaced):
+                        property_data[row] = prop
+                    matrix = matrix.copy()
+                    matrix[replaced_rows] = embeddings[replacing]
+                    type_codes = type_codes.copy()
+                    type_codes[replaced_rows] = self._type_column.encode(replaced)
+                    location_codes = location_codes.copy()
+                    location_codes[replaced_rows] = self._location_column.encode(replaced)
+                    if self._ann is not None:
+                        assignments = assignments.copy()
+                        assignments[replaced_rows] = self._ann.assign(embeddings[replacing])
+
+                added = [properties[i] for i in appended]
+                self._rows_by_id.update(self._row_ids(added, start=len(property_data)))
+                self.property_data = property_data + added
+                self.matrix = np.concatenate([matrix, embeddings[appended]])
+                self._type_codes = np.concatenate([type_codes, self._type_column.encode(added)])
+                self._location_codes = np.concatenate([location_codes, self._location_column.encode(added)])
+                if self._ann is not None:
+                    self._assignments = np.concatenate([assignments, self._ann.assign(embeddings[appended])])
+                    self._ann_lists = build_inverted_lists(self._assignments, self._ann.nlist)
+                self._bump_version_locked()
                 
             logger.info(f"Added {len(properties)} properties to vector store")
+            self._maybe_train_ann()
         except Exception as e:
             logger.error(f"Error adding properties to vector store: {str(e)}")
             raise
+
+    @staticmethod
+    def _row_ids(properties: List[Dict[str, Any]], start: int = 0) -> Dict[str, int]:
+        return {str(prop["_id"]): start + i for i, prop in enumerate(properties) if "_id" in prop}
+
+    def rebuild(self, properties: List[Dict[str, Any]]) -> None:
+        """
+        Replace the whole index with the given properties
+
+        Embeddings are computed before the swap, so concurrent searches keep
+        using the previous index until the new one is ready.
+        """
+        try:
+            texts = [self._get_property_text(prop) for prop in properties]
+            embeddings = self._encode_properties(texts)
+            type_column = _CategoryColumn('ประเภท')
+            location_column = _CategoryColumn('ตำแหน่ง')
+            type_codes = type_column.encode(properties)
+            location_codes = location_column.encode(properties)
+            rows_by_id = self._row_ids(properties)
+
+            with self._lock:
+                self.property_data = list(properties)
+                self._rows_by_id = rows_by_id
+                self.matrix = embeddings
+                self._type_column = type_column
+                self._location_column = location_column
+                self._type_codes = type_codes
+                self._location_codes = location_codes
+                self._ann = None
+                self._ann_trained_size = 0
+                self._assignments = np.zeros(0, dtype=np.int32)
+                self._ann_lists = None
+                self._bump_version_locked()
+
+            logger.info(f"Rebuilt vector store with {len(properties)} properties")
+            self._maybe_train_ann()
+        except Exception as e:
+            logger.error(f"Error rebuilding vector store: {str(e)}")
+            raise
+
+    def remove_by_ids(self, ids: Iterable[str]) -> int:
+        """
+        Remove properties whose `_id` is in ids, without re-embedding the rest
+        """
+        id_set = {str(i) for i in ids}
+        return self._remove_where(lambda prop: str(prop.get("_id")) in id_set)
+
+    def remove_by_file_id(self, file_id: str) -> int:
+        """
+        Remove every property that was stored from the given upload batch
+        """
+        return self._remove_where(lambda prop: prop.get("file_id") == file_id)
+
+    def set_file_id(self, ids: Iterable[str], file_id: str) -> int:
+        """
+        Move indexed properties to another upload batch without re-embedding them
+        """
+        moved = 0
+        with self._lock:
+            for property_id in {str(i) for i in ids}:
+                row = self._rows_by_id.get(property_id)
+                if row is not None:
+                    self.property_data[row]["file_id"] = file_id
+                    moved += 1
+            if moved:
+                # ผลการค้นหาใน cache ยังมี file_id เดิมอยู่
+                self._bump_version_locked()
+        return moved
+
+    def contains(self, property_id: str) -> bool:
+        """
+        Check whether a property `_id` is already indexed
+        """
+        with self._lock:
+            return str(property_id) in self._rows_by_id
+
+    def missing_ids(self, property_ids: Iterable[str]) -> Set[str]:
+        """
+        The given property `_id`s that are not indexed
+        """
+        wanted = {str(i) for i in property_ids}
+        with self._lock:
+            return {property_id for property_id in wanted if property_id not in self._rows_by_id}
+
+    def _remove_where(self, predicate: Callable[[Dict[str, Any]], bool]) -> int:
+        try:
+            with self._lock:
+                removed = self._remove_where_locked(predicate)
+
+            if removed:
+                logger.info(f"Removed {removed} properties from vector store")
+            return removed
+        except Exception as e:
+            logger.error(f"Error removing properties from vector store: {str(e)}")
+            raise
+
+    def _remove_where_locked(self, predicate: Callable[[Dict[str, Any]], bool]) -> int:
+        keep = np.fromiter((not predicate(prop) for prop in self.property_data), dtype=bool, count=len(self.property_data))
+        removed = int(len(keep) - keep.sum())
+        if removed:
+            self.property_data = [prop for prop, kept in zip(self.property_data, keep) if kept]
+            self._rows_by_id = self._row_ids(self.property_data)
+            self.matrix = np.ascontiguousarray(self.matrix[keep])
+            self._type_codes = self._type_codes[keep]
+            self._location_codes = self._location_codes[keep]
+            if self._ann is not None:
+                self._assignments = self._assignments[keep]
+                self._ann_lists = build_inverted_lists(self._assignments, self._ann.nlist)
+            self._bump_version_locked()
+        return removed
+
+    def _bump_version_locked(self) -> None:
+        """
+        Mark the index as changed; cached search results are no longer valid
+        """
+        self.index_version += 1
+        self.result_cache.clear()
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """
+        Hit/miss counters of the query caches, for sizing them
+        """
+        stats = {
+            "index_version": self.index_version,
+            "query_embedding": self.query_embedding_cache.stats(),
+            "search_result": self.result_cache.stats(),
+            "query_batching": self.embedding_batcher.stats(),
+            "ann": self.ann_stats()
+        }
+        if self.embedding_cache is not None:
+            stats["property_embedding"] = {
+                "size": len(self.embedding_cache),
+                "hits": self.embedding_cache.hits,
+                "misses": self.embedding_cache.misses
+            }
+        return stats
+
+    def ann_stats(self) -> Dict[str, Any]:
+        """
+        How often ANN searches had to widen nprobe, or fell back to scanning every row
+        """
+        with self._ann_stats_lock:
+            stats = dict(self._ann_stats)
+        searches = stats["ann_queries"] + stats["exact_fallbacks"]
+        stats["fallback_rate"] = stats["exact_fallbacks"] / searches if searches else 0.0
+        stats["widen_rate"] = stats["widened_queries"] / stats["ann_queries"] if stats["ann_queries"] else 0.0
+        return stats
+
+    def _count(self, key: str) -> None:
+        with self._ann_stats_lock:
+            self._ann_stats[key] += 1
+
+    def _ann_enabled(self) -> bool:
+        return self.index_config.get('backend') == 'ivf'
+
+    def _maybe_train_ann(self) -> None:
+        """
+        Train (or retrain) the IVF index once the catalog is large enough
+
+        Training runs outside the lock on a snapshot of the matrix; rows are
+        then assigned to clusters under the lock so concurrent inserts are
+        not lost.
+        """
+        if not self._ann_enabled():
+            return
+        config = self.index_config
+        with self._lock:
+            matrix = self.matrix
+            trained_size = self._ann_trained_size
+        size = len(matrix)
+        if size < config['min_train_size']:
+            return
+        if trained_size and size < trained_size * config['retrain_growth']:
+            return
+
+        try:
+            ann = IVFIndex.train(
+                matrix,
+                nlist=config['nlist'],
+                iterations=config['train_iterations'],
+                sample_size=config['train_sample_size']
+            )
+            with self._lock:
+                self._ann = ann
+                self._ann_trained_size = len(self.matrix)
+                self._assignments = ann.assign(self.matrix)
+                self._ann_lists = build_inverted_lists(self._assignments, ann.nlist)
+                self._bump_version_locked()
+        except Exception as e:
+            logger.error(f"Error training ANN index, falling back to exact search: {str(e)}")
+
+    def _snapshot(self) -> _Snapshot:
+        with self._lock:
+            return _Snapshot(self.property_data, self.matrix, self._type_codes, self._location_codes,
+                             self._type_column, self._location_column, self._ann, self._ann_lists,
+                             self.index_version)
+
+    def __len__(self) -> int:
+        return len(self.property_data)
             
     def _get_property_text(self, prop: Dict[str, Any]) -> str:
         """
@@ -125,58 +568,229 @@ class VectorStore:
                     
         return ""
 
+    def _score(self,
+               query: str,
+               query_embedding: np.ndarray,
+               snapshot: _Snapshot,
+               rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Cosine similarity multiplied by the ประเภท and ตำแหน่ง boosts
+
+        Scores every row of the snapshot, or only `rows` when given.
+        """
+        # แยกตำแหน่งและประเภทจากประโยคค้นหา
+        target_location = self._extract_location(query)
+        target_property_type = self._extract_property_type(query)
+
+        matrix = snapshot.matrix
+        type_codes = snapshot.type_codes
+        location_codes = snapshot.location_codes
+        if rows is not None:
+            matrix = matrix[rows]
+            type_codes = type_codes[rows]
+            location_codes = location_codes[rows]
+
+        # Cosine similarity: matrix ถูก normalize ไว้แล้ว จึงเหลือแค่ matrix-vector product เดียว
+        scores = matrix @ query_embedding
+
+        # เพิ่มคะแนนให้กับประเภทที่ตรงกัน (x2.5) หรือประเภทที่อยู่ในคำค้นหา (x1.5)
+        type_boosts = snapshot.type_column.boosts(target_property_type, 2.5, query, 1.5)
+        # เพิ่มคะแนนให้กับตำแหน่งที่ตรงกัน (x2.0) หรือตำแหน่งที่อยู่ในคำค้นหา (x2.3)
+        location_boosts = snapshot.location_column.boosts(target_location, 2.0, query, 2.3, contains=True)
+
+        scores *= type_boosts[type_codes]
+        scores *= location_boosts[location_codes]
+        return scores
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, top_k: int) -> np.ndarray:
+        """
+        Indices of the top_k scores in descending order (ties keep insertion order)
+        """
+        k = min(top_k, len(scores))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        if k < len(scores):
+            kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+            # เก็บทุกแถวที่คะแนนเท่ากับอันดับที่ k เพื่อให้ผลเหมือนการ sort แบบ stable
+            candidates = np.flatnonzero(scores >= kth)
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.lexsort((candidates, -scores[candidates]))][:k]
+
+    def _rank(self,
+              query: str,
+              query_embedding: np.ndarray,
+              snapshot: _Snapshot,
+              top_k: int,
+              exact: bool = False) -> List[Tuple[int, float]]:
+        """
+        (row, score) pairs above the similarity threshold, best first
+
+        With a trained IVF index only the rows of the closest lists are scored,
+        re-ranked exactly with the same boosts, and then cut at the similarity
+        threshold (fewer than top_k results above it is a valid answer, not a
+        miss). When the probed lists hold fewer than top_k rows, nprobe is
+        doubled and the probe retried. Only once every list would be probed
+        is the whole matrix scanned.
+        """
+        if not exact and snapshot.ann is not None and snapshot.ann_lists is not None:
+            needed = min(top_k, len(snapshot.property_data))
+            nprobe = self.index_config['nprobe']
+            widened = False
+            while nprobe < snapshot.ann.nlist:
+                lists = snapshot.ann.probe(query_embedding, nprobe)
+                rows = gather_candidates(*snapshot.ann_lists, lists)
+                if len(rows) >= needed:
+                    self._count("ann_queries")
+                    if widened:
+                        self._count("widened_queries")
+                    scores = self._score(query, query_embedding, snapshot, rows)
+                    return [(int(rows[i]), float(scores[i])) for i in self._top_k(scores, top_k)
+                            if scores[i] >= VECTOR_SIMILARITY_THRESHOLD]
+                # cluster ที่ probe มีแถวไม่พอ top_k: ขยายจำนวน cluster แล้วลองใหม่
+                nprobe *= 2
+                widened = True
+            self._count("exact_fallbacks")
+
+        # Exact: คำนวณทุกแถว
+        scores = self._score(query, query_embedding, snapshot)
+        return [(int(i), float(scores[i])) for i in self._top_k(scores, top_k)
+                if scores[i] >= VECTOR_SIMILARITY_THRESHOLD]
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """
+        Canonical form of a query used for cache keys (collapsed whitespace)
+        """
+        return " ".join(query.split())
+
+    def _encode_query(self, query: str) -> np.ndarray:
+        """
+        Normalized query embedding, served from the LRU cache when possible
+        """
+        embedding = self.query_embedding_cache.get(query)
+        if embedding is None:
+            embedding = self._encode([query])[0]
+            self.query_embedding_cache.put(query, embedding)
+        return embedding
+
+    def _prepare_search(self, query: str, top_k: int) -> Tuple[str, _Snapshot, Tuple, Optional[List[Dict[str, Any]]]]:
+        """
+        Normalize the query, take an index snapshot and check the result cache
+        """
+        query = self.normalize_query(query)
+
+        # อ่าน snapshot ของ index เพื่อไม่ให้ถูกแก้ไขระหว่างค้นหา
+        snapshot = self._snapshot()
+
+        # คำค้นหาที่ซ้ำกับ index เวอร์ชันเดิม ใช้ผลลัพธ์จาก cache ได้ทันที
+        cache_key = (query, top_k, snapshot.version)
+        cached = self.result_cache.get(cache_key) if snapshot.property_data else None
+        if cached is not None:
+            cached = [result.copy() for result in cached]
+        return query, snapshot, cache_key, cached
+
+    def _finish_search(self,
+                       query: str,
+                       query_embedding: np.ndarray,
+                       snapshot: _Snapshot,
+                       top_k: int,
+                       cache_key: Tuple) -> List[Dict[str, Any]]:
+        # Calculate similarities with property type and location boost,
+        # then filter by threshold and take top_k
+        results = []
+        for idx, sim in self._rank(query, query_embedding, snapshot, top_k):
+            result = snapshot.property_data[idx].copy()
+            result["similarity_score"] = sim
+            results.append(result)
+
+        # ไม่เก็บลง cache ถ้า index เปลี่ยนไประหว่างค้นหา
+        if snapshot.version == self.index_version:
+            self.result_cache.put(cache_key, [result.copy() for result in results])
+        return results
+
     def search(self, query: str, top_k: int = MAX_RESULTS) -> List[Dict[str, Any]]:
         """
         Search for properties similar to the query using real vector embeddings
         """
         try:
-            if not self.vectors or not self.property_data:
+            query, snapshot, cache_key, cached = self._prepare_search(query, top_k)
+
+            if not snapshot.property_data:
                 logger.warning("Vector store is empty")
                 return []
-                
-            # แยกตำแหน่งและประเภทจากประโยคค้นหา
-            target_location = self._extract_location(query)
-            target_property_type = self._extract_property_type(query)
+            if cached is not None:
+                return cached
             
             # Create query embedding using the model
-            query_embedding = self.model.encode(query, convert_to_numpy=True)
-            
-            # Calculate similarities with property type and location boost
-            similarities = []
-            for i, vec in enumerate(self.vectors):
-                # Cosine similarity
-                similarity = np.dot(query_embedding, vec) / (np.linalg.norm(query_embedding) * np.linalg.norm(vec))
-                
-                prop = self.property_data[i]
-                
-                # เพิ่มคะแนนให้กับประเภทที่ตรงกับคำค้นหา
-                if 'ประเภท' in prop:
-                    if target_property_type and prop['ประเภท'] == target_property_type:
-                        similarity *= 2.5  # เพิ่มน้ำหนักให้กับประเภทที่ตรงกัน
-                    elif prop['ประเภท'] in query:
-                        similarity *= 1.5  # เพิ่มน้ำหนักให้กับประเภทที่อยู่ในคำค้นหา
-                
-                # เพิ่มคะแนนให้กับตำแหน่งที่ตรงกับคำค้นหา
-                if 'ตำแหน่ง' in prop:
-                    if target_location and target_location in prop['ตำแหน่ง']:
-                        similarity *= 2.0  # เพิ่มน้ำหนักให้กับตำแหน่งที่ตรงกัน
-                    elif prop['ตำแหน่ง'] in query:
-                        similarity *= 2.3  # เพิ่มน้ำหนักให้กับตำแหน่งที่อยู่ในคำค้นหา
-                
-                similarities.append((i, similarity))
-                
-            # Sort by similarity (descending)
-            similarities.sort(key=lambda x: x[1], reverse=True)
+            query_embedding = self._encode_query(query)
             
-            # Filter by threshold and take top_k
-            results = []
-            for idx, sim in similarities[:top_k]:
-                if sim >= VECTOR_SIMILARITY_THRESHOLD:
-                    result = self.property_data[idx].copy()
-                    result["similarity_score"] = float(sim)
-                    results.append(result)
-                    
-            return results
+            return self._finish_search(query, query_embedding, snapshot, top_k, cache_key)
         except Exception as e:
             logger.error(f"Error searching vector store: {str(e)}")
             return []
+
+    async def search_async(self, query: str, top_k: int = MAX_RESULTS) -> List[Dict[str, Any]]:
+        """
+        Same as search(), but the query is encoded through the micro-batcher so
+        concurrent requests share one forward pass
+        """
+        try:
+            query, snapshot, cache_key, cached = self._prepare_search(query, top_k)
+
+            if not snapshot.property_data:
+                logger.warning("Vector store is empty")
+                return []
+            if cached is not None:
+                return cached
+
+            query_embedding = self.query_embedding_cache.get(query)
+            if query_embedding is None:
+                query_embedding = await self.embedding_batcher.encode(query)
+                self.query_embedding_cache.put(query, query_embedding)
+
+            return self._finish_search(query, query_embedding, snapshot, top_k, cache_key)
+        except Exception as e:
+            logger.error(f"Error searching vector store: {str(e)}")
+            return []
+
+    def check_encoder_parity(self, texts: List[str] = None) -> Dict[str, Any]:
+        """
+        Compare the active encoder with the SentenceTransformer reference
+
+        Defaults to a sample of indexed property texts. Loads the torch model
+        for the comparison, so run it offline or from an admin task rather
+        than on the request path.
+        """
+        if texts is None:
+            snapshot = self._snapshot()
+            texts = [self._get_property_text(prop) for prop in snapshot.property_data[:256]]
+        if not texts:
+            texts = load_parity_texts(EMBEDDING_ENCODER_CONFIG['parity_texts_file'])
+        self.load_encoder()
+        if self.encoder.backend == "torch":
+            return {"backend": "torch", "texts": len(texts), "min_cosine": 1.0, "mean_cosine": 1.0, "passed": True}
+        reference = SentenceTransformerEncoder(self.embedding_model_name)
+        result = check_parity(reference, self.encoder, texts, EMBEDDING_ENCODER_CONFIG['parity_tolerance'])
+        result["backend"] = self.encoder.backend
+        return result
+
+    def evaluate_recall(self, queries: List[str], top_k: int = MAX_RESULTS) -> float:
+        """
+        Fraction of exact top_k results that the ANN path also returns
+
+        Used as a regression check when tuning nlist/nprobe.
+        """
+        snapshot = self._snapshot()
+        if not queries or not snapshot.property_data:
+            return 1.0
+        embeddings = self._encode(queries)
+        hits = 0
+        total = 0
+        for query, embedding in zip(queries, embeddings):
+            expected = [idx for idx, _ in self._rank(query, embedding, snapshot, top_k, exact=True)]
+            got = {idx for idx, _ in self._rank(query, embedding, snapshot, top_k)}
+            hits += sum(1 for idx in expected if idx in got)
+            total += len(expected)
+        return hits / total if total else 1.0
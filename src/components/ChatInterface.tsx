@@ -342,8 +342,17 @@ export default function ChatInterface() {
   const [typingMessage, setTypingMessage] = useState("");
   const [currentTypingIndex, setCurrentTypingIndex] = useState(-1);
   const [isProcessing, setIsProcessing] = useState(false);
+  // seq สำหรับดึงข้อความที่เก่ากว่าจาก server (null = โหลดครบแล้ว)
+  const [olderBefore, setOlderBefore] = useState<number | null>(null);
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
+  const skipScrollRef = useRef(false);
 
   useEffect(() => {
+    // ไม่เลื่อนลงล่างเมื่อเพิ่มข้อความเก่าไว้ด้านบน
+    if (skipScrollRef.current) {
+      skipScrollRef.current = false;
+      return;
+    }
     scrollToBottom();
   }, [messages]);
 
@@ -407,6 +416,7 @@ export default function ChatInterface() {
 
   // ฟังก์ชันโหลดประวัติการสนทนาในห้อง
   const loadChatRoomHistory = async (roomId: string) => {
+    setOlderBefore(null);
     try {
       console.log("กำลังโหลดประวัติห้องสนทนา:", roomId);
       // ตรวจสอบก่อนว่ามีข้อมูลใน local state (useChats) หรือไม่
@@ -453,6 +463,7 @@ export default function ChatInterface() {
             
             console.log("โหลดประวัติจาก API สำเร็จ:", formattedMessages.length, "ข้อความ");
             setMessages(formattedMessages);
+            setOlderBefore(historyFromApi.next_before ?? null);
             toast.info(translate(
               `โหลดประวัติสนทนาจากเซิร์ฟเวอร์ (${formattedMessages.length} ข้อความ)`,
               `Loaded chat history from server (${formattedMessages.length} messages)`,
@@ -502,6 +513,33 @@ export default function ChatInterface() {
     }
   };
 
+  // โหลดข้อความหน้าที่เก่ากว่า (ประวัติแบ่งหน้าละ 50 ข้อความ) แล้วเพิ่มไว้ด้านบน
+  const loadOlderMessages = async () => {
+    if (!chatRoomId || olderBefore === null || isLoadingOlder) return;
+    setIsLoadingOlder(true);
+    try {
+      const page = await getChatRoomHistory(chatRoomId, olderBefore);
+      const olderMessages = page.messages.map(msg => ({
+        type: msg.role === "user" ? "user" : "assistant",
+        content: msg.content,
+        timestamp: new Date(msg.timestamp),
+        properties: msg.properties || []
+      } as Message));
+      skipScrollRef.current = olderMessages.length > 0;
+      setMessages((prev) => [...olderMessages, ...prev]);
+      setOlderBefore(page.next_before ?? null);
+    } catch (error) {
+      console.error("Error loading older messages:", error);
+      toast.error(translate(
+        errorMessages.loadHistoryFailed.thai,
+        errorMessages.loadHistoryFailed.english,
+        language
+      ));
+    } finally {
+      setIsLoadingOlder(false);
+    }
+  };
+
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
   };
@@ -944,6 +982,21 @@ export default function ChatInterface() {
     <div className="flex flex-col h-[calc(85vh-90px)]">
       <Card className="flex-1 overflow-hidden flex flex-col border-[#43BE98]">
         <div className="flex-1 overflow-y-auto p-4 space-y-4">
+          {olderBefore !== null && (
+            <div className="flex justify-center">
+              <Button
+                type="button"
+                variant="outline"
+                size="sm"
+                onClick={loadOlderMessages}
+                disabled={isLoadingOlder}
+                className="border-[#43BE98]"
+              >
+                {isLoadingOlder && <Loader className="h-4 w-4 animate-spin mr-2" />}
+                {translate("โหลดข้อความก่อนหน้า", "Load older messages", language)}
+              </Button>
+            </div>
+          )}
           {messages.map((message, index) => (
             <div
               key={index}
@@ -103,7 +103,11 @@ export default function FileUploader() {
       
       setUploadStatus("success");
       toast.success(response.message || "อัปโหลดไฟล์สำเร็จ");
-      toast.info(`นำเข้าข้อมูล ${response.num_records} รายการ`);
+      if (response.status === "queued" || response.status === "running") {
+        toast.info(`ยังนำเข้าข้อมูลไม่เสร็จ (นำเข้าแล้ว ${response.num_records} รายการ) ตรวจสอบสถานะได้ด้วยรหัสงาน ${response.job_id}`);
+      } else {
+        toast.info(`นำเข้าข้อมูล ${response.num_records} รายการ`);
+      }
     } catch (error) {
       console.error("Error uploading file:", error);
       setUploadStatus("error");
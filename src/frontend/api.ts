@@ -4,6 +4,9 @@
 
 // Base URL for API calls
 const API_BASE_URL = 'http://localhost:8000/api';
+// รอ job นำเข้าไฟล์ได้นานสุดเท่านี้ (ถ้า worker ที่ถือ job ล่ม job จะค้างเป็น running จนกว่าจะ restart)
+const UPLOAD_JOB_MAX_WAIT_MS = 10 * 60 * 1000;
+const UPLOAD_JOB_POLL_MS = 1000;
 
 // Types
 export interface PropertyQuery {
@@ -14,6 +17,8 @@ export interface PropertyQuery {
   save_message?: boolean;
   timestamp?: number;
   get_history?: boolean;
+  history_before?: number;
+  history_limit?: number;
   language?: string;
   user_id?: string;
 }
@@ -29,6 +34,7 @@ export interface ChatResponse {
     timestamp: number;
     properties?: Array<Record<string, string>>;
   }>;
+  next_before?: number | null;
 }
 
 export interface ChatHistory {
@@ -39,12 +45,38 @@ export interface ChatHistory {
     timestamp: number;
     properties?: Array<Record<string, string>>;
   }>;
+  // seq ของข้อความที่เก่าที่สุดในหน้านี้ ใช้ดึงหน้าถัดไป (null = ไม่มีข้อความเก่ากว่านี้แล้ว)
+  next_before?: number | null;
 }
 
 export interface UploadResponse {
   message: string;
   file_id: string;
+  // 0 ในคำตอบของ /upload (นำเข้าใน background); uploadPropertyFile เติมจำนวนจริงหลัง job เสร็จ
+  // (หรือจำนวนที่นำเข้าแล้ว ถ้าเลิกรอก่อน job เสร็จ: status ยังเป็น queued/running)
   num_records: number;
+  job_id?: string;
+  status?: string;
+}
+
+export interface UploadJob {
+  job_id: string;
+  file_id: string;
+  filename: string;
+  status: "queued" | "running" | "completed" | "completed_with_errors" | "failed";
+  chunks: number;
+  rows_processed: number;
+  rows_inserted: number;
+  rows_updated: number;
+  rows_unchanged: number;
+  rows_duplicate: number;
+  rows_failed: number;
+  total_rows?: number | null;
+  rows_per_second?: number | null;
+  eta_seconds?: number | null;
+  errors: { chunk: number; rows: number; error: string }[];
+  error?: string | null;
+  resumed: number;
 }
 
 export interface ConsultationStyles {
@@ -128,7 +160,7 @@ export const sendChatMessage = async (queryData: PropertyQuery): Promise<ChatRes
 /**
  * Get chat history for a specific chat room
  */
-export const getChatRoomHistory = async (chatRoomId: string): Promise<ChatHistory> => {
+export const getChatRoomHistory = async (chatRoomId: string, before?: number): Promise<ChatHistory> => {
   try {
     // เปลี่ยนเป็น POST request ด้วย flag get_history
     const response = await fetch(`${API_BASE_URL}/chat`, {
@@ -141,6 +173,7 @@ export const getChatRoomHistory = async (chatRoomId: string): Promise<ChatHistor
         chat_room_id: chatRoomId,
         query: '',  // ส่ง query ว่างเพื่อบ่งชี้ว่าต้องการเรียกประวัติ
         get_history: true,  // flag สำหรับบอก backend ว่าต้องการดึงประวัติ
+        history_before: before,
         consultation_style: localStorage.getItem("consultationStyle") || "formal",
         user_id: JSON.parse(localStorage.getItem("user") || "{}")?.id
       }),
@@ -166,7 +199,8 @@ export const getChatRoomHistory = async (chatRoomId: string): Promise<ChatHistor
     
     return {
       chat_room_id: chatRoomId,
-      messages: data.messages
+      messages: data.messages,
+      next_before: data.next_before ?? null
     };
   } catch (error) {
     console.error('Error fetching chat history:', error);
@@ -200,14 +234,41 @@ export const uploadPropertyFile = async (
       throw new Error(`API error: ${response.status} - ${errorText}`);
     }
 
-    const data = await response.json();
-    return data;
+    const data: UploadResponse = await response.json();
+    if (!data.job_id) {
+      return data;
+    }
+
+    // ไฟล์ถูกนำเข้าใน background: รอจนกว่า job จะเสร็จ หรือจนครบเวลาที่กำหนด
+    // ถ้ายังไม่เสร็จ คืน status ล่าสุด (queued/running) พร้อม job_id ให้ผู้เรียกติดตามผลต่อเอง
+    const deadline = Date.now() + UPLOAD_JOB_MAX_WAIT_MS;
+    let job = await getUploadJob(data.job_id);
+    while ((job.status === 'queued' || job.status === 'running') && Date.now() < deadline) {
+      await new Promise((resolve) => setTimeout(resolve, UPLOAD_JOB_POLL_MS));
+      job = await getUploadJob(data.job_id);
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'Ingestion failed');
+    }
+    return { ...data, status: job.status, num_records: job.rows_inserted + job.rows_updated + job.rows_unchanged };
   } catch (error) {
     console.error('Error uploading file:', error);
     throw new Error('Failed to upload file. Please try again.');
   }
 };
 
+/**
+ * Get the progress of an upload ingestion job
+ */
+export const getUploadJob = async (jobId: string): Promise<UploadJob> => {
+  const response = await fetch(`${API_BASE_URL}/upload/jobs/${jobId}`);
+  if (!response.ok) {
+    const errorText = await response.text();
+    throw new Error(`API error: ${response.status} - ${errorText}`);
+  }
+  return response.json();
+};
+
 /**
  * Get available consultation styles
  */